@@ -357,14 +357,9 @@ class rbspFp(object):
 		import tsyganenko as ts
 		import numpy as np
 
-		fname = 'trace.{:%Y%m%d}.{:%Y%m%d}.dat'.format(self.sTime, self.eTime)
-		try:
-			trace = ts.tsygTrace(filename=fname)
-			print 'Read tracing results...'
-		except:
-			print 'Tracing...'
-			trace = ts.tsygTrace(data['lat'], data['lon'], data['alt'], datetime=data['time'], rmin=1.047)
-			trace.save( fname )
+		# Traces are cached by their inputs, footpoints only
+		cache = ts.traceCache(lines=False)
+		trace = ts.tsygTrace(data['lat'], data['lon'], data['alt'], datetime=data['time'], rmin=1.047, nProcs=None, cache=cache)
 
 		self.lonNH = trace.lonNH
 		self.latNH = trace.latNH
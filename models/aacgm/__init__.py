@@ -2,8 +2,110 @@
 *********************
 **Module**: models.aacgm
 *********************
+
+**Functions**:
+  * :func:`models.aacgm.aacgmConvNp`: convert numpy arrays to/from aacgm
+  * :func:`models.aacgm.aacgmCacheWarm`: load coefficient epochs ahead of use
+  * :func:`models.aacgm.aacgmCacheInfo`: report coefficient loads and epoch switches
+  * :func:`models.aacgm.aacgmConvFast`: approximate conversion from cached lookup grids
+  * :func:`models.aacgm.mltFromEpochNp`: MLT for arrays of epoch times and magnetic longitudes
+
+**Modules**:
+  * :mod:`models.aacgm.aacgmGrid`: precomputed lookup grids for fast conversions
+
+Coefficient sets are parsed once per 5-year epoch and stay resident, so
+alternating between years does not re-read the coefficient files.
 """
 try:
     from aacgm import *
 except Exception, e:
     print __file__+' -> aacgm: ', e
+
+try:
+    from aacgmGrid import aacgmGrid, aacgmConvFast
+except Exception, e:
+    print __file__+' -> aacgmGrid: ', e
+
+
+def aacgmConvNp(lat, lon, height, year, flg, out=None, nThreads=1):
+  """
+Convert arrays of coordinates to/from aacgm in a single call.
+
+The conversion runs in C on whole float64 arrays with the GIL released, so it
+can also be spread over python threads. Each call converts with its own copy
+of the coefficients for year, so concurrent calls for other years (or scalar
+aacgmConv calls) do not affect it.
+
+* **INPUTS**:
+  * **lat**: latitude [degree] (scalar or array)
+  * **lon**: longitude [degree] (scalar or array)
+  * **height**: altitude [km] (scalar or array)
+  * **year**: year of the coefficients to use
+  * **flg**: 0 for geo to aacgm, 1 for aacgm to geo
+  * **[out]**: tuple of 3 C-contiguous float64 arrays shaped like the
+    broadcast inputs which receive (lat, lon, r). These may be the input
+    arrays themselves for an in-place conversion.
+  * **[nThreads]**: number of threads used to split large arrays
+
+* **OUTPUTS**:
+  * **lat, lon, r**: arrays shaped like the broadcast inputs. Points which
+    could not be converted are set to NaN.
+
+  """
+  import numpy as np
+
+  height = np.asarray(height, dtype='float64')
+  lat, lon = np.broadcast_arrays(
+      np.asarray(lat, dtype='float64'), np.asarray(lon, dtype='float64'))
+  if height.size != 1:
+    lat, lon, height = np.broadcast_arrays(lat, lon, height)
+  shape = lat.shape
+  if out is None:
+    out = tuple(np.empty(shape, dtype='float64') for i in range(3))
+  elif len(out) != 3 or any(o.shape != shape or o.dtype != np.float64 or 
+      not o.flags['C_CONTIGUOUS'] for o in out):
+    raise ValueError('out must hold 3 C-contiguous float64 arrays of '
+        'shape {}'.format(shape))
+
+  # a single height is passed as is, everything else as flat contiguous
+  # arrays (a no-op for arrays which already are)
+  lat = np.ascontiguousarray(lat).reshape(-1)
+  lon = np.ascontiguousarray(lon).reshape(-1)
+  height = np.ascontiguousarray(height).reshape(-1)
+
+  aacgmConvBuf(lat, lon, height,
+      out[0].reshape(-1), out[1].reshape(-1), out[2].reshape(-1),
+      int(year), int(flg), int(nThreads))
+
+  return out
+
+
+def mltFromEpochNp(epoch, mLon):
+  """
+Calculate MLT for arrays of epoch times and magnetic longitudes.
+
+The magnetic longitude of the subsolar point is computed once per unique
+epoch (in time order, as repeated calls to mltFromEpoch would), so annotating
+every beam or record of a long interval costs one solar computation per time
+step.
+
+* **INPUTS**:
+  * **epoch**: seconds since 1970-01-01 (scalar or array)
+  * **mLon**: aacgm longitude [degree] (scalar or array)
+
+* **OUTPUTS**:
+  * **mlt**: magnetic local time [hours], shaped like the broadcast inputs
+
+  """
+  import numpy as np
+
+  epoch, mLon = np.broadcast_arrays(np.asarray(epoch, dtype='float64'),
+      np.asarray(mLon, dtype='float64'))
+  uEpoch, inv = np.unique(epoch, return_inverse=True)
+  mslon = np.empty(uEpoch.shape, dtype='float64')
+  mltMagSolarLonBuf(np.ascontiguousarray(uEpoch), mslon)
+
+  mlt = (mLon - mslon[inv].reshape(epoch.shape))/15. + 12.
+  mlt = np.where(mlt >= 24., mlt - 24., mlt)
+  mlt = np.where(mlt < 0., mlt + 24., mlt)
+  return mlt
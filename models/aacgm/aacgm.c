@@ -37,6 +37,7 @@
 #include <math.h>
 
 #include "default.h"
+#include "aacgm.h"
 #include "convert_geo_coord.h"
 
 
@@ -44,7 +45,23 @@ extern struct {
         double coef[121][3][5][2];
 } sph_harm_model;
 
-int AACGMLoadCoefFP(FILE *fp){
+/* Parsed coefficient sets are kept for every epoch that has been used,
+   so switching between years only copies a resident set into
+   sph_harm_model instead of reading and parsing the file again. */
+
+#define AACGM_MAX_EPOCH 64
+
+struct AACGMCoefSet {
+    int year;
+    double coef[121][3][5][2];
+};
+
+static struct AACGMCoefSet *coef_cache[AACGM_MAX_EPOCH];
+static int coef_cache_num=0;
+static int coef_current=-1;
+static struct AACGMCacheStats cache_stats={0,0,0};
+
+static int AACGMParseCoef(FILE *fp,double coef[121][3][5][2]) {
     char tmp[64];
     int f,l,a,t,i;
     if(fp==NULL) return -1;
@@ -52,13 +69,10 @@ int AACGMLoadCoefFP(FILE *fp){
         for(l=0;l<5;l++){
             for(a=0;a<3;a++){ 
                 for(t=0;t<121;t++){
-                    if(fscanf(fp,"%s",tmp) !=1){
-                        fclose(fp);
-                        return -1;
-                    }
+                    if(fscanf(fp,"%63s",tmp) !=1) return -1;
                     for (i=0;(tmp[i] !=0) && (tmp[i] !='D');i++);
                     if (tmp[i]=='D') tmp[i]='e';
-                    sph_harm_model.coef[t][a][l][f]=atof(tmp);
+                    coef[t][a][l][f]=atof(tmp);
                 }
             }
         }
@@ -66,28 +80,115 @@ int AACGMLoadCoefFP(FILE *fp){
     return 0;
 }
 
+int AACGMLoadCoefFP(FILE *fp){
+    if(fp==NULL) return -1;
+    /* sph_harm_model no longer matches any cached epoch */
+    coef_current=-1;
+    if (AACGMParseCoef(fp,sph_harm_model.coef) !=0) {
+        fclose(fp);
+        return -1;
+    }
+    return 0;
+}
+
 
 
 int AACGMLoadCoef(char *fname) {
     FILE *fp;
     fp=fopen(fname,"r");
     if (fp==NULL) return -1;
-    AACGMLoadCoefFP(fp);
+    if (AACGMLoadCoefFP(fp) !=0) return -1;
     fclose(fp);
     return 0;
 }
 
-int AACGMInit(int year) {
+static struct AACGMCoefSet *AACGMCacheFind(int year) {
+    int i;
+    for (i=0;i<coef_cache_num;i++)
+        if (coef_cache[i]->year==year) return coef_cache[i];
+    return NULL;
+}
+
+int AACGMCacheLoad(int year) {
     char fname[256];
     char yrstr[32];  
+    char *prefix;
+    FILE *fp;
+    struct AACGMCoefSet *set;
     if (year==0) year=DEFAULT_YEAR;
     year=(year/5)*5;
+    if (AACGMCacheFind(year) !=NULL) return 0;
+    if (coef_cache_num>=AACGM_MAX_EPOCH) return -1;
+    prefix=getenv("AACGM_DAVITPY_DAT_PREFIX");
+    if ((prefix==NULL) || (strlen(prefix)==0) ||
+        (strlen(prefix)>sizeof(fname)-16)) return -1;
     sprintf(yrstr,"%4.4d",year); 
-    strcpy(fname,getenv("AACGM_DAVITPY_DAT_PREFIX"));
-    if (strlen(fname)==0) return -1;
+    strcpy(fname,prefix);
     strcat(fname,yrstr);
     strcat(fname,".asc");
-    return AACGMLoadCoef(fname);
+    fp=fopen(fname,"r");
+    if (fp==NULL) return -1;
+    set=malloc(sizeof(struct AACGMCoefSet));
+    if (set==NULL) {
+        fclose(fp);
+        return -1;
+    }
+    if (AACGMParseCoef(fp,set->coef) !=0) {
+        fclose(fp);
+        free(set);
+        return -1;
+    }
+    fclose(fp);
+    set->year=year;
+    coef_cache[coef_cache_num++]=set;
+    cache_stats.loads++;
+    return 0;
+}
+
+int AACGMInit(int year) {
+    struct AACGMCoefSet *set;
+    if (year==0) year=DEFAULT_YEAR;
+    year=(year/5)*5;
+    if (year==coef_current) {
+        cache_stats.hits++;
+        return 0;
+    }
+    if (AACGMCacheLoad(year) !=0) return -1;
+    set=AACGMCacheFind(year);
+    memcpy(sph_harm_model.coef,set->coef,sizeof(set->coef));
+    coef_current=year;
+    cache_stats.switches++;
+    return 0;
+}
+
+/* Copies the coefficients of an epoch for a conversion which must not
+   read sph_harm_model, since another thread may switch it meanwhile */
+
+int AACGMInitCopy(int year,double coef[121][3][5][2]) {
+    int err;
+    err=AACGMInit(year);
+    memcpy(coef,sph_harm_model.coef,sizeof(sph_harm_model.coef));
+    return err;
+}
+
+int AACGMCacheEpochs(int *years,int max) {
+    int i;
+    for (i=0;(i<coef_cache_num) && (i<max);i++) years[i]=coef_cache[i]->year;
+    return coef_cache_num;
+}
+
+void AACGMCacheGetStats(struct AACGMCacheStats *stats) {
+    *stats=cache_stats;
+}
+
+void AACGMCacheClear(void) {
+    int i;
+    for (i=0;i<coef_cache_num;i++) free(coef_cache[i]);
+    coef_cache_num=0;
+    coef_current=-1;
+    cache_stats.loads=0;
+    cache_stats.switches=0;
+    cache_stats.hits=0;
 }
 
 int AACGMConvert(double in_lat,double in_lon,double height,
@@ -100,6 +201,18 @@ int AACGMConvert(double in_lat,double in_lon,double height,
      return 0;
 }
 
+int AACGMConvert_r(struct convert_geo_state *state,
+                   double in_lat,double in_lon,double height,
+                   double *out_lat,double *out_lon,double *r,
+                   int flag){
+     int err;
+     err=convert_geo_coord_r(state,in_lat,in_lon,height,
+                             out_lat,out_lon,flag,10);
+     *r=1.0;
+     if (err !=0) return -1;
+     return 0;
+}
+
          
 
 
@@ -34,12 +34,29 @@
 #ifndef _AACGM_H
 #define _AACGM_H
 
+struct AACGMCacheStats {
+  int loads;     /* coefficient files read and parsed */
+  int switches;  /* epoch changes served from the cache */
+  int hits;      /* AACGMInit calls for the epoch already in use */
+};
+
 int AACGMLoadCoefFP(FILE  *fp);
 int AACGMLoadCoef(char *fname);
 int AACGMInit(int year);
+int AACGMInitCopy(int year,double coef[121][3][5][2]);
+int AACGMCacheLoad(int year);
+int AACGMCacheEpochs(int *years,int max);
+void AACGMCacheGetStats(struct AACGMCacheStats *stats);
+void AACGMCacheClear(void);
 int AACGMConvert(double in_lat,double in_lon,double height,
               double *out_lat,double *out_lon,double *r,
               int flag);
+
+struct convert_geo_state;
+int AACGMConvert_r(struct convert_geo_state *state,
+              double in_lat,double in_lon,double height,
+              double *out_lat,double *out_lon,double *r,
+              int flag);
 #endif
 
 
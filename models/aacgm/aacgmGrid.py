@@ -0,0 +1,295 @@
+# Copyright (C) 2012  VT SuperDARN Lab
+# Full license can be found in LICENSE.txt
+"""
+*********************
+**Module**: models.aacgm.aacgmGrid
+*********************
+Fast approximate AACGM conversion from precomputed lookup grids
+
+For plotting (coastlines, grids) the full spherical harmonic expansion is
+overkill. A :class:`aacgmGrid` samples the exact conversion once on a regular
+lat/lon grid for a given epoch, altitude and direction, saves it to disk and
+then converts any number of points by bilinear (order=1) or bicubic
+(order=3) interpolation. Points falling next to grid nodes where the exact
+routine is undefined are converted exactly.
+
+**Classes**:
+  * :class:`models.aacgm.aacgmGrid.aacgmGrid`: lookup grid for one epoch/altitude/direction
+
+**Functions**:
+  * :func:`models.aacgm.aacgmGrid.aacgmConvFast`: convert arrays using cached lookup grids
+
+"""
+
+# grids already built or loaded in this process
+_grids = {}
+
+# earth radius [km] used by the AACGM altitude adjustment
+_eRadius = 6371.2
+
+
+class aacgmGrid(object):
+  """A geographic to AACGM (or inverse) lookup grid.
+
+  **Args**:
+    * **year** (int): year of the coefficients (rounded to its 5-year epoch)
+    * **[height]** (float): altitude [km]
+    * **[flg]** (int): 0 for geo to aacgm, 1 for aacgm to geo
+    * **[res]** (float): grid resolution [degree]
+    * **[order]** (int): 1 for bilinear, 3 for bicubic interpolation
+    * **[cacheDir]** (str): where grids are saved (defaults to $DAVIT_TMPDIR/aacgm or /tmp/sd/aacgm)
+    * **[nCheck]** (int): number of random points used to estimate the error against the exact routine
+  **Members**:
+    * **lat, lon** (ndarray): grid node coordinates [degree]
+    * **latOut, lonOut** (ndarray): exact conversion at each node (NaN where undefined)
+    * **maxError, rmsError** (float): great-circle error [degree] of the
+      interpolation against :func:`models.aacgm.aacgmConvNp` over nCheck random points
+  **Example**:
+    ::
+
+      grid = aacgmGrid(2012, height=0., flg=0)
+      mlat, mlon = grid.convert(glat, glon)
+      print grid.maxError
+
+  """
+
+  def __init__(self, year, height=0., flg=0, res=0.5, order=1,
+      cacheDir=None, nCheck=10000):
+    import os
+    import numpy as np
+
+    self.epoch = (int(year)//5)*5
+    self.height = float(height)
+    self.flg = int(flg)
+    self.res = float(res)
+    self.order = int(order)
+
+    if cacheDir is None:
+      try: cacheDir = os.path.join(os.environ['DAVIT_TMPDIR'], 'aacgm')
+      except KeyError: cacheDir = '/tmp/sd/aacgm'
+    self.fileName = os.path.join(cacheDir,
+        'aacgmGrid_{:04d}_{:.1f}km_flg{}_{:g}deg.npz'.format(
+        self.epoch, self.height, self.flg, self.res))
+
+    if os.path.isfile(self.fileName):
+      with np.load(self.fileName) as npz:
+        self.lat, self.lon = npz['lat'], npz['lon']
+        self.latOut, self.lonOut = npz['latOut'], npz['lonOut']
+    else:
+      self._build()
+      if not os.path.exists(cacheDir): os.makedirs(cacheDir)
+      np.savez_compressed(self.fileName, lat=self.lat, lon=self.lon,
+          latOut=self.latOut, lonOut=self.lonOut)
+
+    self._prepare()
+    self.maxError, self.rmsError = self.checkError(nCheck)
+
+
+  def __str__(self):
+    return ('aacgmGrid: epoch {}, {} km, flg {}, {} deg, order {}\n'
+        '  max error {:.4f} deg, rms error {:.4f} deg').format(
+        self.epoch, self.height, self.flg, self.res, self.order,
+        self.maxError, self.rmsError)
+
+
+  def _build(self):
+    """Evaluate the exact conversion at every grid node"""
+    import numpy as np
+    from models import aacgm
+
+    self.lat = np.arange(-90., 90.+self.res/2., self.res)
+    self.lon = np.arange(0., 360.+self.res/2., self.res)
+    glon, glat = np.meshgrid(self.lon, self.lat)
+    self.latOut, self.lonOut, _ = aacgm.aacgmConvNp(glat, glon, self.height,
+        self.epoch, self.flg)
+
+
+  def _prepare(self):
+    """Set up the arrays actually interpolated.
+
+    The output points are interpolated as unit vectors, which avoids the
+    360 degree wrap and is smooth at the AACGM poles. Above the ground the
+    AACGM latitudes jump across the magnetic equator, so geo to aacgm grids
+    interpolate the latitude before its altitude adjustment, which is then
+    applied to the result (see altitude_to_cgm.c).
+
+    Undefined nodes are flagged (and widened by the interpolation stencil)
+    so that points depending on them fall back to the exact routine. For
+    bicubic interpolation they are first filled from their neighbours, so
+    that the spline prefilter does not spread errors over the good nodes.
+    """
+    import numpy as np
+    from scipy import ndimage
+
+    bad = ~(np.isfinite(self.latOut) & np.isfinite(self.lonOut))
+    latOut = np.where(bad, 0., self.latOut)
+    if self.flg == 0:
+      latOut = np.sign(latOut)*np.degrees(np.arccos(np.minimum(1.,
+          np.cos(np.radians(latOut))*np.sqrt(self.height/_eRadius + 1.))))
+
+    rlat = np.radians(latOut)
+    rlon = np.radians(np.where(bad, 0., self.lonOut))
+    fields = [np.sin(rlat), np.cos(rlat)*np.cos(rlon), np.cos(rlat)*np.sin(rlon)]
+    if self.order > 1:
+      if bad.any() and not bad.all():
+        fields = self._fill(fields, bad)
+      bad = ndimage.binary_dilation(bad, iterations=2)
+
+    # extend the grid over the poles and around in longitude, so that the
+    # spline prefilter and the interpolation stencil see the neighbours
+    # each node actually has on the sphere
+    self._pad = 3
+    wide = 8*self._pad if self.order > 1 else self._pad
+    fields = [self._extend(f, wide) for f in fields]
+    if self.order > 1:
+      fields = [ndimage.spline_filter(f, order=self.order) for f in fields]
+    c = wide - self._pad
+    self._fields = [f[c:f.shape[0]-c, c:f.shape[1]-c] for f in fields]
+    self._bad = self._extend(bad, self._pad).astype('float64')
+
+
+  def _extend(self, f, n):
+    """Add n rows beyond each pole and n columns on each side in longitude.
+
+    The last column repeats lon=0 and is dropped. Beyond a pole, row k is
+    row -k shifted by 180 degrees of longitude (when the grid ends on the
+    pole, otherwise the edge row is repeated).
+    """
+    import numpy as np
+
+    f = f[:, :-1]
+    nLon = f.shape[1]
+    half = int(round(180./self.res))
+    if nLon == 2*half and abs(self.lat[0] + 90.) < 1e-9:
+      bottom = np.roll(f[n:0:-1], half, axis=1)
+    else:
+      bottom = np.repeat(f[:1], n, axis=0)
+    if nLon == 2*half and abs(self.lat[-1] - 90.) < 1e-9:
+      top = np.roll(f[-2:-n-2:-1], half, axis=1)
+    else:
+      top = np.repeat(f[-1:], n, axis=0)
+    f = np.concatenate([bottom, f, top])
+    return np.pad(f, ((0, 0), (n, n)), mode='wrap')
+
+
+  @staticmethod
+  def _fill(fields, bad, nIter=50):
+    """Fill flagged nodes with the nearest good node, then relax them
+    towards the mean of their neighbours"""
+    import numpy as np
+    from scipy import ndimage
+
+    inx = ndimage.distance_transform_edt(bad, return_distances=False,
+        return_indices=True)
+    fields = [f[tuple(inx)] for f in fields]
+    for f in fields:
+      for i in range(nIter):
+        p = np.pad(f, 1, mode='edge')
+        p[1:-1, 0], p[1:-1, -1] = f[:, -2], f[:, 1]
+        f[bad] = 0.25*(p[:-2, 1:-1] + p[2:, 1:-1] + p[1:-1, :-2] + 
+            p[1:-1, 2:])[bad]
+    return fields
+
+
+  def _interp(self, lat, lon):
+    """Interpolate the grid, returns (lat, lon, needsExact)"""
+    import numpy as np
+    from scipy import ndimage
+
+    coords = np.array([(lat - self.lat[0])/self.res + self._pad,
+        np.mod(lon, 360.)/self.res + self._pad])
+    kw = dict(order=self.order, mode='nearest', prefilter=False)
+    z, x, y = [ndimage.map_coordinates(f, coords, **kw) for f in self._fields]
+    latOut = np.degrees(np.arctan2(z, np.hypot(x, y)))
+    lonOut = np.degrees(np.arctan2(y, x))
+    if self.flg == 0:
+      latOut = np.sign(latOut)*np.degrees(np.arccos(np.sqrt(np.cos(
+          np.radians(latOut))**2/(self.height/_eRadius + 1.))))
+    bad = ndimage.map_coordinates(self._bad, coords, order=1,
+        mode='nearest') > 0.
+    bad |= ~(np.isfinite(lat) & np.isfinite(lon))
+    return latOut, lonOut, bad
+
+
+  def convert(self, lat, lon, exactFallback=True):
+    """Convert coordinates using the grid.
+
+    **Args**:
+      * **lat, lon**: coordinates [degree] (scalars or arrays of any shape)
+      * **[exactFallback]** (bool): use the exact routine where the grid
+        cannot be trusted, otherwise return NaN there
+    **Returns**:
+      * **latOut, lonOut**: converted coordinates, shaped like the inputs
+
+    """
+    import numpy as np
+    from models import aacgm
+
+    lat, lon = np.broadcast_arrays(np.asarray(lat, dtype='float64'),
+        np.asarray(lon, dtype='float64'))
+    shape = lat.shape
+    lat, lon = lat.ravel(), lon.ravel()
+    latOut, lonOut, bad = self._interp(lat, lon)
+    if bad.any():
+      if exactFallback:
+        latOut[bad], lonOut[bad], _ = aacgm.aacgmConvNp(lat[bad], lon[bad],
+            self.height, self.epoch, self.flg)
+      else:
+        latOut[bad], lonOut[bad] = np.nan, np.nan
+    return latOut.reshape(shape), lonOut.reshape(shape)
+
+
+  def checkError(self, nCheck=10000, seed=0):
+    """Compare the interpolation against the exact routine.
+
+    **Args**:
+      * **[nCheck]** (int): number of random points (uniform on the sphere)
+      * **[seed]** (int): random seed, so that the estimate is reproducible
+    **Returns**:
+      * **maxError, rmsError** (float): great-circle distance [degree]
+
+    """
+    import numpy as np
+    from models import aacgm
+
+    if nCheck <= 0: return np.nan, np.nan
+    rnd = np.random.RandomState(seed)
+    lat = np.degrees(np.arcsin(rnd.uniform(-1., 1., nCheck)))
+    lon = rnd.uniform(0., 360., nCheck)
+    exLat, exLon, _ = aacgm.aacgmConvNp(lat, lon, self.height,
+        self.epoch, self.flg)
+    apLat, apLon = self.convert(lat, lon, exactFallback=False)
+    good = np.isfinite(exLat) & np.isfinite(apLat)
+    if not good.any(): return np.nan, np.nan
+    exLat, exLon = np.radians(exLat[good]), np.radians(exLon[good])
+    apLat, apLon = np.radians(apLat[good]), np.radians(apLon[good])
+    cosd = np.sin(exLat)*np.sin(apLat) + \
+        np.cos(exLat)*np.cos(apLat)*np.cos(exLon - apLon)
+    err = np.degrees(np.arccos(np.clip(cosd, -1., 1.)))
+    return err.max(), np.sqrt(np.mean(err**2))
+
+
+def aacgmConvFast(lat, lon, height, year, flg, res=0.5, order=1,
+    cacheDir=None):
+  """Convert to/from AACGM using a cached lookup grid.
+
+  Grids are built (or read from disk) on first use for each
+  (epoch, height, flg, res, order) and kept for the rest of the session.
+
+  **Args**:
+    * **lat, lon**: coordinates [degree] (scalars or arrays)
+    * **height** (float): altitude [km] (a single value)
+    * **year** (int): year of the coefficients
+    * **flg** (int): 0 for geo to aacgm, 1 for aacgm to geo
+    * **[res]** (float): grid resolution [degree]
+    * **[order]** (int): 1 for bilinear, 3 for bicubic interpolation
+    * **[cacheDir]** (str): where grids are saved
+  **Returns**:
+    * **latOut, lonOut**: converted coordinates, shaped like the inputs
+
+  """
+  key = ((int(year)//5)*5, float(height), int(flg), float(res), int(order))
+  if key not in _grids:
+    _grids[key] = aacgmGrid(year, height=height, flg=flg, res=res,
+        order=order, cacheDir=cacheDir)
+  return _grids[key].convert(lat, lon)
@@ -7,8 +7,10 @@
 #include <string.h>
 #include <fcntl.h>
 #include <math.h>
+#include <pthread.h>
 #include "rtime.h"
 #include "aacgm.h"
+#include "convert_geo_coord.h"
 #include "mlt.h"
 #include "AstAlg.h"
 
@@ -16,6 +18,10 @@
   typedef int Py_ssize_t;
 #endif
 
+/* smallest number of points handed to a single worker thread */
+#define AACGM_MIN_CHUNK 2048
+#define AACGM_MAX_THREADS 64
+
 static PyObject *
 aacgm_wrap(PyObject *self, PyObject *args)
 {
@@ -84,6 +90,215 @@ aacgm_arr_wrap(PyObject *self, PyObject *args)
     }
     
 }
+struct aacgm_chunk {
+    const double *lat, *lon, *height;
+    double *latOut, *lonOut, *rOut;
+    Py_ssize_t nHeight, start, stop;
+    int flg;
+    double (*coef)[3][5][2];
+    Py_ssize_t nFail;
+};
+
+static void *
+aacgm_chunk_run(void *arg)
+{
+    struct aacgm_chunk *c = (struct aacgm_chunk *) arg;
+    struct convert_geo_state state;
+    double inlon, height, outLat, outLon, r;
+    Py_ssize_t i;
+
+    convert_geo_state_init(&state);
+    state.coef = c->coef;
+    c->nFail = 0;
+    for (i=c->start; i<c->stop; i++) {
+        inlon = fmod(c->lon[i], 360.);
+        height = (c->nHeight == 1) ? c->height[0] : c->height[i];
+        if (AACGMConvert_r(&state, c->lat[i], inlon, height,
+                           &outLat, &outLon, &r, c->flg) != 0) {
+            outLat = outLon = r = NAN;
+            c->nFail++;
+        }
+        c->latOut[i] = outLat;
+        c->lonOut[i] = outLon;
+        c->rOut[i] = r;
+    }
+    return NULL;
+}
+
+/* get a contiguous float64 buffer, optionally writable */
+static int
+aacgm_get_dbuf(PyObject *obj, Py_buffer *view, int writable, const char *name)
+{
+    int flags = PyBUF_C_CONTIGUOUS | PyBUF_FORMAT;
+    const char *fmt;
+
+    if (writable) flags |= PyBUF_WRITABLE;
+    if (PyObject_GetBuffer(obj, view, flags) < 0) return -1;
+    fmt = view->format;
+    if (fmt != NULL && (fmt[0] == '<' || fmt[0] == '=' || fmt[0] == '@')) fmt++;
+    if (view->itemsize != sizeof(double) || fmt == NULL || strcmp(fmt, "d") != 0) {
+        PyErr_Format(PyExc_TypeError,
+                     "%s must be a C-contiguous float64 array", name);
+        PyBuffer_Release(view);
+        return -1;
+    }
+    return 0;
+}
+
+static PyObject *
+aacgm_buf_wrap(PyObject *self, PyObject *args)
+{
+    PyObject *objs[6];
+    static const char *names[6] = {"lat", "lon", "height",
+                                   "latOut", "lonOut", "rOut"};
+    Py_buffer views[6];
+    struct aacgm_chunk chunks[AACGM_MAX_THREADS];
+    pthread_t tids[AACGM_MAX_THREADS];
+    int started[AACGM_MAX_THREADS];
+    int year, flg, nThreads = 1, nGot = 0, i, err = 0;
+    Py_ssize_t nElem, nHeight, nFail = 0, step;
+    double (*coef)[3][5][2];
+
+    if(!PyArg_ParseTuple(args, "OOOOOOii|i", &objs[0], &objs[1], &objs[2],
+                         &objs[3], &objs[4], &objs[5], &year, &flg, &nThreads))
+        return NULL;
+
+    for (nGot=0; nGot<6; nGot++) {
+        if (aacgm_get_dbuf(objs[nGot], &views[nGot], nGot >= 3,
+                           names[nGot]) < 0) {
+            err = 1;
+            break;
+        }
+    }
+    if (!err) {
+        nElem = views[0].len / sizeof(double);
+        nHeight = views[2].len / sizeof(double);
+        for (i=1; i<6; i++) {
+            if (i == 2 && nHeight == 1) continue;
+            if (views[i].len / (Py_ssize_t) sizeof(double) != nElem) {
+                PyErr_Format(PyExc_ValueError,
+                             "%s does not have the same length as lat",
+                             names[i]);
+                err = 1;
+                break;
+            }
+        }
+    }
+    if (!err) {
+        coef = malloc(121 * sizeof(*coef));
+        if (coef == NULL) {
+            PyErr_NoMemory();
+            err = 1;
+        }
+    }
+    if (err) {
+        for (i=0; i<nGot; i++) PyBuffer_Release(&views[i]);
+        return NULL;
+    }
+
+    if (nThreads < 1) nThreads = 1;
+    if (nThreads > AACGM_MAX_THREADS) nThreads = AACGM_MAX_THREADS;
+    if (nElem / nThreads < AACGM_MIN_CHUNK)
+        nThreads = (int) (nElem / AACGM_MIN_CHUNK) > 1 ?
+                   (int) (nElem / AACGM_MIN_CHUNK) : 1;
+    step = (nElem + nThreads - 1) / nThreads;
+
+    for (i=0; i<nThreads; i++) {
+        chunks[i].lat = (const double *) views[0].buf;
+        chunks[i].lon = (const double *) views[1].buf;
+        chunks[i].height = (const double *) views[2].buf;
+        chunks[i].latOut = (double *) views[3].buf;
+        chunks[i].lonOut = (double *) views[4].buf;
+        chunks[i].rOut = (double *) views[5].buf;
+        chunks[i].nHeight = nHeight;
+        chunks[i].start = i * step;
+        chunks[i].stop = ((i + 1) * step < nElem) ? (i + 1) * step : nElem;
+        chunks[i].flg = flg;
+        chunks[i].coef = coef;
+        chunks[i].nFail = 0;
+    }
+
+    /* the coefficients are loaded and copied with the GIL held; the
+       conversion only reads this copy, so other python threads may load
+       another epoch meanwhile */
+    AACGMInitCopy(year, coef);
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i=1; i<nThreads; i++) {
+        started[i] = (pthread_create(&tids[i], NULL, aacgm_chunk_run,
+                                     &chunks[i]) == 0);
+    }
+    aacgm_chunk_run(&chunks[0]);
+    for (i=1; i<nThreads; i++) {
+        if (started[i]) pthread_join(tids[i], NULL);
+        else aacgm_chunk_run(&chunks[i]);
+    }
+    Py_END_ALLOW_THREADS
+
+    for (i=0; i<nThreads; i++) nFail += chunks[i].nFail;
+    free(coef);
+    for (i=0; i<6; i++) PyBuffer_Release(&views[i]);
+    return PyInt_FromSsize_t(nFail);
+}
+static PyObject *
+aacgm_cache_warm_wrap(PyObject *self, PyObject *args)
+{
+    PyObject *yearSeq = NULL, *seq, *item;
+    Py_ssize_t nElem, i;
+    int year, nOk = 0;
+
+    if(!PyArg_ParseTuple(args, "|O", &yearSeq))
+        return NULL;
+
+    if (yearSeq == NULL || yearSeq == Py_None) {
+        /* every epoch for which a coefficient file can be found */
+        for (year=1900; year<=2100; year+=5)
+            if (AACGMCacheLoad(year) == 0) nOk++;
+        return PyInt_FromLong(nOk);
+    }
+
+    seq = PySequence_Fast(yearSeq, "years must be a sequence of integers");
+    if (seq == NULL) return NULL;
+    nElem = PySequence_Fast_GET_SIZE(seq);
+    for (i=0; i<nElem; i++) {
+        item = PySequence_Fast_GET_ITEM(seq, i);
+        year = (int) PyInt_AsLong(item);
+        if (year == -1 && PyErr_Occurred()) {
+            Py_DECREF(seq);
+            return NULL;
+        }
+        if (AACGMCacheLoad(year) == 0) nOk++;
+    }
+    Py_DECREF(seq);
+    return PyInt_FromLong(nOk);
+}
+
+static PyObject *
+aacgm_cache_info_wrap(PyObject *self, PyObject *args)
+{
+    struct AACGMCacheStats stats;
+    int years[128], nEpoch, i;
+    PyObject *epochs;
+
+    AACGMCacheGetStats(&stats);
+    nEpoch = AACGMCacheEpochs(years, 128);
+    epochs = PyList_New(0);
+    for (i=0; i<nEpoch && i<128; i++) {
+        PyObject *yr = PyInt_FromLong(years[i]);
+        PyList_Append(epochs, yr);
+        Py_DECREF(yr);
+    }
+    return Py_BuildValue("{s:i,s:i,s:i,s:N}", "loads", stats.loads,
+                         "switches", stats.switches, "hits", stats.hits,
+                         "epochs", epochs);
+}
+
+static PyObject *
+aacgm_cache_clear_wrap(PyObject *self, PyObject *args)
+{
+    AACGMCacheClear();
+    Py_RETURN_NONE;
+}
  
 static PyObject *
 MLTConvertYMDHMS_wrap(PyObject *self, PyObject *args)
@@ -131,6 +346,40 @@ MLTConvertYrsec_wrap(PyObject *self, PyObject *args)
     }
 
 }
+static PyObject *
+MLTMagSolarLonBuf_wrap(PyObject *self, PyObject *args)
+{
+    PyObject *epochObj, *outObj;
+    Py_buffer epochView, outView;
+    const double *epoch;
+    double *out;
+    Py_ssize_t nElem, i;
+
+    if(!PyArg_ParseTuple(args, "OO", &epochObj, &outObj))
+        return NULL;
+    if (aacgm_get_dbuf(epochObj, &epochView, 0, "epoch") < 0)
+        return NULL;
+    if (aacgm_get_dbuf(outObj, &outView, 1, "mslon") < 0) {
+        PyBuffer_Release(&epochView);
+        return NULL;
+    }
+    nElem = epochView.len / sizeof(double);
+    if (outView.len / (Py_ssize_t) sizeof(double) != nElem) {
+        PyErr_SetString(PyExc_ValueError,
+                        "mslon does not have the same length as epoch");
+        PyBuffer_Release(&epochView);
+        PyBuffer_Release(&outView);
+        return NULL;
+    }
+    epoch = (const double *) epochView.buf;
+    out = (double *) outView.buf;
+    /* the solar position routines keep static state, keep the GIL */
+    for (i=0; i<nElem; i++) out[i] = MLTMagSolarLonEpoch(epoch[i]);
+
+    PyBuffer_Release(&epochView);
+    PyBuffer_Release(&outView);
+    Py_RETURN_NONE;
+}
 /*
 static PyObject * 
 rposazm_wrap(PyObject *self, PyObject *args)
@@ -215,8 +464,13 @@ static PyMethodDef aacgmMethods[] =
 {
     {"aacgmConv",  aacgm_wrap, METH_VARARGS, "convert to aacgm coords\nformat: lat, lon, r = aacgmConv(inLat, inLon, height, year, flg)\nheight in km; flg=0: geo to aacgm; flg=1: aacgm to geo"},
     {"aacgmConvArr",  aacgm_arr_wrap, METH_VARARGS, "convert to aacgm coords when inputs are lists\nformat: lat, lon, r = aacgmConvArr(inLatList, inLonList, heightList, year, flg)\nflg=0: geo to aacgm, flg=1: aacgm to geo"},
+    {"aacgmConvBuf",  aacgm_buf_wrap, METH_VARARGS, "convert to aacgm coords when inputs are float64 buffers (e.g. numpy arrays)\nformat: nFail = aacgmConvBuf(inLat, inLon, height, outLat, outLon, outR, year, flg[, nThreads])\nall arrays must be C-contiguous float64 of the same length (height may have length 1);\noutputs may be the input arrays for in-place conversion; failed points are set to NaN.\nThe GIL is released during the conversion, which uses its own copy of the coefficients of year;\nnThreads > 1 splits large arrays over worker threads.\nflg=0: geo to aacgm, flg=1: aacgm to geo"},
+    {"aacgmCacheWarm",  aacgm_cache_warm_wrap, METH_VARARGS, "load and keep the coefficients of several epochs resident\nformat: nLoaded = aacgmCacheWarm([years])\nwithout years, every 5-year epoch with a coefficient file is loaded"},
+    {"aacgmCacheInfo",  aacgm_cache_info_wrap, METH_NOARGS, "report the state of the coefficient cache\nformat: info = aacgmCacheInfo()\ninfo is a dict with loads (coefficient files read), switches (epoch changes),\nhits (calls for the epoch in use) and epochs (resident epoch years)"},
+    {"aacgmCacheClear",  aacgm_cache_clear_wrap, METH_NOARGS, "drop all cached coefficient sets and reset the counters\nformat: aacgmCacheClear()"},
     {"mltFromEpoch",  MLTConvertEpoch_wrap, METH_VARARGS, "calculate mlt from epoch time and mag lon\nformat:mlt=mltFromEpoch(epoch,mLon)"},
     {"mltFromYmdhms",  MLTConvertYMDHMS_wrap, METH_VARARGS, "calculate mlt from y,mn,d,h,m,s and mag lon\nformat:mlt=mltFromYmdhms(yr,mo,dy,hr,mt,sc,mLon)"},
+    {"mltMagSolarLonBuf", MLTMagSolarLonBuf_wrap, METH_VARARGS, "calculate the aacgm longitude of the subsolar point for float64 buffers of epoch times\nformat: mltMagSolarLonBuf(epoch, mslonOut)\nmlt = (mLon - mslon)/15 + 12, see models.aacgm.mltFromEpochNp"},
     {"mltFromYrsec", MLTConvertYrsec_wrap , METH_VARARGS, "calculate mlt from yr seconds and mag lon\nformat:mlt=mltFromEpoch(year,yrsec,mLon)"},
 //  {"rPosAzm",  rposazm_wrap, METH_VARARGS, "wraper for rpos, MAY NOT be right\nformat:pos=rPosAzm(bm,rng,stid,eTime,frang,rsep,rx,height,magflg)"},
     {NULL, NULL, 0, NULL}        /* Sentinel */
@@ -37,22 +37,43 @@
 #include "altitude_to_cgm.h"
 #include "cgm_to_altitude.h"
 #include "rylm.h"
+#include "convert_geo_coord.h"
 
 extern struct {
   double coef[121][3][5][2];
 } sph_harm_model;
 
-static double cint[121][3][2]; 
+/* Shared state used by the non-reentrant convert_geo_coord() */
 
-/* Table of constant values */
+static struct convert_geo_state state_global={{{{0}}},{-1,-1},-1,NULL};
 
-static double height_old[2]={-1,-1};
-static double first_coeff_old=-1;
+void convert_geo_state_init(struct convert_geo_state *state) {
+    state->height_old[0]=-1.0;
+    state->height_old[1]=-1.0;
+    state->first_coeff_old=-1;
+    state->coef=NULL;
+}
 
 int convert_geo_coord(double lat_in,double  lon_in,
 		      double height_in,double *lat_out,
 		      double *lon_out,int flag,
 		      int order) {
+    return convert_geo_coord_r(&state_global,lat_in,lon_in,height_in,
+                               lat_out,lon_out,flag,order);
+}
+
+/* Reentrant version of convert_geo_coord(). All of the cached height
+   interpolated coefficients live in the caller supplied state, so
+   separate threads may convert concurrently provided each one owns
+   its own state. Threads which run while another one may load a
+   different epoch into sph_harm_model must point state->coef to their
+   own copy of the model coefficients. */
+
+int convert_geo_coord_r(struct convert_geo_state *state,
+                        double lat_in,double  lon_in,
+		        double height_in,double *lat_out,
+		        double *lon_out,int flag,
+		        int order) {
 
     
     int i, j, l, m, k;
@@ -71,21 +92,24 @@ int convert_geo_coord(double lat_in,double  lon_in,
     double colat_output=0, r=0, x=0, y=0, z=0;
     double alt_var=0;
     double lon_input=0;
+    double (*coef)[3][5][2];
+
+    coef=(state->coef !=NULL) ? state->coef : sph_harm_model.coef;
 
     if (lon_in<0) lon_in+=360.0;  
 
-    if (first_coeff_old != sph_harm_model.coef[0][0][0][0]) {
-	height_old[0] = -1.0;
-	height_old[1] = -1.0;
+    if (state->first_coeff_old != coef[0][0][0][0]) {
+	state->height_old[0] = -1.0;
+	state->height_old[1] = -1.0;
     }
-    first_coeff_old= sph_harm_model.coef[0][0][0][0];
+    state->first_coeff_old= coef[0][0][0][0];
 
     if ((height_in < 0) || (height_in > 7200)) return -2;
     else if ((flag < 0) || (flag > 1)) return -4; 
     else if (fabs(lat_in) >90.) return -8;
     else if ((lon_in<0) || (lon_in >360)) return -16;
        
-    if (height_in != height_old[flag]) {
+    if (height_in != state->height_old[flag]) {
 	alt_var= height_in/7200.0;
 	alt_var_sq = alt_var * alt_var;
 	alt_var_cu = alt_var * alt_var_sq;
@@ -93,14 +117,14 @@ int convert_geo_coord(double lat_in,double  lon_in,
 
 	for (i=0; i<3; i++) {
 	    for (j=0; j<121;j++) {
-		cint[j][i][flag] =sph_harm_model.coef[j][i][0][flag]+
-                sph_harm_model.coef[j][i][1][flag]*alt_var+
-                sph_harm_model.coef[j][i][2][flag]*alt_var_sq+
-                sph_harm_model.coef[j][i][3][flag]*alt_var_cu+
-                sph_harm_model.coef[j][i][4][flag]*alt_var_qu;
+		state->cint[j][i][flag] =coef[j][i][0][flag]+
+                coef[j][i][1][flag]*alt_var+
+                coef[j][i][2][flag]*alt_var_sq+
+                coef[j][i][3][flag]*alt_var_cu+
+                coef[j][i][4][flag]*alt_var_qu;
 	    }
 	}
-	height_old[flag] = height_in;
+	state->height_old[flag] = height_in;
     
     }
 
@@ -124,9 +148,9 @@ int convert_geo_coord(double lat_in,double  lon_in,
       for (m = -l; m <= l; m++) {
 
 	    k = l * (l+1) + m+1;
-	    x += cint[k-1][0][flag]*ylmval[k-1];
-            y += cint[k-1][1][flag]*ylmval[k-1];
-            z += cint[k-1][2][flag]*ylmval[k-1];
+	    x += state->cint[k-1][0][flag]*ylmval[k-1];
+            y += state->cint[k-1][1][flag]*ylmval[k-1];
+            z += state->cint[k-1][2][flag]*ylmval[k-1];
 	}
     }
     r = sqrt(x * x + y * y + z * z);
@@ -29,21 +29,25 @@
 
 
 
-int convert_geo_coord(double lat_in,double  lon_in,
-		      double height_in,double *lat_out,
-		      double *lon_out,int flag,int order);
-
-  
-
-
-
-
-
-
-
-
+#ifndef _CONVERT_GEO_COORD_H
+#define _CONVERT_GEO_COORD_H
 
+struct convert_geo_state {
+  double cint[121][3][2];
+  double height_old[2];
+  double first_coeff_old;
+  double (*coef)[3][5][2];  /* model coefficients, sph_harm_model if NULL */
+};
 
+void convert_geo_state_init(struct convert_geo_state *state);
 
+int convert_geo_coord(double lat_in,double  lon_in,
+		      double height_in,double *lat_out,
+		      double *lon_out,int flag,int order);
 
+int convert_geo_coord_r(struct convert_geo_state *state,
+                        double lat_in,double  lon_in,
+                        double height_in,double *lat_out,
+                        double *lon_out,int flag,int order);
 
+#endif
@@ -127,3 +127,11 @@ double MLTConvertEpoch(double epoch,double mlon) {
   return astmlt(yr,mo,dy,hr,mt,(int) sc,mlon,&mslon);
 }
 
+double MLTMagSolarLonEpoch(double epoch) {
+  int yr,mo,dy,hr,mt;
+  double sc;
+  double mslon;
+  TimeEpochToYMDHMS(epoch,&yr,&mo,&dy,&hr,&mt,&sc);
+  astmlt(yr,mo,dy,hr,mt,(int) sc,0.0,&mslon);
+  return mslon;
+}
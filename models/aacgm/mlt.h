@@ -37,4 +37,6 @@ double MLTConvertYrsec(int yr,int yrsec,double mlon);
 
 double MLTConvertEpoch(double epoch,double mlon);
 
+double MLTMagSolarLonEpoch(double epoch);
+
 #endif
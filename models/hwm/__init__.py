@@ -7,6 +7,7 @@
 
 **Modules**:
     * :mod:`hwm07`: fortran subroutines
+    * :mod:`models.hwm.hwmBatch`: winds for arrays of points
   
 *********************
 """
@@ -15,3 +16,8 @@ try:
     from hwm07 import *
 except Exception as e:
     print __file__+' -> models.hwm.hwm07: ', e
+
+try:
+    from hwmBatch import hwmWinds, closePool
+except Exception as e:
+    print __file__+' -> models.hwm.hwmBatch: ', e
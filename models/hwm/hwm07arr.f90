@@ -0,0 +1,37 @@
+!================================================================================
+! Evaluate HWM07 for N points in one call, looping in fortran.
+!
+! Input arguments are those of hwm07, one value per point (ap(2,n)).
+! Output argument:
+!        w(1,i) = meridional wind (m/sec + northward)
+!        w(2,i) = zonal wind (m/sec + eastward)
+!================================================================================
+
+subroutine hwm07arr(n,iyd,sec,alt,glat,glon,stl,f107a,f107,ap,w)
+
+    implicit none
+    integer(4),intent(in)   :: n
+    integer(4),intent(in)   :: iyd(n)
+    real(4),intent(in)      :: sec(n),alt(n),glat(n),glon(n),stl(n)
+    real(4),intent(in)      :: f107a(n),f107(n)
+    real(4),intent(in)      :: ap(2,n)
+    real(4),intent(out)     :: w(2,n)
+
+    real(4)                 :: qw(2),dw(2)
+    integer(4)              :: i
+
+    do i = 1, n
+      call hwmqt(iyd(i),sec(i),alt(i),glat(i),glon(i),stl(i), &
+                 f107a(i),f107(i),ap(:,i),qw)
+      if (ap(2,i) .ge. 0.0) then
+        call dwm07b_hwm_interface(iyd(i),sec(i),alt(i),glat(i),glon(i), &
+                                  ap(:,i),dw)
+        w(:,i) = qw + dw
+      else
+        w(:,i) = qw
+      endif
+    enddo
+
+    return
+
+end subroutine hwm07arr
@@ -0,0 +1,116 @@
+# Copyright (C) 2012  VT SuperDARN Lab
+# Full license can be found in LICENSE.txt
+"""
+*********************
+**Module**: models.hwm.hwmBatch
+*********************
+Evaluate HWM07 winds for arrays of points
+
+The points are looped over in fortran (:func:`hwm07arr`), in chunks spread
+over a pool of worker processes. The pool is kept between calls so that
+each worker reads the HWM/DWM data files only once.
+
+**Functions**:
+  * :func:`models.hwm.hwmBatch.hwmWinds`: meridional and zonal winds for arrays of points
+  * :func:`models.hwm.hwmBatch.closePool`: stop the worker processes
+
+"""
+
+# Worker pool kept between calls: (nProcs, Pool)
+_pool = None
+
+
+def _initWorker():
+  """Load the model in a new worker by evaluating a single point"""
+  import numpy as np
+  from models import hwm
+
+  hwm.hwm07arr(np.array([1]), np.zeros(1), np.array([300.]), np.zeros(1),
+      np.zeros(1), np.zeros(1), np.array([150.]), np.array([150.]),
+      np.array([[4.], [-1.]]))
+
+
+def _runChunk(args):
+  """Evaluate one chunk of points (runs in the pool workers)"""
+  from models import hwm
+
+  iyd, sec, alt, glat, glon, stl, f107a, f107, ap = args
+  return hwm.hwm07arr(iyd, sec, alt, glat, glon, stl, f107a, f107, ap.T)
+
+
+def _getPool(nProcs):
+  """Return a pool of nProcs initialized workers, reusing the last one"""
+  global _pool
+  from multiprocessing import Pool
+
+  if _pool is not None and _pool[0] != nProcs: closePool()
+  if _pool is None:
+    _pool = (nProcs, Pool(processes=nProcs, initializer=_initWorker))
+  return _pool[1]
+
+
+def closePool():
+  """Stop the worker processes kept by :func:`hwmWinds`"""
+  global _pool
+
+  if _pool is not None:
+    _pool[1].close()
+    _pool[1].join()
+    _pool = None
+
+
+def hwmWinds(iyd, sec, alt, glat, glon, stl, f107a, f107, ap,
+    nProcs=None, chunkSize=20000):
+  """Evaluate HWM07 for arrays of points.
+
+  All inputs are those of :func:`hwm07` and are broadcast against each
+  other (ap with a trailing dimension of 2).
+
+  **Args**:
+    * **iyd** (int or array): year and day as YYDDD
+    * **sec** (float or array): UT [s]
+    * **alt** (float or array): altitude [km]
+    * **glat, glon** (float or array): geodetic latitude and longitude [degree]
+    * **stl** (float or array): local apparent solar time [hours]
+    * **f107a, f107** (float or array): 81-day average and daily F10.7
+    * **ap** (array): ap(...,0) is the current 3hr ap index, ap(...,1) the
+      3hr ap used by the disturbance wind model (negative to turn DWM off)
+    * **[nProcs]** (int): number of worker processes (defaults to the
+      number of CPUs, 1 evaluates in this process)
+    * **[chunkSize]** (int): number of points per chunk; smaller inputs
+      are evaluated in this process
+  **Returns**:
+    * **mer, zon** (ndarray): meridional (northward) and zonal (eastward)
+      winds [m/s], shaped like the broadcast inputs
+  **Example**:
+    ::
+
+      import numpy as np
+      alt = np.arange(100., 400., 5.)
+      mer, zon = hwmWinds(12001, 43200., alt, 50., -100., 5.3, 150., 150., [4., -1.])
+
+  """
+  import numpy as np
+  from multiprocessing import cpu_count
+
+  ap = np.asarray(ap, dtype='float32')
+  inputs = np.broadcast_arrays(np.asarray(iyd, dtype='int32'),
+      *[np.asarray(a, dtype='float32')
+      for a in (sec, alt, glat, glon, stl, f107a, f107)] + [ap[..., 0]])
+  shape = inputs[0].shape
+  ap = np.broadcast_to(ap, shape + (2,)).reshape(-1, 2)
+  flat = [a.ravel() for a in inputs[:-1]] + [ap]
+  nPts = len(flat[0])
+
+  chunks = []
+  for i0 in xrange(0, nPts, chunkSize):
+    chunks.append([a[i0:i0+chunkSize] for a in flat])
+
+  if nProcs is None: nProcs = cpu_count()
+  if nProcs > 1 and len(chunks) > 1:
+    results = _getPool(nProcs).map(_runChunk, chunks)
+  else:
+    results = [_runChunk(c) for c in chunks]
+
+  w = np.concatenate(results, axis=1) if results else np.zeros((2, 0))
+  return w[0].reshape(shape), w[1].reshape(shape)
@@ -6,8 +6,13 @@
 *********************
 Basic plotting tools
 
+**Functions**:
+  * :func:`models.igrf.field`: field components, dip and declination for arrays of points
+  * :func:`models.igrf.gaussCoef`: main-field coefficients for a date (cached)
+
 **Modules**:
   * :mod:`models.igrf`: fortran subroutines
+  * :mod:`models.igrf.igrfField`: numpy evaluation of the main field
 
 """
 
@@ -15,3 +20,8 @@ try:
     from igrf import *
 except Exception, e:
     print __file__+' -> igrf: ', e
+
+try:
+    from igrfField import field, gaussCoef
+except Exception, e:
+    print __file__+' -> igrfField: ', e
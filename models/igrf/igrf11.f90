@@ -593,7 +593,7 @@ Cf2py intent(out) x,y,z,f
      2          gb(120),gc(120),gd(120),ge(120),gf(120),gg(120),
      3          gi(120),gj(120),gk(195),gl(195),gm(195),gp(195),
      4          gq(195),
-     5          p(105),q(105),cl(13),sl(13)
+     5          p(105),q(105),cl(13),sl(13),ghi(195)
       equivalence (g0,gh(1)),(g1,gh(121)),(g2,gh(241)),(g3,gh(361)),
      1            (g4,gh(481)),(g5,gh(601)),(g6,gh(721)),(g7,gh(841)),
      2            (g8,gh(961)),(g9,gh(1081)),(ga,gh(1201)),
@@ -1161,5 +1161,43 @@ c
      1        f20.3,'.  Date must be in the range 1900.0.ge.date',
      2        '.le.2020.0. On return f = 1.0d8., x = y = z = 0.')
       return
+c
+c     entry igrf11gh returns the main-field coefficients interpolated
+c     (extrapolated after 2010.0) to date, as used by the synthesis
+c     above, so that they can be computed once and reused for many
+c     points. They are ordered g(1,0), g(1,1), h(1,1), g(2,0), g(2,1),
+c     h(2,1), ... up to degree 13; models before 1995.0 only extend to
+c     degree 10 and the remaining coefficients are set to zero.
+c     nmxo is the maximum degree, or 0 if date is out of bounds.
+c
+      entry igrf11gh (date,ghi,nmxo)
+      do 20 k=1,195
+   20 ghi(k) = 0.0
+      nmxo  = 0
+      if (date.lt.1900.0.or.date.gt.2020.0) return
+      if (date.ge.2010.0) then
+       t     = date - 2010.0
+       tc    = 1.0
+       nmx   = 13
+       ll    = 2865
+      else
+       t     = 0.2*(date - 1900.0)
+       ll    = INT(t)
+       one   = ll
+       t     = t - one
+       if (date.lt.1995.0) then
+        nmx   = 10
+        ll    = nmx*(nmx+2)*ll
+       else
+        nmx   = 13
+        ll    = 120*19 + nmx*(nmx+2)*INT( 0.2*(date - 1995.0) )
+       endif
+       tc    = 1.0 - t
+      endif
+      nc    = nmx*(nmx+2)
+      do 21 k=1,nc
+   21 ghi(k) = tc*gh(ll+k) + t*gh(ll+nc+k)
+      nmxo  = nmx
+      return
       end
 
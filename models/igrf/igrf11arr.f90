@@ -0,0 +1,117 @@
+      subroutine igrf11synarr (n,ghi,nd,idx,itype,alt,colat,elong,
+     1                         x,y,z)
+c
+c     Main-field synthesis at n points in one call, as in igrf11syn
+c     (isv = 0), but from coefficients already interpolated to the date
+c     of each point (see entry igrf11gh) so that they are not recomputed
+c     for every point.
+c   INPUT
+c     ghi   = coefficients of nd dates, ordered as returned by igrf11gh
+c     idx   = column of ghi used for each point (1 to nd)
+c     itype, alt, colat, elong as for igrf11syn, one value per point
+c   OUTPUT
+c     x, y, z = north, east and vertical components (nT)
+c
+      implicit double precision (a-h,o-z)
+      dimension ghi(195,nd),idx(n),alt(n),colat(n),elong(n),
+     1          x(n),y(n),z(n),p(105),q(105),cl(13),sl(13)
+c
+      kmx   = 105
+      do 100 ipt=1,n
+      ic    = idx(ipt)
+      xs    = 0.0
+      ys    = 0.0
+      zs    = 0.0
+      r     = alt(ipt)
+      one   = colat(ipt)*0.017453292
+      ct    = cos(one)
+      st    = sin(one)
+      one   = elong(ipt)*0.017453292
+      cl(1) = cos(one)
+      sl(1) = sin(one)
+      cd    = 1.0
+      sd    = 0.0
+      l     = 1
+      m     = 1
+      n1    = 0
+      if (itype.eq.2) go to 3
+c
+c     conversion from geodetic to geocentric coordinates 
+c     (using the WGS84 spheroid)
+c
+      a2    = 40680631.6
+      b2    = 40408296.0
+      one   = a2*st*st
+      two   = b2*ct*ct
+      three = one + two
+      rho   = sqrt(three)
+      r     = sqrt(r*(r + 2.0*rho) + (a2*one + b2*two)/three)
+      cd    = (alt(ipt) + rho)/r
+      sd    = (a2 - b2)/rho*ct*st/r
+      one   = ct
+      ct    = ct*cd -  st*sd
+      st    = st*cd + one*sd
+c
+    3 ratio = 6371.2/r
+      rr    = ratio*ratio
+c
+c     computation of Schmidt quasi-normal coefficients p and x(=q)
+c
+      p(1)  = 1.0
+      p(3)  = st
+      q(1)  = 0.0
+      q(3)  =  ct
+      do 10 k=2,kmx
+       if (n1.ge.m) go to 4
+       m     = 0
+       n1    = n1 + 1
+       rr    = rr*ratio
+       fn    = n1
+       gn    = n1 - 1
+    4  fm    = m
+       if (m.ne.n1) go to 5
+       if (k.eq.3) go to 6
+       one   = sqrt(1.0 - 0.5/fm)
+       j     = k - n1 - 1
+       p(k)  = one*st*p(j)
+       q(k)  = one*(st*q(j) + ct*p(j))
+       cl(m) = cl(m-1)*cl(1) - sl(m-1)*sl(1)
+       sl(m) = sl(m-1)*cl(1) + cl(m-1)*sl(1)
+       go to 6
+    5  gmm   = m*m
+       one   = sqrt(fn*fn - gmm)
+       two   = sqrt(gn*gn - gmm)/one
+       three = (fn + gn)/one
+       i     = k - n1
+       j     = i - n1 + 1
+       p(k)  = three*ct*p(i) - two*p(j)
+       q(k)  = three*(ct*q(i) - st*p(i)) - two*q(j)
+c
+c     synthesis of x, y and z in geocentric coordinates
+c
+    6  one   = ghi(l,ic)*rr
+       if (m.eq.0) go to 9
+       two   = ghi(l+1,ic)*rr
+       three = one*cl(m) + two*sl(m)
+       xs    = xs + three*q(k)
+       zs    = zs - (fn + 1.0)*three*p(k)
+       if (st.eq.0.0) go to 7
+       ys    = ys + (one*sl(m) - two*cl(m))*fm*p(k)/st
+       go to 8
+    7  ys    = ys + (one*sl(m) - two*cl(m))*q(k)*ct
+    8  l     = l + 2
+       go to 10
+    9  xs    = xs + one*q(k)
+       zs    = zs - (fn + 1.0)*one*p(k)
+       l     = l + 1
+   10 m     = m + 1
+c
+c     conversion to coordinate system specified by itype
+c
+      x(ipt) = xs*cd + zs*sd
+      y(ipt) = ys
+      z(ipt) = zs*cd - xs*sd
+  100 continue
+c
+      return
+      end
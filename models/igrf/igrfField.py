@@ -0,0 +1,128 @@
+# Copyright (C) 2012  VT SuperDARN Lab
+# Full license can be found in LICENSE.txt
+"""
+*********************
+**Module**: models.igrf.igrfField
+*********************
+Evaluate the IGRF main field over arrays of dates and positions
+
+:func:`igrf11syn` interpolates the Gauss coefficients to the requested date
+on every call and returns one point at a time. Here the interpolated
+coefficients are computed once per date (with :func:`igrf11gh`) and kept,
+and the synthesis loops over whole arrays in fortran (:func:`igrf11synarr`).
+
+**Functions**:
+  * :func:`models.igrf.igrfField.gaussCoef`: main-field coefficients for a date
+  * :func:`models.igrf.igrfField.field`: field components, dip and declination for arrays of points
+
+"""
+
+# Interpolated coefficients already computed: float32 date -> gh (None out of bounds)
+_coefs = {}
+
+def gaussCoef(date):
+  """Main-field Gauss coefficients interpolated to date.
+
+  Results are cached per date (in the single precision used by the
+  fortran routines).
+
+  **Args**:
+    * **date** (float): decimal year (1900.0 to 2020.0)
+  **Returns**:
+    * **gh** (ndarray): 195 coefficients [nT] ordered g(1,0), g(1,1),
+      h(1,1), g(2,0), ... (zeros beyond the model degree), or None if the
+      date is out of bounds
+  **Example**:
+    ::
+
+      gh = gaussCoef(2012.5)
+      g10 = gh[0]
+
+  """
+  import numpy as np
+  from models import igrf
+
+  date = np.float32(date)
+  if date not in _coefs:
+    gh, nmx = igrf.igrf11gh(date)
+    _coefs[date] = np.array(gh) if nmx > 0 else None
+  return _coefs[date]
+
+
+def _decimalYear(dates):
+  """Convert datetime64 values to decimal years"""
+  import numpy as np
+
+  years = dates.astype('datetime64[Y]')
+  start = years.astype('datetime64[us]')
+  length = (years + 1).astype('datetime64[us]') - start
+  return years.astype(int) + 1970. + (dates - start)/length
+
+
+def field(date, alt, lat, lon, geodetic=True):
+  """IGRF main field for arrays of dates and positions.
+
+  All inputs are broadcast against each other. The interpolated
+  coefficients are computed once for each distinct date (see
+  :func:`gaussCoef`).
+
+  **Args**:
+    * **date** (float, datetime or array of either, or datetime64 array):
+      decimal years or UT times (1900.0 to 2020.0, values beyond 2015.0
+      are extrapolated)
+    * **alt** (float or array): altitude above sea level [km] if geodetic,
+      otherwise distance from the centre of the Earth [km]
+    * **lat** (float or array): latitude [degree]
+    * **lon** (float or array): east longitude [degree]
+    * **[geodetic]** (bool): positions are geodetic (WGS84), otherwise
+      geocentric (spherical)
+  **Returns**:
+    * **out** (dict): arrays shaped like the broadcast inputs: 'Bx' north,
+      'By' east, 'Bz' vertical (down) components and 'F' total intensity
+      [nT], 'dip' inclination and 'dec' declination [degree]. Points with
+      dates out of bounds are set to NaN.
+  **Example**:
+    ::
+
+      import numpy as np, datetime as dt
+      lat, lon = np.meshgrid(np.arange(-90., 91., 1.), np.arange(0., 360., 1.))
+      out = field(dt.datetime(2012,1,1), 300., lat, lon)
+      dip = out['dip']
+
+  """
+  import numpy as np
+  import datetime as dt
+  from models import igrf
+
+  if isinstance(date, dt.datetime) or (np.ndim(date) > 0 and
+      len(date) > 0 and isinstance(np.ravel(date)[0], dt.datetime)):
+    date = np.asarray(date, dtype='datetime64[us]')
+  date = np.asarray(date)
+  if date.dtype.kind == 'M':
+    date = _decimalYear(date.astype('datetime64[us]'))
+
+  date, alt, lat, lon = np.broadcast_arrays(date.astype('float32'),
+      *[np.asarray(a, dtype='float64') for a in (alt, lat, lon)])
+  shape = date.shape
+  date, alt, lat, lon = [a.ravel() for a in (date, alt, lat, lon)]
+
+  # coefficients for each distinct date, NaN out of bounds
+  uDates, inv = np.unique(date, return_inverse=True)
+  gh = np.empty((len(uDates), 195))
+  for i, d in enumerate(uDates):
+    c = gaussCoef(d)
+    gh[i] = c if c is not None else np.nan
+
+  if len(date) > 0:
+    bx, by, bz = igrf.igrf11synarr(gh.T, inv+1, 1 if geodetic else 2,
+        alt, 90. - lat, np.mod(lon, 360.))
+  else:
+    bx, by, bz = np.zeros(0), np.zeros(0), np.zeros(0)
+
+  bh = np.hypot(bx, by)
+  out = {'Bx': bx.reshape(shape), 'By': by.reshape(shape),
+      'Bz': bz.reshape(shape),
+      'F': np.sqrt(bh*bh + bz*bz).reshape(shape),
+      'dip': np.degrees(np.arctan2(bz, bh)).reshape(shape),
+      'dec': np.degrees(np.arctan2(by, bx)).reshape(shape)}
+  return out
@@ -7,6 +7,7 @@
 
 **Modules**:
     * :mod:`iri`: fortran subroutines 
+    * :mod:`models.iri.iriBatch`: batch profile evaluation with a profile cache
     
 *******************************
 """
@@ -15,3 +16,8 @@ try:
       from iri import *
 except Exception, e:
       print __file__+' -> models.iri.iri: ', e
+
+try:
+      from iriBatch import iriProfiles, profileCache, defaultJf
+except Exception, e:
+      print __file__+' -> models.iri.iriBatch: ', e
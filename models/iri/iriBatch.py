@@ -0,0 +1,273 @@
+# Copyright (C) 2012  VT SuperDARN Lab
+# Full license can be found in LICENSE.txt
+"""
+*********************
+**Module**: models.iri.iriBatch
+*********************
+Batch evaluation of IRI profiles with a content-keyed profile cache
+
+:func:`iri_sub` computes one location and one height range per call, and
+loads its coefficient files once per process. :func:`iriProfiles` evaluates
+many (lat, lon, time) profiles across a process pool (so each worker pays
+the file loading once) and keeps every result in a :class:`profileCache`,
+keyed by a hash of all the inputs and flags, so repeated requests for the
+same profiles are read back instead of recomputed.
+
+**Classes**:
+  * :class:`models.iri.iriBatch.profileCache`: on-disk LRU cache of IRI profiles
+
+**Functions**:
+  * :func:`models.iri.iriBatch.defaultJf`: standard IRI option switches
+  * :func:`models.iri.iriBatch.iriProfiles`: evaluate many profiles at once
+
+"""
+
+# Fields kept for each profile: name -> row of OUTF
+_outfRows = {'ne': 0, 'tn': 1, 'ti': 2, 'te': 3}
+
+# Default cache, created on first use
+_defaultCache = None
+
+
+def defaultJf(messages=False):
+  """Standard IRI option switches (see the JF table in irisub.for)
+
+  **Args**:
+    * **[messages]** (bool): turn IRI console messages on (jf(34))
+  **Returns**:
+    * **jf** (ndarray): 50 booleans
+
+  """
+  import numpy as np
+
+  jf = np.ones(50, dtype=bool)
+  for i in [4, 5, 6, 21, 23, 28, 29, 30, 33, 35]: jf[i-1] = False
+  jf[35:] = False
+  jf[33] = messages
+  return jf
+
+
+class profileCache(object):
+  """Content-keyed cache of IRI profiles with LRU eviction.
+
+  Profiles are kept in memory (up to **maxMemEntries**) and as compressed
+  npz files in **cacheDir** (up to **maxEntries**). Reading an entry marks
+  it as recently used; the least recently used entries are evicted first.
+
+  **Args**:
+    * **[cacheDir]** (str): defaults to $DAVIT_TMPDIR/iri or /tmp/sd/iri
+    * **[maxEntries]** (int): maximum number of profiles kept on disk
+    * **[maxMemEntries]** (int): maximum number of profiles kept in memory
+  **Members**:
+    * **hits, misses** (int): cache statistics for this object
+
+  """
+
+  def __init__(self, cacheDir=None, maxEntries=100000, maxMemEntries=5000):
+    import os
+    from collections import OrderedDict
+
+    if cacheDir is None:
+      try: cacheDir = os.path.join(os.environ['DAVIT_TMPDIR'], 'iri')
+      except KeyError: cacheDir = '/tmp/sd/iri'
+    if not os.path.exists(cacheDir): os.makedirs(cacheDir)
+    self.cacheDir = cacheDir
+    self.maxEntries = maxEntries
+    self.maxMemEntries = maxMemEntries
+    self.hits = 0
+    self.misses = 0
+    self._mem = OrderedDict()
+    self._nPut = 0
+
+
+  @staticmethod
+  def key(jf, jmag, lat, lon, year, mmdd, dhour, heibeg, heiend, heistp,
+      oarr=None):
+    """Hash of all the inputs of one :func:`iri_sub` call.
+
+    Floats are reduced to single precision first, as IRI does, so that
+    inputs which IRI cannot distinguish share the same entry.
+    """
+    import hashlib
+    import numpy as np
+
+    h = hashlib.sha1()
+    h.update(np.asarray(jf, dtype=bool).tostring())
+    h.update(np.array([jmag, year, mmdd], dtype='int32').tostring())
+    h.update(np.array([lat, lon, dhour, heibeg, heiend, heistp],
+        dtype='float32').tostring())
+    if oarr is not None:
+      h.update(np.asarray(oarr, dtype='float32').tostring())
+    return h.hexdigest()
+
+
+  def _fileName(self, key):
+    import os
+    return os.path.join(self.cacheDir, key+'.npz')
+
+
+  def get(self, key):
+    """Return the cached profile dictionary for key, or None"""
+    import os
+    import numpy as np
+
+    if key in self._mem:
+      self.hits += 1
+      prof = self._mem.pop(key)
+      self._mem[key] = prof
+      return prof
+    fileName = self._fileName(key)
+    try:
+      with np.load(fileName) as npz:
+        prof = dict((k, npz[k]) for k in npz.files)
+      os.utime(fileName, None)
+    except (IOError, OSError, ValueError):
+      self.misses += 1
+      return None
+    self.hits += 1
+    self._remember(key, prof)
+    return prof
+
+
+  def put(self, key, prof):
+    """Store a profile dictionary (of arrays) under key"""
+    import numpy as np
+
+    self._remember(key, prof)
+    np.savez_compressed(self._fileName(key), **prof)
+    self._nPut += 1
+    # checking the directory is not free, only do it once in a while
+    if self._nPut % 500 == 0: self.evict()
+
+
+  def _remember(self, key, prof):
+    self._mem[key] = prof
+    while len(self._mem) > self.maxMemEntries:
+      self._mem.popitem(last=False)
+
+
+  def evict(self):
+    """Remove the least recently used files beyond maxEntries"""
+    import os
+    import glob
+
+    files = glob.glob(os.path.join(self.cacheDir, '*.npz'))
+    if len(files) <= self.maxEntries: return
+    files.sort(key=lambda f: os.path.getmtime(f))
+    for f in files[:len(files)-self.maxEntries]:
+      try: os.remove(f)
+      except OSError: pass
+
+
+  def clear(self):
+    """Remove every cached profile"""
+    import os
+    import glob
+
+    self._mem.clear()
+    for f in glob.glob(os.path.join(self.cacheDir, '*.npz')):
+      try: os.remove(f)
+      except OSError: pass
+
+
+def _runProfile(args):
+  """Evaluate a single IRI profile (runs in the pool workers)"""
+  import numpy as np
+  from models import iri
+
+  jf, jmag, lat, lon, year, mmdd, dhour, heibeg, heiend, heistp, oarr, nh = args
+  if oarr is None: oarr = np.zeros(100)
+  outf, oarr = iri.iri_sub(jf, jmag, lat, lon, year, mmdd, dhour,
+      heibeg, heiend, heistp, oarr)
+  prof = dict((k, np.array(outf[row, :nh])) for k, row in _outfRows.items())
+  prof['oarr'] = np.array(oarr)
+  return prof
+
+
+def iriProfiles(lats, lons, times, heibeg=60., heiend=560., heistp=2.,
+    jf=None, jmag=0, oarr=None, nProcs=None, cache=True):
+  """Evaluate IRI profiles for many locations and times.
+
+  **Args**:
+    * **lats, lons** (float or array): latitudes and longitudes [degree]
+      (geographic, or geomagnetic if jmag=1)
+    * **times** (datetime or list of datetime): UT of each profile
+    * **[heibeg, heiend, heistp]** (float): height range [km]
+    * **[jf]** (array of 50 bool): IRI switches (defaults to :func:`defaultJf`)
+    * **[jmag]** (int): 0 geographic, 1 geomagnetic coordinates
+    * **[oarr]** (array of 100): user inputs for the switches which need them
+    * **[nProcs]** (int): number of worker processes (defaults to the number of CPUs, 1 disables the pool)
+    * **[cache]**: True to use the default :class:`profileCache`, a
+      :class:`profileCache` object, or False to disable caching
+  **Returns**:
+    * **profiles** (dict): 'alt' (nh) and 'ne', 'te', 'ti', 'tn' (N, nh)
+      and 'oarr' (N, 100) arrays, N being the broadcast number of
+      (lat, lon, time) inputs
+  **Example**:
+    ::
+
+      import datetime as dt
+      prof = iriProfiles([50., 60.], [-100., -100.], dt.datetime(2012,1,1,12))
+      ne = prof['ne']
+
+  """
+  import numpy as np
+  import datetime as dt
+  from multiprocessing import Pool, cpu_count
+  global _defaultCache
+
+  if jf is None: jf = defaultJf()
+  jf = np.asarray(jf, dtype=bool)
+  alt = np.arange(heibeg, heiend + heistp/2., heistp)
+  nh = len(alt)
+  if nh > 1000:
+    raise ValueError('IRI computes at most 1000 heights, {} requested'.format(nh))
+
+  if isinstance(times, dt.datetime): times = [times]
+  tInd = np.arange(len(times))
+  lats, lons, tInd = np.broadcast_arrays(np.atleast_1d(lats).astype(float),
+      np.atleast_1d(lons).astype(float), tInd)
+  lats, lons, tInd = lats.ravel(), lons.ravel(), tInd.ravel()
+  nProf = len(lats)
+
+  if cache is True:
+    if _defaultCache is None: _defaultCache = profileCache()
+    cache = _defaultCache
+  elif cache is False:
+    cache = None
+
+  # Build the IRI arguments and look each profile up in the cache
+  args, keys, profs = [], [], [None]*nProf
+  for i in xrange(nProf):
+    t = times[tInd[i]]
+    dhour = t.hour + t.minute/60. + (t.second + t.microsecond*1e-6)/3600. + 25.
+    a = (jf, jmag, lats[i], lons[i], t.year, t.month*100 + t.day, dhour,
+        heibeg, heiend, heistp, oarr, nh)
+    key = profileCache.key(*a[:-1]) if cache is not None else None
+    if cache is not None: profs[i] = cache.get(key)
+    args.append(a)
+    keys.append(key)
+  todo = [i for i in xrange(nProf) if profs[i] is None]
+
+  # Run what is left
+  if nProcs is None: nProcs = cpu_count()
+  nProcs = max(1, min(nProcs, len(todo)))
+  if nProcs > 1:
+    pool = Pool(processes=nProcs)
+    try:
+      results = pool.map(_runProfile, [args[i] for i in todo],
+          chunksize=max(1, len(todo)/(4*nProcs)))
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = [_runProfile(args[i]) for i in todo]
+  for i, prof in zip(todo, results):
+    profs[i] = prof
+    if cache is not None: cache.put(keys[i], prof)
+
+  out = {'alt': alt}
+  for k in _outfRows.keys():
+    out[k] = np.array([p[k] for p in profs]).reshape(nProf, nh)
+  out['oarr'] = np.array([p['oarr'] for p in profs]).reshape(nProf, 100)
+  return out
@@ -38,6 +38,12 @@ This module contains the following functions:
       * **D(9)** - Anomalous oxygen number density(CM-3)
       * **T(1)** - exospheric temperature
       * **T(2)** - temperature at ALT
+
+  * :func:`models.msis.msisFort.gtd7arr`: gtd7 (or gtd7d) looped over N points
+    in fortran, with one set of tselec switches for the call
+
+  * :func:`models.msis.msisGrid.msisGrid`: densities and temperatures over
+    altitude/lat/lon/time grids, deriving the time and F10.7/Ap inputs
   
 """
 
@@ -46,12 +52,74 @@ try:
 except Exception as e:
     print __file__+' -> models.msis: ', e 
 
+try: 
+    from msisGrid import msisGrid
+except Exception as e:
+    print __file__+' -> models.msis.msisGrid: ', e 
+
+# Tabulated F10.7/Ap values, loaded once by _loadF107Ap
+_apf107 = None
+
+
+def _loadF107Ap():
+  """
+Read apf107.dat from the IRI directory into numpy arrays (only once).
+
+* **OUTPUT**:
+  * table: a dictionnary containing:
+    * ord0: proleptic Gregorian ordinal of the first tabulated day
+    * row: day ordinal - ord0 -> row in the table (-1 if missing)
+    * date: date of each row
+    * ap3: 3 hour AP indices flattened in time order (8 per row)
+    * apd: daily AP of each row
+    * f107, f107a: daily and 81 day average f10.7 flux of each row
+
+  """
+  global _apf107
+  if _apf107 is not None: return _apf107
+
+  from models import iri
+  from datetime import date
+  import numpy as np
+
+  # Get current path to IRI module
+  path = iri.__file__.partition('__init__.py')[0]
+
+  # (cannot use genfromtext because some columns are not separated by anything)
+  tdate, tap, tapd, tf107, tf107a = [], [], [], [], []
+  with open('{}apf107.dat'.format(path), 'r') as fileh:
+    for ldat in fileh:
+      if len(ldat.strip()) == 0: continue
+      yy = int(ldat[1:3])
+      year = 1900+yy if (yy >= 58) else 2000+yy
+      tdate.append( date(year, int(ldat[4:6]), int(ldat[7:9])).toordinal() )
+      tap.append( [int(ldat[9+3*iap:9+3*iap+4]) for iap in xrange(8)] )
+      tapd.append( int(ldat[33:36]) )
+      tf107.append( float(ldat[39:44]) )
+      tf107a.append( float(ldat[44:49]) )
+
+  tdate = np.array(tdate)
+  ord0 = tdate[0]
+  row = -np.ones(tdate[-1] - ord0 + 1, dtype=int)
+  row[tdate - ord0] = np.arange(len(tdate))
+  _apf107 = {'ord0': ord0, 'row': row,
+      'date': np.array([date.fromordinal(o) for o in tdate]),
+      'ap3': np.array(tap, dtype=float).ravel(),
+      'apd': np.array(tapd, dtype=float),
+      'f107': np.array(tf107), 'f107a': np.array(tf107a)}
+  return _apf107
+
+
 def getF107Ap(mydatetime=None):
   """
 Obtain F107 and AP required for MSIS input from tabulated values in IRI data.
 
+The table is read once per session and indexed by date, so repeated calls
+are cheap. Given a list or array of times, all of them are looked up at once.
+
 * **INPUT**:
-  * mydatetime: python datetime object (defaults to last tabulated value)
+  * mydatetime: python datetime object, or a list/array of datetime
+    objects or numpy datetime64 values (defaults to last tabulated value)
 
 * **OUTPUT**:
   * dictOut: a dictionnary containing:
@@ -66,74 +134,82 @@ Obtain F107 and AP required for MSIS input from tabulated values in IRI data.
       * (5) 3 HR AP index for 9 hours before current time
       * (6) Average of eight 3 hour AP indicies from 12 to 33 hrs prior to current time
       * (7) Average of eight 3 hour AP indicies from 36 to 57 hrs prior to current time
+    For several times, f107 and f107a are arrays of shape (N), ap is an
+    array of shape (N, 7), and times outside the table are set to NaN.
 
   """
-  from models import iri
   from datetime import datetime
-  from numpy import mean, floor
-  
-  # Get current path to IRI module
-  path = iri.__file__.partition('__init__.py')[0]
-  
-  # open apf107.dat file
-  with open('{}apf107.dat'.format(path), 'r') as fileh:
-    data = []
-    for line in fileh:
-      data.append(line)
+  import numpy as np
 
-  # read into array 
-  # (cannot use genfromtext because some columns are not separated by anything)
-  tdate = []
-  tap = []
-  tapd = []
-  tf107 = []
-  tf107a = []
-  tf107y = []
-  for ldat in data:
-    yy = int(ldat[1:3])
-    year = 1900+yy if (yy >= 58) else 2000+yy
-    tdate.append( datetime(year, int(ldat[4:6]), int(ldat[7:9])).date() )
-    ttap = []
-    for iap in xrange(8):
-      ttap.append( int(ldat[9+3*iap:9+3*iap+4]) )
-    tap.append( ttap )
-    tapd.append( int(ldat[33:36]) )
-    tf107.append( float(ldat[39:44]) )
-    tf107a.append( float(ldat[44:49]) )
-    tf107y.append( float(ldat[49:54]) )
-
-  # Get required datetime
-  dictOut = {}
-  if mydatetime is None:
-    dictOut['datetime'] = datetime(tdate[-1].year, tdate[-1].month, tdate[-1].day)
-  elif mydatetime.date() <= tdate[-1]:
-    dictOut['datetime'] = mydatetime
+  tab = _loadF107Ap()
+  lastDate = tab['date'][-1]
+
+  # Scalar call
+  if mydatetime is None or isinstance(mydatetime, datetime):
+    if mydatetime is None:
+      mydatetime = datetime(lastDate.year, lastDate.month, lastDate.day)
+    elif not tab['date'][0] <= mydatetime.date() <= lastDate:
+      print 'Invalid date {}'.format(mydatetime)
+      print 'Date must be in range {} to {}'.format(tab['date'][0],lastDate)
+      return
+    out = _f107ApArr(tab, np.array([mydatetime.toordinal()]), 
+        np.array([mydatetime.hour]))
+    ap = out['ap'][0]
+    return {'datetime': mydatetime,
+        'f107': out['f107'][0],
+        'f107a': out['f107a'][0],
+        'ap': [a if np.isnan(a) else int(a) for a in ap[:5]] + list(ap[5:])}
+
+  # Array of times
+  times = np.asarray(mydatetime)
+  if np.issubdtype(times.dtype, np.datetime64):
+    days = times.astype('datetime64[D]')
+    hours = ((times - days)/np.timedelta64(1, 'h')).astype(int)
+    ordinals = days.astype(int) + datetime(1970, 1, 1).toordinal()
   else:
-    print 'Invalid date {}'.format(mydatetime)
-    print 'Date must be in range {} to {}'.format(tdate[0],tdate[-1])
-    return
-
-  # Find entry for date
-  dtInd = tdate.index(dictOut['datetime'].date())
-  # Find hour index
-  hrInd = int( floor( dictOut['datetime'].hour/3. ) )
-
-  # f107 output
-  dictOut['f107'] = tf107[dtInd-1]
-  dictOut['f107a'] = tf107a[dtInd]
-
-  # AP output
-  ttap = [ tap[dtInd][hrInd-i] for i in range(hrInd+1) ]
-  for id in xrange(3):
-    for ih in xrange(8):
-      ttap.append(tap[dtInd-id-1][-ih-1])
-  dictOut['ap'] = [ tapd[dtInd], 
-                    ttap[0], 
-                    ttap[1], 
-                    ttap[2], 
-                    ttap[3], 
-                    mean(ttap[4:13]), 
-                    mean(ttap[13:26])
-                  ]
-
-  return dictOut
+    ordinals = np.array([t.toordinal() for t in times.flat]).reshape(times.shape)
+    hours = np.array([t.hour for t in times.flat]).reshape(times.shape)
+  out = _f107ApArr(tab, ordinals, hours)
+  if np.isnan(out['f107a']).any():
+    print 'Some dates are outside of {} to {}: set to NaN'.format(
+        tab['date'][0],lastDate)
+  out['datetime'] = mydatetime
+  return out
+
+
+def _f107ApArr(tab, ordinals, hours):
+  """F10.7 and AP for arrays of day ordinals and hours (see getF107Ap)"""
+  import numpy as np
+
+  ordinals = np.asarray(ordinals)
+  shape = ordinals.shape
+  dOff = ordinals.ravel() - tab['ord0']
+  inTab = (dOff >= 0) & (dOff < len(tab['row']))
+  dtInd = np.where(inTab, tab['row'][np.clip(dOff, 0, len(tab['row'])-1)], -1)
+  valid = dtInd >= 0
+  hrInd = np.floor(np.asarray(hours).ravel()/3.).astype(int)
+
+  # f107 of the previous day (needs one tabulated day before)
+  f107 = np.where(valid & (dtInd >= 1), tab['f107'][np.clip(dtInd-1, 0, None)], np.nan)
+  f107a = np.where(valid, tab['f107a'][np.clip(dtInd, 0, None)], np.nan)
+
+  # 3 hour AP going back in time from the current slot: ttap[k] = ap3[p-k]
+  # (the 57 hours of history need three tabulated days before)
+  p = dtInd*8 + hrInd
+  nBack = 26
+  ttap = tab['ap3'][np.clip(p[:, None] - np.arange(nBack)[None, :], 0, None)]
+  ap = np.empty((len(p), 7))
+  ap[:, 0] = np.where(valid, tab['apd'][np.clip(dtInd, 0, None)], np.nan)
+  ap[:, 1:5] = ttap[:, 0:4]
+  ap[:, 5] = ttap[:, 4:13].mean(axis=1)
+  # the history holds hrInd+25 values, i.e. only 12 in the last average
+  # when hrInd is 0
+  last = np.minimum(nBack, hrInd + 25)
+  inLast = np.arange(nBack)[None, :] < last[:, None]
+  inLast[:, :13] = False
+  ap[:, 6] = (ttap*inLast).sum(axis=1) / inLast.sum(axis=1)
+  ap[~valid, 0] = np.nan
+  ap[~(valid & (dtInd >= 3)), 1:] = np.nan
+
+  return {'f107': f107.reshape(shape), 'f107a': f107a.reshape(shape),
+      'ap': ap.reshape(shape + (7,))}
@@ -0,0 +1,142 @@
+# Copyright (C) 2012  VT SuperDARN Lab
+# Full license can be found in LICENSE.txt
+"""
+*********************
+**Module**: models.msis.msisGrid
+*********************
+Evaluate NRLMSISE-00 over arrays of altitude, latitude, longitude and time
+
+The model inputs IYD, SEC and STL are derived from the times and
+longitudes, F10.7 and Ap are looked up with :func:`models.msis.getF107Ap`,
+and the points are evaluated in chunks (looping in fortran with
+:func:`gtd7arr`) spread over a process pool.
+
+**Functions**:
+  * :func:`models.msis.msisGrid.msisGrid`: densities and temperatures on a grid
+
+"""
+
+# Output names for D(1:9) and T(1:2) of gtd7
+densNames = ['HE', 'O', 'N2', 'O2', 'AR', 'RHO', 'H', 'N', 'AO']
+tempNames = ['TEX', 'T']
+
+
+def _runChunk(args):
+  """Evaluate one chunk of points (runs in the pool workers)"""
+  from models import msis
+
+  iyd, sec, alt, lat, lon, stl, f107a, f107, ap, mass, sw, drag = args
+  return msis.gtd7arr(iyd, sec, alt, lat, lon, stl, f107a, f107, ap.T,
+      mass, sw, int(drag))
+
+
+def msisGrid(alt, lat, lon, times, f107=None, f107a=None, ap=None,
+    mass=48, sw=None, drag=False, outer=False, nProcs=None, chunkSize=20000):
+  """Evaluate NRLMSISE-00 densities and temperatures on a grid.
+
+  **Args**:
+    * **alt** (float or array): altitude [km]
+    * **lat** (float or array): geodetic latitude [degree]
+    * **lon** (float or array): geodetic longitude [degree]
+    * **times** (datetime, list of datetime or datetime64 array): UT
+    * **[f107, f107a, ap]**: override the tabulated daily F10.7 (previous
+      day), 81-day average F10.7 and 7-element AP vector (scalars, or
+      arrays broadcastable to the grid; ap with a trailing dimension of 7)
+    * **[mass]** (int): mass number passed to gtd7 (48 for all species)
+    * **[sw]** (array of 25): model switches for tselec. Defaults to all on
+      with sw(9)=-1 so that the full 3-hour AP history is used.
+    * **[drag]** (bool): use gtd7d (effective total mass density for drag)
+    * **[outer]** (bool): treat alt, lat, lon, times as 1-D axes and
+      evaluate their outer product, shaped (ntimes, nalt, nlat, nlon).
+      Otherwise all inputs are broadcast against each other.
+    * **[nProcs]** (int): number of worker processes (defaults to the
+      number of CPUs, 1 disables the pool)
+    * **[chunkSize]** (int): number of points per chunk
+  **Returns**:
+    * **out** (dict): arrays shaped like the grid for each output
+      ('HE', 'O', 'N2', 'O2', 'AR', 'H', 'N', 'AO' number densities [cm-3],
+      'RHO' total mass density [g/cm3], 'TEX' exospheric and 'T' local
+      temperature [K]), plus the 'f107', 'f107a' drivers used
+  **Example**:
+    ::
+
+      import numpy as np, datetime as dt
+      out = msisGrid(np.arange(100., 500., 10.), np.arange(-90., 91., 5.),
+          np.arange(0., 360., 10.), [dt.datetime(2012,1,1,h) for h in range(24)],
+          outer=True)
+      out['O'].shape  # (24, 40, 37, 36)
+
+  """
+  import numpy as np
+  import datetime as dt
+  from multiprocessing import Pool, cpu_count
+  from models.msis import getF107Ap
+
+  if isinstance(times, dt.datetime): times = [times]
+  times = np.asarray(times, dtype='datetime64[us]')
+  alt, lat, lon = [np.asarray(a, dtype='float64') for a in (alt, lat, lon)]
+  if outer:
+    times = times.reshape(-1, 1, 1, 1)
+    alt, lat, lon = alt.reshape(-1, 1, 1), lat.reshape(-1, 1), lon.ravel()
+  tInd = np.arange(times.size).reshape(times.shape)
+  alt, lat, lon, tInd = np.broadcast_arrays(alt, lat, lon, tInd)
+  shape = alt.shape
+  times = times.ravel()
+
+  # Time inputs, computed per unique time
+  uTimes, inv = np.unique(times, return_inverse=True)
+  days = uTimes.astype('datetime64[D]')
+  years = days.astype('datetime64[Y]')
+  doy = (days - years).astype(int) + 1
+  iyd = ((years.astype(int) + 1970) % 100)*1000 + doy
+  sec = (uTimes - days)/np.timedelta64(1, 's')
+
+  # Solar and geomagnetic drivers
+  if f107 is None or f107a is None or ap is None:
+    drivers = getF107Ap(uTimes)
+  f107 = drivers['f107'][inv][tInd] if f107 is None else \
+      np.broadcast_to(f107, shape)
+  f107a = drivers['f107a'][inv][tInd] if f107a is None else \
+      np.broadcast_to(f107a, shape)
+  ap = drivers['ap'][inv][tInd] if ap is None else \
+      np.broadcast_to(ap, shape + (7,))
+
+  if sw is None:
+    sw = np.ones(25)
+    sw[8] = -1.
+
+  # Flatten everything for the fortran loop
+  iyd = iyd[inv][tInd].ravel().astype('int32')
+  sec = sec[inv][tInd].ravel()
+  lonF = lon.ravel()
+  stl = np.mod(sec/3600. + lonF/15., 24.)
+  flat = [iyd, sec, alt.ravel(), lat.ravel(), lonF, stl,
+      np.ravel(f107a), np.ravel(f107), ap.reshape(-1, 7)]
+  nPts = len(iyd)
+  chunks = []
+  for i0 in xrange(0, nPts, chunkSize):
+    chunks.append([a[i0:i0+chunkSize] for a in flat] + [mass, sw, drag])
+
+  if nProcs is None: nProcs = cpu_count()
+  nProcs = max(1, min(nProcs, len(chunks)))
+  if nProcs > 1:
+    pool = Pool(processes=nProcs)
+    try:
+      results = pool.map(_runChunk, chunks)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = [_runChunk(c) for c in chunks]
+
+  if results:
+    d = np.concatenate([r[0] for r in results], axis=1)
+    t = np.concatenate([r[1] for r in results], axis=1)
+  else:
+    d, t = np.zeros((9, 0)), np.zeros((2, 0))
+  out = {}
+  for i, name in enumerate(densNames): out[name] = d[i].reshape(shape)
+  for i, name in enumerate(tempNames): out[name] = t[i].reshape(shape)
+  out['f107'] = np.ravel(f107).reshape(shape)
+  out['f107a'] = np.ravel(f107a).reshape(shape)
+  return out
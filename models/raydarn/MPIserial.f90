@@ -0,0 +1,143 @@
+! Copyright (C) 2012  VT SuperDARN Lab
+! Full license can be found in LICENSE.txt
+! Single process stand-in for the MPI routines used by the ray tracing program.
+! Linked instead of MPI to build rtFortSerial (see Makefile), which runs without
+! an MPI runtime: each invocation is one rank writing its files sequentially.
+! Datatype handles are the size of the type in bytes.
+MODULE MPI
+
+	implicit none
+
+	integer,parameter::			MPI_ADDRESS_KIND = 8, MPI_OFFSET_KIND = 8
+	integer,parameter::			MPI_STATUS_SIZE = 1
+	integer,parameter::			MPI_COMM_WORLD = 0, MPI_INFO_NULL = 0
+	integer,parameter::			MPI_MODE_CREATE = 1, MPI_MODE_WRONLY = 4
+	integer,parameter::			MPI_CHAR = 1, MPI_INTEGER = 4, MPI_REAL = 4
+	integer,parameter::			MPI_DOUBLE_PRECISION = 8
+	integer,parameter::			MPI_MAX = 0
+
+	real(kind=8),external::		MPI_WTIME
+
+END MODULE MPI
+
+
+SUBROUTINE MPI_INIT(code)
+	integer::	code
+	code = 0
+END SUBROUTINE MPI_INIT
+
+
+SUBROUTINE MPI_FINALIZE(code)
+	integer::	code
+	code = 0
+END SUBROUTINE MPI_FINALIZE
+
+
+SUBROUTINE MPI_COMM_SIZE(comm, nprocs, code)
+	integer::	comm, nprocs, code
+	nprocs = 1
+	code = 0
+END SUBROUTINE MPI_COMM_SIZE
+
+
+SUBROUTINE MPI_COMM_RANK(comm, rank, code)
+	integer::	comm, rank, code
+	rank = 0
+	code = 0
+END SUBROUTINE MPI_COMM_RANK
+
+
+SUBROUTINE MPI_BARRIER(comm, code)
+	integer::	comm, code
+	code = 0
+END SUBROUTINE MPI_BARRIER
+
+
+SUBROUTINE MPI_BCAST(buf, count, datatype, root, comm, code)
+	integer::	count, datatype, root, comm, code
+	character::	buf(*)
+	code = 0
+END SUBROUTINE MPI_BCAST
+
+
+SUBROUTINE MPI_REDUCE(sendbuf, recvbuf, count, datatype, op, root, comm, code)
+	integer::	count, datatype, op, root, comm, code
+	character::	sendbuf(count*datatype), recvbuf(count*datatype)
+	recvbuf = sendbuf
+	code = 0
+END SUBROUTINE MPI_REDUCE
+
+
+FUNCTION MPI_WTIME()
+	real(kind=8)::		MPI_WTIME
+	integer(kind=8)::	count, rate
+	CALL system_clock(count, rate)
+	MPI_WTIME = real(count, 8)/rate
+END FUNCTION MPI_WTIME
+
+
+! Datatypes
+SUBROUTINE MPI_TYPE_CONTIGUOUS(count, oldtype, newtype, code)
+	integer::	count, oldtype, newtype, code
+	newtype = count*oldtype
+	code = 0
+END SUBROUTINE MPI_TYPE_CONTIGUOUS
+
+
+SUBROUTINE MPI_TYPE_CREATE_STRUCT(count, lblocks, disp, types, newtype, code)
+	integer::			count, newtype, code
+	integer::			lblocks(count), types(count)
+	integer(kind=8)::	disp(count)
+	newtype = int(disp(count)) + lblocks(count)*types(count)
+	code = 0
+END SUBROUTINE MPI_TYPE_CREATE_STRUCT
+
+
+SUBROUTINE MPI_GET_ADDRESS(location, addr, code)
+	integer::			code
+	character::			location(*)
+	integer(kind=8)::	addr
+	addr = loc(location)
+	code = 0
+END SUBROUTINE MPI_GET_ADDRESS
+
+
+SUBROUTINE MPI_TYPE_COMMIT(datatype, code)
+	integer::	datatype, code
+	code = 0
+END SUBROUTINE MPI_TYPE_COMMIT
+
+
+SUBROUTINE MPI_TYPE_FREE(datatype, code)
+	integer::	datatype, code
+	code = 0
+END SUBROUTINE MPI_TYPE_FREE
+
+
+SUBROUTINE MPI_TYPE_SIZE(datatype, size, code)
+	integer::	datatype, size, code
+	size = datatype
+	code = 0
+END SUBROUTINE MPI_TYPE_SIZE
+
+
+! Files
+SUBROUTINE MPI_FILE_OPEN(comm, filename, amode, info, fh, code)
+	integer::			comm, amode, info, fh, code
+	character(len=*)::	filename
+	open(newunit=fh, file=trim(filename), access='stream', form='unformatted', &
+		status='replace', iostat=code)
+END SUBROUTINE MPI_FILE_OPEN
+
+
+SUBROUTINE MPI_FILE_WRITE_SHARED(fh, buf, count, datatype, status, code)
+	integer::	fh, count, datatype, status(*), code
+	character::	buf(count*datatype)
+	write(fh, iostat=code) buf
+END SUBROUTINE MPI_FILE_WRITE_SHARED
+
+
+SUBROUTINE MPI_FILE_CLOSE(fh, code)
+	integer::	fh, code
+	close(fh, iostat=code)
+END SUBROUTINE MPI_FILE_CLOSE
@@ -8,8 +8,13 @@ This module wraps the ray-tracing coupled with IRI and IGRF
 
 **Modules**
     * :mod:`models.raydarn.rt`: 
+    * :mod:`models.raydarn.rtCache`: cache of raytracing outputs
 
 """
 try: from rt import *
 except Exception, e:
     print __file__+' -> models.raydarn.rt: ', e
+
+try: from rtCache import rtCache
+except Exception, e:
+    print __file__+' -> models.raydarn.rtCache: ', e
@@ -16,6 +16,9 @@ program     rayDARN
 !   - nhop: number of hops to be considered (default is 1)
 !   - hourbeg, hour end, hourstp: hour (+25 for UT)
 !
+! Arguments: input file, output directory, output file extension, and optionally a directory
+! where electron density arrays are saved and reused between runs (see EDENS_ARR)
+!
 ! Outputs (files):
 !   - edens.dat: electron densities from transmitter along given azimuth (from 60km to 560km altitude over 2500km distance)\
 !   - rays.dat: rays information: Number of steps, hour, azimuth, elevation, altitude, theta, group range, true range, refractive index, latitude, longitude
@@ -36,6 +39,7 @@ program     rayDARN
     integer::   dhour, dazim, delev
     character:: filename*100
     character(len=80):: arg
+    character(len=250):: edensdir
 ! IRI
     real*4::    edensARR(500,500), edens
     real*4::    edensPOS(500,2), dip(500,2), edensTHT(500)
@@ -68,6 +72,8 @@ program     rayDARN
     endif
     ! Bcast parameters
     CALL MPI_BCAST(params, 1, type_param, 0, MPI_COMM_WORLD, code)
+    ! Electron density cache (blank if not used)
+    CALL getarg(4, edensdir)
 
     ! Creates output files
     filename = trim(params%outdir)//"rays."//trim(params%filext)//".dat"
@@ -163,7 +169,7 @@ program     rayDARN
             if (azim.gt.params%azimend) exit
 !            print*, rank, 'azim',hour,azim
             ! Generate electron density background
-            CALL IRI_ARR(params, hour, azim, edensARR, edensPOS, edensTHT, dip)
+            CALL EDENS_ARR(params, hour, azim, edensdir, edensARR, edensPOS, edensTHT, dip)
             CALL MPI_FILE_WRITE_SHARED(hfedens, (/hour, azim, &
 !                                            edensPOS(::2,:), &
                                             edensTHT(::2), &
@@ -992,6 +998,61 @@ SUBROUTINE IRI_ARR(params, hour, azim, edensARR, edensPOS, edensTHT, dip)
 END SUBROUTINE IRI_ARR
 
 
+! *************************************************************************
+! Electron density arrays from IRI_ARR, saved in directory edensdir and
+! read back when the same hour and azimuth are needed again (edensdir is
+! specific to the transmitter position, date and IRI options, and is not
+! used when blank)
+! *************************************************************************
+SUBROUTINE EDENS_ARR(params, hour, azim, edensdir, edensARR, edensPOS, edensTHT, dip)
+
+    use constants
+    implicit none
+    real*4,intent(in)::                         azim, hour
+    type(prm),intent(in)::                      params
+    character(len=*),intent(in)::               edensdir
+    real*4,dimension(500,500),intent(out)::     edensARR
+    real*4,dimension(500,2),intent(out)::       edensPOS, dip
+    real*4,dimension(500),intent(out)::         edensTHT
+
+    character(len=300)::        filename, tmpname
+    logical::                   found
+    integer::                   funit, ios
+
+    if (len_trim(edensdir).eq.0) then
+        CALL IRI_ARR(params, hour, azim, edensARR, edensPOS, edensTHT, dip)
+        return
+    endif
+
+    ! One file per hour and azimuth (to 1e-4)
+    write(filename, "(a,'edens.',i0,'.',i0,'.dat')") trim(edensdir), &
+        nint(hour*1e4), nint(azim*1e4)
+    inquire(file=trim(filename), exist=found)
+    if (found) then
+        open(newunit=funit, file=trim(filename), access='stream', form='unformatted', &
+            status='old', iostat=ios)
+        if (ios.eq.0) then
+            read(funit, iostat=ios) edensARR, edensPOS, edensTHT, dip
+            close(funit)
+            if (ios.eq.0) return
+        endif
+    endif
+
+    CALL IRI_ARR(params, hour, azim, edensARR, edensPOS, edensTHT, dip)
+
+    ! Written under a temporary name first so that other runs never read a partial file
+    write(tmpname, "(a,'.',i0,'.tmp')") trim(filename), getpid()
+    open(newunit=funit, file=trim(tmpname), access='stream', form='unformatted', &
+        status='replace', iostat=ios)
+    if (ios.eq.0) then
+        write(funit, iostat=ios) edensARR, edensPOS, edensTHT, dip
+        close(funit)
+        if (ios.eq.0) CALL rename(trim(tmpname), trim(filename))
+    endif
+
+END SUBROUTINE EDENS_ARR
+
+
 ! *************************************************************************
 ! Interpolates electron densities at a given position
 ! *************************************************************************
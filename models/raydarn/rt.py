@@ -12,7 +12,10 @@ This module runs the raytracing code
     * :class:`models.raydarn.rt.Edens`: store and process electron density profiles
     * :class:`models.raydarn.rt.Rays`: store and process individual rays
 
-.. note:: The ray tracing requires mpi to run. You can adjust the number of processors, but be wise about it and do not assign more than you have
+**Functions**:
+    * :func:`models.raydarn.rt.runMany`: run several ray traces concurrently
+
+.. note:: The ray tracing runs with mpi (rtFort). Without mpiexec, it runs as independent single process jobs of rtFortSerial (built with "make serial"), which needs no MPI runtime. You can adjust the number of processors, but be wise about it and do not assign more than you have
 
 """
 
@@ -38,8 +41,13 @@ class RtRun(object):
         * [**debug**] (bool): print some diagnostics of the fortran run and output processing
         * [**fext**] (str): output file id, max 10 character long (mostly used for multiple users environments, like a website)
         * [**loadFrom**] (str): file name where a pickled instance of RtRun was saved (supersedes all other args)
-        * [**nprocs**] (int): number of processes to use with MPI
+        * [**nprocs**] (int): number of processes to use with MPI (or in the process pool)
+        * [**backend**] (str): 'mpi' to run with mpiexec, 'pool' to run single process jobs in a pool, 'auto' to use mpi when mpiexec is available
+        * [**cache**] (:class:`rtCache.rtCache` or bool): reuse the outputs of identical runs (True uses the default cache)
+        * [**edensCache**] (:class:`rtCache.rtCache` or bool): keep the electron densities computed with IRI and reuse them in runs with the same radar, date and ionosphere (True uses the default cache)
+        * [**run**] (bool): run the ray tracing now, otherwise only set up the run (see :func:`RtRun.run`)
     **Methods**:
+        * :func:`RtRun.run`
         * :func:`RtRun.readRays`
         * :func:`RtRun.readEdens`
         * :func:`RtRun.readScatter`
@@ -67,7 +75,8 @@ class RtRun(object):
         debug=False, 
         fext=None, 
         loadFrom=None, 
-        nprocs=4):
+        nprocs=4, backend='auto', 
+        cache=False, edensCache=False, run=True):
         import datetime as dt
         from os import path
         from pydarn import radar
@@ -126,11 +135,39 @@ class RtRun(object):
             self.outDir = path.join( outDir, '' )
             self.fExt = '0' if not fext else fext
 
-            # Write input file
-            inputFile = self._genInput()
-            
+            # Electron densities cache
+            self.edensCache = edensCache
+
             # Run the ray tracing
-            success = self._execute(nprocs, inputFile, debug=debug)
+            if run:
+                self.run(nprocs, backend=backend, cache=cache, debug=debug)
+
+
+    def run(self, nprocs=4, backend='auto', cache=False, debug=False):
+        """Run the ray tracing, or copy its outputs from the cache
+
+        **Args**:
+            * [**nprocs**] (int): number of processes to use with MPI (or in the process pool)
+            * [**backend**] (str): 'mpi', 'pool' or 'auto' (see :class:`RtRun`)
+            * [**cache**] (:class:`rtCache.rtCache` or bool): reuse the outputs of identical runs (True uses the default cache)
+            * [**debug**] (bool): print some diagnostics of the fortran run
+        **Returns**:
+            * True once the outputs are in outDir
+        """
+        cache = _getCache(cache)
+        if cache:
+            key = cache.key(self)
+            if cache.get(key, self):
+                return True
+
+        # Write input file
+        inputFile = self._genInput()
+        
+        # Run the ray tracing
+        success = self._execute(nprocs, inputFile, backend=backend, debug=debug)
+        if cache:
+            cache.put(key, self)
+        return success
 
 
     def _genInput(self):
@@ -140,46 +177,221 @@ class RtRun(object):
 
         fname = path.join(self.outDir, 'rtrun.{}.inp'.format(self.fExt))
         with open(fname, 'w') as f:
-            f.write( "{:8.2f}  Transmitter latitude (degrees N)\n".format( self.site.geolat ) )
-            f.write( "{:8.2f}  Transmitter Longitude (degrees E\n".format( self.site.geolon ) )
-            f.write( "{:8.2f}  Azimuth (degrees E) (begin)\n".format( self.azim[0] ) )
-            f.write( "{:8.2f}  Azimuth (degrees E) (end)\n".format( self.azim[1] ) )
-            f.write( "{:8.2f}  Azimuth (degrees E) (step)\n".format( self.azim[2] ) )
-            f.write( "{:8.2f}  Elevation angle (begin)\n".format( self.elev[0] ) )
-            f.write( "{:8.2f}  Elevation angle (end)\n".format( self.elev[1] ) )
-            f.write( "{:8.2f}  Elevation angle (step)\n".format( self.elev[2] ) )
-            f.write( "{:8.2f}  Frequency (Mhz)\n".format( self.freq ) )
-            f.write( "{:8d}  nubmer of hops (minimum 1)\n".format( self.nhops) )
-            f.write( "{:8d}  Year (yyyy)\n".format( self.time[0].year ) )
-            f.write( "{:8d}  Month and day (mmdd)\n".format( self.time[0].month*100 + self.time[0].day ) )
-            tt = self.time[0].hour + self.time[0].minute/60.
-            tt += 25.
-            f.write( "{:8.2f}  hour (add 25 for UT) (begin)\n".format( tt ) )
-            tt = self.time[1].hour + self.time[1].minute/60.
-            tt += (self.time[1].day - self.time[0].day) * 24.
-            tt += 25.
-            f.write( "{:8.2f}  hour (add 25 for UT) (end)\n".format( tt ) )
-            f.write( "{:8.2f}  hour (step)\n".format( self.dTime ) )
-            f.write( "{:8.2f}  hmf2 (km, if 0 then ignored)\n".format( self.hmf2 ) )
-            f.write( "{:8.2f}  nmf2 (log10, if 0 then ignored)\n".format( self.nmf2 ) )
+            f.write( self._inputText() )
 
         return fname
+
+
+    def _inputText(self, azim=None, hour=None):
+        """Content of the input file
+
+        **Args**:
+            * [**azim**] (tuple): (begin, end) azimuths replacing those of the run
+            * [**hour**] (tuple): (begin, end) hours (+25 for UT) replacing those of the run
+        """
+        from StringIO import StringIO
+
+        if azim is None: azim = self.azim[:2]
+        f = StringIO()
+        f.write( "{:8.2f}  Transmitter latitude (degrees N)\n".format( self.site.geolat ) )
+        f.write( "{:8.2f}  Transmitter Longitude (degrees E\n".format( self.site.geolon ) )
+        f.write( "{:8.2f}  Azimuth (degrees E) (begin)\n".format( azim[0] ) )
+        f.write( "{:8.2f}  Azimuth (degrees E) (end)\n".format( azim[1] ) )
+        f.write( "{:8.2f}  Azimuth (degrees E) (step)\n".format( self.azim[2] ) )
+        f.write( "{:8.2f}  Elevation angle (begin)\n".format( self.elev[0] ) )
+        f.write( "{:8.2f}  Elevation angle (end)\n".format( self.elev[1] ) )
+        f.write( "{:8.2f}  Elevation angle (step)\n".format( self.elev[2] ) )
+        f.write( "{:8.2f}  Frequency (Mhz)\n".format( self.freq ) )
+        f.write( "{:8d}  nubmer of hops (minimum 1)\n".format( self.nhops) )
+        f.write( "{:8d}  Year (yyyy)\n".format( self.time[0].year ) )
+        f.write( "{:8d}  Month and day (mmdd)\n".format( self.time[0].month*100 + self.time[0].day ) )
+        tt = self.time[0].hour + self.time[0].minute/60.
+        tt += 25.
+        if hour: tt = hour[0]
+        f.write( "{:8.2f}  hour (add 25 for UT) (begin)\n".format( tt ) )
+        tt = self.time[1].hour + self.time[1].minute/60.
+        tt += (self.time[1].day - self.time[0].day) * 24.
+        tt += 25.
+        if hour: tt = hour[1]
+        f.write( "{:8.2f}  hour (add 25 for UT) (end)\n".format( tt ) )
+        f.write( "{:8.2f}  hour (step)\n".format( self.dTime ) )
+        f.write( "{:8.2f}  hmf2 (km, if 0 then ignored)\n".format( self.hmf2 ) )
+        f.write( "{:8.2f}  nmf2 (log10, if 0 then ignored)\n".format( self.nmf2 ) )
+
+        return f.getvalue()
         
 
-    def _execute(self, nprocs, inputFileName, debug=False):
+    def _execute(self, nprocs, inputFileName, backend='auto', debug=False):
         """Execute raytracing command
         """
+        if _getBackend(backend) == 'pool':
+            return self._executePool(nprocs, inputFileName, debug=debug)
+        process = self._start(nprocs, inputFileName)
+        process.wait()
+        return self._finish(process, inputFileName, debug=debug)
+
+
+    def _executePool(self, nprocs, inputFileName, debug=False):
+        """Execute the raytracing as independent single process jobs
+
+        The hours (or the azimuths of each hour, when there are fewer hours 
+        than processes) are split in the way MPI ranks would share them. 
+        Each chunk is traced by rtFortSerial with its own input and output 
+        files, nprocs at a time, and the outputs are merged into the files 
+        a single mpi run would have written.
+        """
+        import subprocess as subp
+        import shutil
+        from tempfile import mkdtemp
+        from multiprocessing.pool import ThreadPool
+        from os import path
+
+        exe = path.join(path.abspath( __file__.split('rt.py')[0] ), 'rtFortSerial')
+        if not path.isfile(exe):
+            raise Exception('{} not found, build it with "make serial"'.format(exe))
+
+        # Chunks are kept in a short temporary path (the fortran code 
+        # accepts at most 100 characters)
+        tmpDir = path.join(mkdtemp(prefix='rt'), '')
+        try:
+            commands = []
+            for i, (azim, hour) in enumerate(self._chunks(nprocs)):
+                chunkInput = path.join(tmpDir, 'rtrun.{}.inp'.format(i))
+                with open(chunkInput, 'w') as f:
+                    f.write( self._inputText(azim=azim, hour=hour) )
+                commands.append([exe, chunkInput, tmpDir, '{}'.format(i)] + 
+                    self._edensArgs())
+
+            pool = ThreadPool(processes=nprocs)
+            try:
+                results = pool.map(_runCommand, commands)
+            finally:
+                pool.close()
+                pool.join()
+
+            for command, (exitCode, output) in zip(commands, results):
+                if debug or (exitCode != 0):
+                    print 'In:: {}'.format( command )
+                    print 'Exit code:: {}'.format( exitCode )
+                    print 'Returned:: \n', output
+                if (exitCode != 0):
+                    raise Exception('Fortran execution error.')
+
+            # Merge the chunks behind the header of the whole run
+            header = self._header()
+            for name in ['rays', 'edens', 'gscat', 'iscat']:
+                with open(path.join(self.outDir, '{}.{}.dat'.format(name, self.fExt)), 'wb') as fo:
+                    fo.write(header)
+                    for i in range(len(commands)):
+                        with open(path.join(tmpDir, '{}.{}.dat'.format(name, i)), 'rb') as fi:
+                            fi.seek(_headerSize)
+                            shutil.copyfileobj(fi, fo)
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+        subp.call(['rm',inputFileName])
+        return True
+
+
+    def _edensArgs(self):
+        """Electron density cache argument of the fortran code (if any)
+        """
+        cache = _getCache(getattr(self, 'edensCache', False))
+        return [cache.edensDir(self)] if cache else []
+
+
+    def _grid(self):
+        """Azimuths, elevations and hours as the fortran code reads them
+
+        **Returns**:
+            * **params** (list): the 17 values of the input file (single precision)
+            * **nhour**, **nazim**, **nelev** (int): number of hours, azimuths and elevations
+        """
+        import numpy as np
+
+        lines = self._inputText().splitlines()
+        params = [int(l[:8]) if i in (9, 10, 11) else np.float32(l[:8]) 
+            for i, l in enumerate(lines)]
+        azbeg, azend, azstp, elbeg, elend, elstp = params[2:8]
+        hrbeg, hrend, hrstp = params[12:15]
+        nint = lambda x: int(round(float(x)))
+        nelev = nint((elend - elbeg)/elstp) + 1
+        nazim = nint((azend - azbeg)/azstp) + 1
+        nhour = nint((hrend - hrbeg)/hrstp) + 1
+        if hrend < hrbeg: nhour = nint((np.float32(24.) - hrbeg + hrend)/hrstp) + 1
+        if hrend == hrbeg: nhour = nint(np.float32(24.)/hrstp) + 1
+
+        return params, nhour, nazim, nelev
+
+
+    def _header(self):
+        """Header of the output files of the whole run
+        """
+        from struct import pack
+
+        params, nhour, nazim, nelev = self._grid()
+        return pack('3i9f3i5f', nhour, nazim, nelev, *params) + \
+            pack('10s', self.fExt.ljust(10)) + pack('100s', self.outDir.ljust(100))
+
+
+    def _chunks(self, n):
+        """Split the run in at least n independent chunks (if possible)
+
+        **Returns**:
+            * **chunks** (list): (begin, end) azimuths and (begin, end) hours of each chunk
+        """
+        import numpy as np
+
+        params, nhour, nazim, nelev = self._grid()
+        azbeg, azend, azstp = params[2:5]
+        hrbeg, hrend, hrstp = params[12:15]
+        # End values are padded so that accumulated steps do not miss the 
+        # last point of a chunk (the last chunk keeps the original end)
+        if hrend > hrbeg and hrstp >= .02:
+            hours = [(hrbeg + i[0]*hrstp, hrbeg + (i[-1] + .5)*hrstp) 
+                for i in np.array_split(np.arange(nhour), min(n, nhour))]
+            hours[-1] = (hours[-1][0], hrend)
+        else:
+            hours = [(hrbeg, hrend)]
+        azims = [(azbeg, azend)]
+        if len(hours) < n and nazim > 1 and azstp >= .04:
+            azims = [(azbeg + i[0]*azstp, azbeg + (i[-1] + .25)*azstp) 
+                for i in np.array_split(np.arange(nazim), 
+                    min(nazim, int(np.ceil(float(n)/len(hours)))))]
+            azims[-1] = (azims[-1][0], azend)
+
+        return [(az, hr) for hr in hours for az in azims]
+
+
+    def _start(self, nprocs, inputFileName):
+        """Start the raytracing command without waiting for it
+        """
         import subprocess as subp
+        from tempfile import TemporaryFile
         from os import path
 
         command = ['mpiexec', '-n', '{}'.format(nprocs), 
             path.join(path.abspath( __file__.split('rt.py')[0] ), 'rtFort'), 
             inputFileName, 
             self.outDir, 
-            self.fExt]
+            self.fExt] + self._edensArgs()
         
-        process = subp.Popen(command, shell=False, stdout=subp.PIPE, stderr=subp.STDOUT)
-        output = process.communicate()[0]
+        # Output goes to a file so that a full pipe never blocks the run
+        log = TemporaryFile()
+        process = subp.Popen(command, shell=False, stdout=log, stderr=subp.STDOUT)
+        process.command, process.log = command, log
+        return process
+
+
+    def _finish(self, process, inputFileName, debug=False):
+        """Check the exit code of a finished raytracing command
+        """
+        import subprocess as subp
+
+        command = process.command
+        process.log.seek(0)
+        output = process.log.read()
+        process.log.close()
         exitCode = process.returncode
 
         if debug or (exitCode != 0):
@@ -220,11 +432,11 @@ class RtRun(object):
         subp.call(['rm',fName])
 
 
-    def readEdens(self, debug=False):
+    def readEdens(self, memmap=False, debug=False):
         """Read edens.dat fortran output
 
         **Args**:
-            * [**site**] (pydarn.radar.radStrict.site): site object of current radar
+            * [**memmap**] (bool): map the density blocks from the file instead of reading them into memory (see :class:`rt.Edens`)
             * [**debug**] (bool): print some i/o diagnostics
         **Returns**:
             * Add a new member to :class:`rt.RtRun`: **rays**, of type :class:`rt.rays`
@@ -241,7 +453,7 @@ class RtRun(object):
         # Initialize rays output
         self.ionos = Edens(fName, 
             site=self.site, radar=self.radar,
-            debug=debug)
+            memmap=memmap, debug=debug)
         # Remove Input file
         subp.call(['rm',fName])
 
@@ -316,6 +528,125 @@ class RtRun(object):
             subp.call(['rm', fName])
 
 
+#########################################################################
+# Multiple runs
+#########################################################################
+def runMany(runs, ncpus=None, backend='auto', cache=True, edensCache=False, debug=False):
+    """Run several ray traces concurrently within a processor budget
+
+    Runs already in the cache (or repeated in the list) are not traced 
+    again. The others are started as simultaneous mpiexec jobs, each new 
+    job getting an equal share of the processors still free. With the 
+    'pool' backend, runs are traced one after the other, each over ncpus 
+    processes.
+
+    With edensCache, the first of the runs sharing electron densities 
+    (same radar, date and ionosphere) is traced before the others start, 
+    so that IRI is only called once for them.
+
+    **Args**:
+        * **runs** (list): keyword arguments of :class:`RtRun` for each run (nprocs, cache and run are ignored)
+        * [**ncpus**] (int): total number of processors for all the jobs (defaults to the number of CPUs)
+        * [**backend**] (str): 'mpi', 'pool' or 'auto' (see :class:`RtRun`)
+        * [**cache**] (:class:`rtCache.rtCache` or bool): cache to use (True uses the default cache)
+        * [**edensCache**] (:class:`rtCache.rtCache` or bool): electron densities cache, for the runs which do not set one
+        * [**debug**] (bool): print some diagnostics of the fortran runs
+    **Returns**:
+        * **rtos** (list): :class:`RtRun` objects in the order of runs, with their outputs in outDir
+    **Example**:
+        ::
+
+            # Frequency sweep over a day of Blackstone beam 12
+            sTime = dt.datetime(2012, 11, 18)
+            runs = [dict(sTime=sTime, eTime=sTime+dt.timedelta(hours=23), 
+                rCode='bks', beam=12, freq=f, outDir='/tmp') 
+                for f in range(8, 19)]
+            rtos = raydarn.runMany(runs, ncpus=8)
+            rtos[0].readRays()
+
+    """
+    import time
+    from multiprocessing import cpu_count
+    from rtCache import rtCache
+
+    if ncpus is None: ncpus = cpu_count()
+    cache = _getCache(cache)
+
+    # Set up the runs, with distinct output files unless they were given
+    rtos = []
+    for spec in runs:
+        spec = dict(spec, run=False)
+        spec.setdefault('edensCache', edensCache)
+        spec.pop('nprocs', None); spec.pop('cache', None); spec.pop('backend', None)
+        rto = RtRun(**spec)
+        if not spec.get('fext') and not spec.get('loadFrom'):
+            rto.fExt = rtCache.key(rto)[:10]
+        rtos.append(rto)
+    outputs = [(rto.outDir, rto.fExt) for rto in rtos]
+    keys = [rtCache.key(rto) for rto in rtos]
+    for i, o in enumerate(outputs):
+        if o in outputs[:i] and keys[i] != keys[outputs.index(o)]:
+            raise ValueError('Runs {} and {} write to the same files'.format(
+                outputs.index(o), i))
+
+    # Each distinct run not in the cache is traced once
+    todo = []
+    for i, rto in enumerate(rtos):
+        if cache and cache.get(keys[i], rto): continue
+        if keys[i] in [keys[j] for j in todo]: continue
+        todo.append(i)
+
+    if _getBackend(backend) == 'pool':
+        for i in todo:
+            rtos[i]._execute(ncpus, rtos[i]._genInput(), backend='pool', debug=debug)
+            if cache: cache.put(keys[i], rtos[i])
+        todo = []
+
+    # Runs sharing an electron densities cache wait for the first of them
+    edensDirs = [''.join(rto._edensArgs()) for rto in rtos]
+    ready = set([''])
+
+    running = []
+    free = ncpus
+    try:
+        while todo or running:
+            # Start as many jobs as the free processors allow
+            busy = set(edensDirs[job[0]] for job in running)
+            while todo and free > 0:
+                startable = [i for i in todo 
+                    if edensDirs[i] in ready or edensDirs[i] not in busy]
+                if not startable: break
+                i = startable[0]
+                todo.remove(i)
+                busy.add(edensDirs[i])
+                nprocs = max(1, free/(len(todo) + 1))
+                inputFile = rtos[i]._genInput()
+                running.append( (i, nprocs, inputFile, 
+                    rtos[i]._start(nprocs, inputFile)) )
+                free -= nprocs
+            time.sleep(.1)
+            for job in running[:]:
+                i, nprocs, inputFile, process = job
+                if process.poll() is None: continue
+                running.remove(job)
+                free += nprocs
+                ready.add(edensDirs[i])
+                rtos[i]._finish(process, inputFile, debug=debug)
+                if cache: cache.put(keys[i], rtos[i])
+    finally:
+        for i, nprocs, inputFile, process in running:
+            if process.poll() is None: process.kill()
+
+    # Repeated runs get the outputs of the one that was traced
+    for i, rto in enumerate(rtos):
+        first = keys.index(keys[i])
+        if first != i and outputs[first] != outputs[i]:
+            if cache: cache.get(keys[i], rto)
+            else: _copyOutputs(rtos[first], rto)
+
+    return rtos
+
+
 #########################################################################
 # Electron densities
 #########################################################################
@@ -326,6 +657,7 @@ class Edens(object):
         * **readFrom** (str): edens.dat file to read the rays from
         * [**site**] (:class:`pydarn.radar.site): radar site object
         * [**radar**] (:class:`pydarn.radar.radar): radar object
+        * [**memmap**] (bool): map the density blocks from the file instead of reading them into memory
         * [**debug**] (bool): verbose mode
     **Methods**:
         * :func:`Edens.readEdens`
@@ -333,62 +665,74 @@ class Edens(object):
     """
     def __init__(self, readFrom, 
         site=None, radar=None, 
-        debug=False):
+        memmap=False, debug=False):
         self.readFrom = readFrom
-        self.edens = {}
 
         self.name = ''
         if radar:
             self.name = radar.code[0].upper()
 
         # Read rays
-        self.readEdens(site=site, debug=debug)
+        self.readEdens(site=site, memmap=memmap, debug=debug)
 
 
-    def readEdens(self, site=None, debug=False):
+    def __getattr__(self, name):
+        # The nested dictionary view is only built when first used
+        if name == 'edens' and 'index' in self.__dict__:
+            self.edens = _nest(self.times, self.beams, None, self.index, 
+                lambda i: {'th': self.th[i], 'nel': self.nel[i], 'dip': self.dip[i]})
+            return self.edens
+        raise AttributeError(name)
+
+
+    def readEdens(self, site=None, memmap=False, debug=False):
         """Read edens.dat fortran output
 
+        Each profile is a fixed size record, so the whole file is read (or 
+        mapped) as a single structured array. The results are stored flat:
+
+            * **times**, **beams**: distinct times (datetime.datetime) and beams (azimuths if no site is given)
+            * **index**: one record per profile, with fields 'time' and 'beam' (indices into times and beams)
+            * **th** (nprof, 250): angular distance from the radar [rad]
+            * **nel** (nprof, 250, 250): electron density [m^-3], altitude along the first axis
+            * **dip** (nprof, 250, 2): magnetic dip and declination
+
+        The nested dictionary edens[time][beam] is built from views into 
+        these arrays when it is first used.
+
         **Args**:
             * [**site**] (pydarn.radar.radStrict.site): site object of current radar
+            * [**memmap**] (bool): map the records from the file instead of reading them into memory
             * [**debug**] (bool): print some i/o diagnostics
         **Returns**:
-            * Populate member edens :class:`rt.Edens`
+            * Populate members index, th, nel and dip of :class:`rt.Edens`
         """
-        from struct import unpack
-        import datetime as dt
-        from numpy import array
+        import numpy as np
+        from os import path
 
         # Read binary file
         with open(self.readFrom, 'rb') as f:
             if debug:
                 print self.readFrom+' header: '
             self.header = _readHeader(f, debug=debug)
-            self.edens = {}
-            while True:
-                bytes = f.read(2*4)
-                # Check for eof
-                if not bytes: break
-                # read hour and azimuth
-                hour, azim = unpack('2f', bytes)
-                # format time index
-                hour = hour - 25.
-                mm = self.header['mmdd']/100
-                dd = self.header['mmdd'] - mm*100
-                rtime = dt.datetime(self.header['year'], mm, dd) + dt.timedelta(hours=hour)
-                # format azimuth index (beam)
-                raz = site.azimToBeam(azim) if site else round(raz, 2)
-                # Initialize dicts
-                if rtime not in self.edens.keys(): self.edens[rtime] = {}
-                self.edens[rtime][raz] = {}
-                # Read edens dict
-                # self.edens[rtime][raz]['pos'] = array( unpack('{}f'.format(250*2), 
-                #     f.read(250*2*4)) )
-                self.edens[rtime][raz]['th'] = array( unpack('{}f'.format(250), 
-                    f.read(250*4)) )
-                self.edens[rtime][raz]['nel'] = array( unpack('{}f'.format(250*250), 
-                    f.read(250*250*4)) ).reshape((250,250), order='F')
-                self.edens[rtime][raz]['dip'] = array( unpack('{}f'.format(250*2), 
-                    f.read(250*2*4)) ).reshape((250,2), order='F')
+            if not memmap:
+                recs = np.fromfile(f, dtype=_edensDtype)
+        if memmap:
+            if path.getsize(self.readFrom) > _headerSize:
+                recs = np.memmap(self.readFrom, dtype=_edensDtype, mode='r', 
+                    offset=_headerSize)
+            else:
+                recs = np.zeros(0, dtype=_edensDtype)
+
+        self.times, self.beams, _, inds = _index(self.header, 
+            recs['hour'], recs['azim'], site=site)
+        self.index = np.zeros(len(recs), dtype=[('time', 'i4'), ('beam', 'i4')])
+        self.index['time'], self.index['beam'] = inds
+        # Blocks are written in fortran order
+        self.th = recs['th']
+        self.nel = recs['nel'].swapaxes(1, 2)
+        self.dip = recs['dip'].swapaxes(1, 2)
+        self.__dict__.pop('edens', None)
 
 
     def plot(self, time, beam=None, maxground=2000, maxalt=500,
@@ -491,26 +835,54 @@ class Scatter(object):
 
         # Read ground scatter
         if self.readGSFrom:
-            self.gsc = {}
             self.readGS(site=site, debug=debug)
 
         # Read ionospheric scatter
         if self.readISFrom:
-            self.isc = {}
             self.readIS(site=site, debug=debug)
 
 
+    def __getattr__(self, name):
+        # The nested dictionary views are only built when first used
+        if name == 'gsc' and 'gsIndex' in self.__dict__:
+            import numpy as np
+            # Group the scatter points of each time, beam and elevation
+            order = np.lexsort((self.gsIndex['elev'], self.gsIndex['beam'], 
+                self.gsIndex['time']))
+            keys = self.gsIndex[order]
+            bounds = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+            groups = np.split(order, bounds) if len(order) else []
+            self.gsc = _nest(self.times, self.beams, self.elevs, 
+                self.gsIndex[[g[0] for g in groups]], 
+                lambda i: dict((k, self.gs[k][groups[i]]) 
+                    for k in ('r', 'th', 'gran', 'lat', 'lon')))
+            return self.gsc
+        if name == 'isc' and 'isIndex' in self.__dict__:
+            def leaf(i):
+                o, n = self.isIndex['offset'][i], self.isIndex['nstp'][i]
+                out = dict((k, self.isSteps[k][o:o+n]) for k in self.isSteps.dtype.names)
+                out['nstp'] = n
+                return out
+            self.isc = _nest(self.times, self.beams, self.elevs, self.isIndex, leaf)
+            return self.isc
+        raise AttributeError(name)
+
+
     def readGS(self, site=None, debug=False):
         """Read gscat.dat fortran output
 
+        Ground scatter points are fixed size records, read at once into 
+        the structured array **gs** (fields 'hour', 'azim', 'elev', 'r', 
+        'th', 'gran', 'lat' and 'lon'). **gsIndex** holds the 'time', 
+        'beam' and 'elev' of each point as indices into **times**, 
+        **beams** and **elevs**, shared with the ionospheric scatter.
+
         **Args**:
             * [**site**] (pydarn.radar.radStrict.site): site object of current radar
             * [**debug**] (bool): print some i/o diagnostics
         **Returns**:
-            * Populate member isc :class:`rt.Scatter`
+            * Populate members gs and gsIndex :class:`rt.Scatter`
         """
-        from struct import unpack
-        import datetime as dt
         import numpy as np
 
         with open(self.readGSFrom, 'rb') as f:
@@ -518,100 +890,67 @@ class Scatter(object):
             if debug:
                 print self.readGSFrom+' header: '
             self.header = _readHeader(f, debug=debug)
-            # Then read ray data, one ray at a time
-            while True:
-                bytes = f.read(3*4)
-                # Check for eof
-                if not bytes: break
-                # read number of ray steps, time, azimuth and elevation
-                rhr, raz, rel = unpack('3f', bytes)
-                # Read reminder of the record
-                rr, tht, gran, lat, lon  = unpack('5f', f.read(5*4))
-                # Convert azimuth to beam number
-                raz = site.azimToBeam(raz) if site else np.round(raz, 2)
-                # Adjust rel to 2 decimal
-                rel = np.around(rel, 2)
-                # convert time to python datetime
-                rhr = rhr - 25.
-                mm = self.header['mmdd']/100
-                dd = self.header['mmdd'] - mm*100
-                rtime = dt.datetime(self.header['year'], mm, dd) + dt.timedelta(hours=rhr)
-                # Create new entries in rays dict
-                if rtime not in self.gsc.keys(): self.gsc[rtime] = {}
-                if raz not in self.gsc[rtime].keys(): self.gsc[rtime][raz] = {}
-                if rel not in self.gsc[rtime][raz].keys(): 
-                    self.gsc[rtime][raz][rel] = {
-                        'r': np.empty(0),
-                        'th': np.empty(0),
-                        'gran': np.empty(0),
-                        'lat': np.empty(0),
-                        'lon': np.empty(0) }
-                self.gsc[rtime][raz][rel]['r'] = np.append( self.gsc[rtime][raz][rel]['r'], rr )
-                self.gsc[rtime][raz][rel]['th'] = np.append( self.gsc[rtime][raz][rel]['th'], tht )
-                self.gsc[rtime][raz][rel]['gran'] = np.append( self.gsc[rtime][raz][rel]['gran'], gran )
-                self.gsc[rtime][raz][rel]['lat'] = np.append( self.gsc[rtime][raz][rel]['lat'], lat )
-                self.gsc[rtime][raz][rel]['lon'] = np.append( self.gsc[rtime][raz][rel]['lon'], lon )
+            self.gs = np.fromfile(f, dtype=_gsDtype)
+        self.gsIndex = np.zeros(len(self.gs), 
+            dtype=[('time', 'i4'), ('beam', 'i4'), ('elev', 'i4')])
+        self._indexScatter(site=site)
 
 
     def readIS(self, site=None, debug=False):
         """Read iscat.dat fortran output
 
+        The scatter of all rays is stored concatenated in the structured 
+        array **isSteps** (fields 'r', 'th', 'gran', 'rel', 'w', 'nr', 
+        'lat', 'lon' and 'h'). **isIndex** has one record per ray with the 
+        'time', 'beam' and 'elev' indices (into **times**, **beams** and 
+        **elevs**), and the 'nstp' scatter points of the ray starting at 
+        'offset' in isSteps.
+
         **Args**:
             * [**site**] (pydarn.radar.radStrict.site): site object of current radar
             * [**debug**] (bool): print some i/o diagnostics
         **Returns**:
-            * Populate member isc :class:`rt.Scatter`
+            * Populate members isSteps and isIndex :class:`rt.Scatter`
         """
-        from struct import unpack
-        import datetime as dt
-        from numpy import around, array
+        import numpy as np
 
-        with open(self.readISFrom, 'rb') as f:
-            # read header
-            if debug:
-                print self.readISFrom+' header: '
-            self.header = _readHeader(f, debug=debug)
-            # Then read ray data, one ray at a time
-            while True:
-                bytes = f.read(4*4)
-                # Check for eof
-                if not bytes: break
-                # read number of ray steps, time, azimuth and elevation
-                nstp, rhr, raz, rel = unpack('4f', bytes)
-                nstp = int(nstp)
-                # Convert azimuth to beam number
-                raz = site.azimToBeam(raz) if site else around(raz, 2)
-                # Adjust rel to 2 decimal
-                rel = around(rel, 2)
-                # convert time to python datetime
-                rhr = rhr - 25.
-                mm = self.header['mmdd']/100
-                dd = self.header['mmdd'] - mm*100
-                rtime = dt.datetime(self.header['year'], mm, dd) + dt.timedelta(hours=rhr)
-                # Create new entries in rays dict
-                if rtime not in self.isc.keys(): self.isc[rtime] = {}
-                if raz not in self.isc[rtime].keys(): self.isc[rtime][raz] = {}
-                self.isc[rtime][raz][rel] = {}
-                # Read to paths dict
-                self.isc[rtime][raz][rel]['nstp'] = nstp
-                self.isc[rtime][raz][rel]['r'] = array( unpack('{}f'.format(nstp), 
-                    f.read(nstp*4)) )
-                self.isc[rtime][raz][rel]['th'] = array( unpack('{}f'.format(nstp), 
-                    f.read(nstp*4)) )
-                self.isc[rtime][raz][rel]['gran'] = array( unpack('{}f'.format(nstp), 
-                    f.read(nstp*4)) )
-                self.isc[rtime][raz][rel]['rel'] = array( unpack('{}f'.format(nstp), 
-                    f.read(nstp*4)) )
-                self.isc[rtime][raz][rel]['w'] = array( unpack('{}f'.format(nstp), 
-                    f.read(nstp*4)) )
-                self.isc[rtime][raz][rel]['nr'] = array( unpack('{}f'.format(nstp), 
-                    f.read(nstp*4)) )
-                self.isc[rtime][raz][rel]['lat'] = array( unpack('{}f'.format(nstp), 
-                    f.read(nstp*4)) )
-                self.isc[rtime][raz][rel]['lon'] = array( unpack('{}f'.format(nstp), 
-                    f.read(nstp*4)) )
-                self.isc[rtime][raz][rel]['h'] = array( unpack('{}f'.format(nstp), 
-                    f.read(nstp*4)) )
+        names = ('r', 'th', 'gran', 'rel', 'w', 'nr', 'lat', 'lon', 'h')
+        if debug:
+            print self.readISFrom+' header: '
+        self.header, meta, offsets, data = _readRecords(self.readISFrom, 
+            len(names), debug=debug)
+        self.isSteps = np.zeros(data.shape[1], dtype=[(n, 'f4') for n in names])
+        for n, d in zip(names, data):
+            self.isSteps[n] = d
+        self.isIndex = np.zeros(len(meta), 
+            dtype=[('time', 'i4'), ('beam', 'i4'), ('elev', 'i4'), 
+                ('nstp', 'i4'), ('offset', 'i8'), 
+                ('hour', 'f4'), ('azim', 'f4'), ('el', 'f4')])
+        self.isIndex['nstp'] = meta[:, 0]
+        self.isIndex['offset'] = offsets[:-1]
+        self.isIndex['hour'], self.isIndex['azim'], self.isIndex['el'] = meta[:, 1:].T
+        self._indexScatter(site=site)
+
+
+    def _indexScatter(self, site=None):
+        """Index ground and ionospheric scatter on common times, beams and elevations
+        """
+        import numpy as np
+
+        hour, azim, elev = [], [], []
+        if 'gs' in self.__dict__:
+            hour.append(self.gs['hour']); azim.append(self.gs['azim']); elev.append(self.gs['elev'])
+        if 'isIndex' in self.__dict__:
+            hour.append(self.isIndex['hour']); azim.append(self.isIndex['azim']); elev.append(self.isIndex['el'])
+        self.times, self.beams, self.elevs, inds = _index(self.header, 
+            np.concatenate(hour), np.concatenate(azim), np.concatenate(elev), 
+            site=site, decimals=2)
+        ngs = len(self.gs) if 'gs' in self.__dict__ else 0
+        for k, ind in zip(('time', 'beam', 'elev'), inds):
+            if ngs: self.gsIndex[k] = ind[:ngs]
+            if 'isIndex' in self.__dict__: self.isIndex[k] = ind[ngs:]
+        self.__dict__.pop('gsc', None)
+        self.__dict__.pop('isc', None)
 
 
     def plot(self, time, beam=None, maxground=2000, maxalt=500,
@@ -743,7 +1082,6 @@ class Rays(object):
         site=None, radar=None, 
         saveToAscii=None, debug=False):
         self.readFrom = readFrom
-        self.paths = {}
 
         self.name = ''
         if radar:
@@ -757,56 +1095,56 @@ class Rays(object):
             self.writeToAscii(saveToAscii)
 
 
+    def __getattr__(self, name):
+        # The nested dictionary view is only built when first used
+        if name == 'paths' and 'index' in self.__dict__:
+            def leaf(i):
+                o, n = self.index['offset'][i], self.index['nrstep'][i]
+                out = dict((k, self.steps[k][o:o+n]) for k in self.steps.dtype.names)
+                out['nrstep'] = n
+                return out
+            self.paths = _nest(self.times, self.beams, self.elevs, self.index, leaf)
+            return self.paths
+        raise AttributeError(name)
+
+
     def readRays(self, site=None, debug=False):
         """Read rays.dat fortran output
 
+        The file is read at once with numpy and the rays are stored flat:
+
+            * **times**, **beams**, **elevs**: distinct times (datetime.datetime), beams (azimuths if no site is given) and elevations
+            * **index**: one record per ray, with fields 'time', 'beam' and 'elev' (indices into the arrays above), and the 'nrstep' steps of the ray starting at 'offset' in steps
+            * **steps**: steps of all rays, concatenated, with fields 'r', 'th', 'gran' and 'nr'
+
+        The nested dictionary paths[time][beam][elevation] is built from 
+        views into these arrays when it is first used.
+
         **Args**:
             * [**site**] (pydarn.radar.radStrict.site): site object of current radar
             * [**debug**] (bool): print some i/o diagnostics
         **Returns**:
-            * Populate member paths :class:`rt.Rays`
+            * Populate members index and steps :class:`rt.Rays`
         """
-        from struct import unpack
-        import datetime as dt
-        from numpy import round, array
+        import numpy as np
 
-        # Read binary file
-        with open(self.readFrom, 'rb') as f:
-            # read header
-            if debug:
-                print self.readFrom+' header: '
-            self.header = _readHeader(f, debug=debug)
-            # Then read ray data, one ray at a time
-            while True:
-                bytes = f.read(4*4)
-                # Check for eof
-                if not bytes: break
-                # read number of ray steps, time, azimuth and elevation
-                nrstep, rhr, raz, rel = unpack('4f', bytes)
-                nrstep = int(nrstep)
-                # Convert azimuth to beam number
-                raz = site.azimToBeam(raz) if site else round(raz, 2)
-                # convert time to python datetime
-                rhr = rhr - 25.
-                mm = self.header['mmdd']/100
-                dd = self.header['mmdd'] - mm*100
-                rtime = dt.datetime(self.header['year'], mm, dd) + dt.timedelta(hours=rhr)
-                # Create new entries in rays dict
-                if rtime not in self.paths.keys(): self.paths[rtime] = {}
-                if raz not in self.paths[rtime].keys(): self.paths[rtime][raz] = {}
-                self.paths[rtime][raz][rel] = {}
-                # Read to paths dict
-                self.paths[rtime][raz][rel]['nrstep'] = nrstep
-                self.paths[rtime][raz][rel]['r'] = array( unpack('{}f'.format(nrstep), 
-                    f.read(nrstep*4)) )
-                self.paths[rtime][raz][rel]['th'] = array( unpack('{}f'.format(nrstep), 
-                    f.read(nrstep*4)) )
-                self.paths[rtime][raz][rel]['gran'] = array( unpack('{}f'.format(nrstep), 
-                    f.read(nrstep*4)) )
-                # self.paths[rtime][raz][rel]['pran'] = array( unpack('{}f'.format(nrstep), 
-                #     f.read(nrstep*4)) )
-                self.paths[rtime][raz][rel]['nr'] = array( unpack('{}f'.format(nrstep), 
-                    f.read(nrstep*4)) )
+        names = ('r', 'th', 'gran', 'nr')
+        if debug:
+            print self.readFrom+' header: '
+        self.header, meta, offsets, data = _readRecords(self.readFrom, 
+            len(names), debug=debug)
+        self.steps = np.zeros(data.shape[1], dtype=[(n, 'f4') for n in names])
+        for n, d in zip(names, data):
+            self.steps[n] = d
+        self.times, self.beams, self.elevs, inds = _index(self.header, 
+            meta[:, 1], meta[:, 2], meta[:, 3], site=site)
+        self.index = np.zeros(len(meta), 
+            dtype=[('time', 'i4'), ('beam', 'i4'), ('elev', 'i4'), 
+                ('nrstep', 'i4'), ('offset', 'i8')])
+        self.index['time'], self.index['beam'], self.index['elev'] = inds
+        self.index['nrstep'] = meta[:, 0]
+        self.index['offset'] = offsets[:-1]
+        self.__dict__.pop('paths', None)
 
 
     def writeToAscii(self, fname):
@@ -978,6 +1316,169 @@ class Rays(object):
 #########################################################################
 # Misc.
 #########################################################################
+# Size of the header of the *.dat files [bytes]
+_headerSize = 3*4 + 9*4 + 3*4 + 5*4 + 10 + 100
+
+# Records of edens.dat: hour, azimuth, then 250 (of 500) points in distance, 
+# a 250x250 (of 500x500) density block and the dip and declination, 
+# each in fortran order
+_edensDtype = [('hour', 'f4'), ('azim', 'f4'), 
+    ('th', 'f4', (250,)), ('nel', 'f4', (250, 250)), ('dip', 'f4', (2, 250))]
+
+# Records of gscat.dat
+_gsDtype = [('hour', 'f4'), ('azim', 'f4'), ('elev', 'f4'), 
+    ('r', 'f4'), ('th', 'f4'), ('gran', 'f4'), ('lat', 'f4'), ('lon', 'f4')]
+
+
+def _getCache(cache):
+    """Cache to use for an RtRun cache argument (None if caching is off)
+    """
+    from rtCache import defaultCache
+
+    if cache is True: return defaultCache()
+    return cache if cache else None
+
+
+def _getBackend(backend):
+    """Execution backend to use: 'mpi' or 'pool'
+    """
+    from distutils.spawn import find_executable
+
+    if backend == 'auto':
+        backend = 'mpi' if find_executable('mpiexec') else 'pool'
+    if backend not in ('mpi', 'pool'):
+        raise ValueError('Unknown backend {}'.format(backend))
+    return backend
+
+
+def _runCommand(command):
+    """Run a command, returning its exit code and output
+    """
+    import subprocess as subp
+
+    process = subp.Popen(command, shell=False, stdout=subp.PIPE, stderr=subp.STDOUT)
+    output = process.communicate()[0]
+    return process.returncode, output
+
+
+def _copyOutputs(src, dst):
+    """Copy the output files of RtRun src to RtRun dst
+    """
+    import shutil
+    from os import path
+
+    for name in ['rays', 'edens', 'gscat', 'iscat']:
+        shutil.copyfile(path.join(src.outDir, '{}.{}.dat'.format(name, src.fExt)), 
+            path.join(dst.outDir, '{}.{}.dat'.format(name, dst.fExt)))
+
+
+def _readRecords(fName, nFields, debug=False):
+    """Read the variable length records of rays.dat or iscat.dat
+
+    Each record is the number of steps n, the hour, azimuth and elevation, 
+    then nFields blocks of n values.
+
+    **Args**:
+        * **fName** (str): file name
+        * **nFields** (int): number of blocks per record
+        * [**debug**] (bool): print some i/o diagnostics
+    **Returns**:
+        * **header**: a dictionary of header values
+        * **meta** (nrec, 4): number of steps, hour, azimuth and elevation of each record
+        * **offsets** (nrec+1): start of each record in data
+        * **data** (nFields, nsteps): values of all records, concatenated
+    """
+    import numpy as np
+
+    with open(fName, 'rb') as f:
+        header = _readHeader(f, debug=debug)
+        raw = np.fromfile(f, dtype='float32')
+
+    # Only the number of steps of each record is looked at here
+    starts = []
+    pos = 0
+    while pos < len(raw):
+        starts.append(pos)
+        pos += 4 + nFields*int(raw[pos])
+    starts = np.array(starts, dtype=int)
+
+    meta = raw[starts[:, np.newaxis] + np.arange(4)].reshape(-1, 4)
+    nstep = meta[:, 0].astype(int)
+    offsets = np.zeros(len(starts)+1, dtype=int)
+    offsets[1:] = np.cumsum(nstep)
+    # Position of every step of the first block in the file, 
+    # the other blocks follow n values later
+    first = np.arange(offsets[-1]) + np.repeat(starts + 4 - offsets[:-1], nstep)
+    n = np.repeat(nstep, nstep)
+    data = raw[first + n*np.arange(nFields)[:, np.newaxis]]
+
+    return header, meta, offsets, data
+
+
+def _index(header, hour, azim, elev=None, site=None, decimals=None):
+    """Index records by time, beam and elevation
+
+    **Args**:
+        * **header** (dict): header of fortran output file
+        * **hour** (ndarray): hour (+25 for UT) of each record
+        * **azim** (ndarray): azimuth of each record
+        * [**elev**] (ndarray): elevation of each record
+        * [**site**] (pydarn.radar.radStrict.site): azimuths are converted to beams if given
+        * [**decimals**] (int): round elevations to this many decimals
+    **Returns**:
+        * **times** (list): distinct times (datetime.datetime)
+        * **beams** (ndarray): distinct beams (azimuths rounded to 2 decimals if no site is given)
+        * **elevs** (ndarray): distinct elevations (None if elev is not given)
+        * **inds** (list): indices of each record into times, beams (and elevs)
+    """
+    import datetime as dt
+    import numpy as np
+
+    mm = header['mmdd']/100
+    dd = header['mmdd'] - mm*100
+    day = dt.datetime(header['year'], mm, dd)
+
+    uhour, itime = np.unique(hour, return_inverse=True)
+    times = [day + dt.timedelta(hours=float(h) - 25.) for h in uhour]
+
+    uazim, iazim = np.unique(azim, return_inverse=True)
+    uazim = uazim.astype('float64')
+    beams, ibeam = np.unique(site.azimToBeam(uazim) if site else np.round(uazim, 2), 
+        return_inverse=True)
+    inds = [itime, ibeam[iazim]]
+
+    elevs = None
+    if elev is not None:
+        elev = np.asarray(elev, dtype='float64')
+        if decimals is not None: elev = np.round(elev, decimals)
+        elevs, ielev = np.unique(elev, return_inverse=True)
+        inds.append(ielev)
+
+    return times, beams, elevs, inds
+
+
+def _nest(times, beams, elevs, index, leaf):
+    """Nested dictionary [time][beam]([elevation]) view of indexed records
+
+    **Args**:
+        * **times**, **beams**, **elevs**: distinct values (elevs may be None)
+        * **index**: record array with fields 'time', 'beam' (and 'elev')
+        * **leaf**: function returning the dictionary entry of record i
+    **Returns**:
+        * **nested** (dict)
+    """
+    beams = beams.tolist()
+    nested = {}
+    if elevs is None:
+        for i, (it, ib) in enumerate(zip(index['time'], index['beam'])):
+            nested.setdefault(times[it], {})[beams[ib]] = leaf(i)
+    else:
+        elevs = elevs.tolist()
+        for i, (it, ib, ie) in enumerate(zip(index['time'], index['beam'], index['elev'])):
+            nested.setdefault(times[it], {}).setdefault(beams[ib], {})[elevs[ie]] = leaf(i)
+    return nested
+
+
 def _readHeader(fObj, debug=False):
     """Read the header part of ray-tracing *.dat files
 
@@ -0,0 +1,196 @@
+# Copyright (C) 2012  VT SuperDARN Lab
+# Full license can be found in LICENSE.txt
+"""
+*********************
+**Module**: models.raydarn.rtCache
+*********************
+Cache of raytracing outputs
+
+Each entry is keyed by a hash of the input file given to the fortran code
+(radar position, azimuths, elevations, frequency, hops, date, hours and
+ionospheric parameters), so that identical runs are only traced once. The
+rays, edens, gscat and iscat files of a run are kept as they were written.
+
+The electron density arrays the fortran code builds with IRI for each hour
+and azimuth can be kept as well (see :func:`rtCache.edensDir`). They only
+depend on the radar position, the date and the IRI options, so that runs
+at other frequencies or elevations reuse them.
+
+**Classes**:
+    * :class:`models.raydarn.rtCache.rtCache`: on-disk cache of raytracing outputs
+
+"""
+
+# Bump when the fortran outputs change so that old entries are not reused
+_version = 1
+
+# Bump when the electron density arrays change (e.g. new IRI version)
+_edensVersion = 1
+
+# Lines of the input file the electron densities depend on: transmitter 
+# position, year, mmdd, hmf2 and nmf2
+_edensLines = [0, 1, 10, 11, 15, 16]
+
+# Output files of a run, rays last: it marks an entry as complete
+_outputs = ['edens', 'gscat', 'iscat', 'rays']
+
+# Default cache, created on first use
+_defaultCache = None
+
+
+class rtCache(object):
+    """Cache of :class:`models.raydarn.rt.RtRun` outputs keyed by their inputs
+
+    **Args**:
+        * [**cacheDir**] (str): defaults to $DAVIT_TMPDIR/raydarn or /tmp/sd/raydarn
+    **Methods**:
+        * :func:`rtCache.key`
+        * :func:`rtCache.get`
+        * :func:`rtCache.put`
+        * :func:`rtCache.edensDir`
+        * :func:`rtCache.clear`
+
+    **Example**:
+        ::
+
+            # Traced the first time, copied from the cache afterwards
+            cache = raydarn.rtCache()
+            rto = raydarn.RtRun(sTime, rCode='bks', beam=12, cache=cache)
+
+    """
+    def __init__(self, cacheDir=None):
+        import os
+
+        if cacheDir is None:
+            try: cacheDir = os.path.join(os.environ['DAVIT_TMPDIR'], 'raydarn')
+            except KeyError: cacheDir = '/tmp/sd/raydarn'
+        if not os.path.exists(cacheDir): os.makedirs(cacheDir)
+        self.cacheDir = cacheDir
+        self.hits = 0
+        self.misses = 0
+
+
+    @staticmethod
+    def key(rto):
+        """Hash of the fortran input of a run
+
+        **Args**:
+            * **rto** (:class:`rt.RtRun`): run (it does not need to have been executed)
+        **Returns**:
+            * **key** (str)
+        """
+        import hashlib
+
+        h = hashlib.sha1()
+        h.update('rtFort v{}\n'.format(_version))
+        h.update(rto._inputText())
+        return h.hexdigest()
+
+
+    def _fileName(self, key, name):
+        import os
+        return os.path.join(self.cacheDir, '{}.{}.dat'.format(key, name))
+
+
+    def has(self, key):
+        """True if the outputs for key are in the cache
+        """
+        import os
+        return os.path.isfile(self._fileName(key, _outputs[-1]))
+
+
+    def get(self, key, rto):
+        """Copy the cached outputs for key to the output directory of a run
+
+        **Args**:
+            * **key** (str): see :func:`rtCache.key`
+            * **rto** (:class:`rt.RtRun`): run to fill
+        **Returns**:
+            * True if the entry was found
+        """
+        import os
+        import shutil
+
+        if not self.has(key):
+            self.misses += 1
+            return False
+        try:
+            for name in _outputs:
+                shutil.copyfile(self._fileName(key, name),
+                    os.path.join(rto.outDir, '{}.{}.dat'.format(name, rto.fExt)))
+        except (IOError, OSError):
+            self.misses += 1
+            return False
+
+        self.hits += 1
+        return True
+
+
+    def put(self, key, rto):
+        """Store the outputs of a run under key
+        """
+        import os
+        import shutil
+
+        for name in _outputs:
+            # copy then rename so that readers never see partial files
+            fName = self._fileName(key, name)
+            tmpName = '{}.{}.tmp'.format(fName, os.getpid())
+            shutil.copyfile(os.path.join(rto.outDir, '{}.{}.dat'.format(name, rto.fExt)),
+                tmpName)
+            os.rename(tmpName, fName)
+
+
+    def edensDir(self, rto):
+        """Directory where the fortran code keeps the electron densities of a run
+
+        The fortran code saves the arrays of each hour and azimuth there 
+        and reads them back instead of calling IRI when they are needed 
+        again.
+
+        **Args**:
+            * **rto** (:class:`rt.RtRun`): run (it does not need to have been executed)
+        **Returns**:
+            * **edensDir** (str): directory name, with a trailing separator
+        """
+        import os
+        import hashlib
+
+        lines = rto._inputText().splitlines()
+        h = hashlib.sha1()
+        h.update('IRI_ARR v{}\n'.format(_edensVersion))
+        for i in _edensLines: h.update(lines[i][:8])
+        edensDir = os.path.join(os.path.abspath(self.cacheDir), 'edens', h.hexdigest(), '')
+        if len(edensDir) > 220:
+            raise ValueError('Cache directory name too long for the fortran code: {}'.format(
+                edensDir))
+        if not os.path.exists(edensDir):
+            try: os.makedirs(edensDir)
+            except OSError: pass
+        return edensDir
+
+
+    def clear(self, edens=True):
+        """Remove every cached run
+
+        **Args**:
+            * [**edens**] (bool): remove the cached electron densities as well
+        """
+        import os
+        import glob
+        import shutil
+
+        for f in glob.glob(os.path.join(self.cacheDir, '*.dat')):
+            try: os.remove(f)
+            except OSError: pass
+        if edens:
+            shutil.rmtree(os.path.join(self.cacheDir, 'edens'), ignore_errors=True)
+
+
+def defaultCache():
+    """The cache used by RtRun(..., cache=True)
+    """
+    global _defaultCache
+
+    if _defaultCache is None: _defaultCache = rtCache()
+    return _defaultCache
@@ -8,26 +8,99 @@
 This modules containes the following object(s):
 
     * :class:`models.tsyganenko.tsygTrace`: Wraps fortran subroutines in one convenient class
+    * :class:`models.tsyganenko.traceCache`: Content-keyed cache of traces
+    * :class:`models.tsyganenko.fpTable`: Footpoints precomputed on a grid, for one parameter bin
+    * :func:`models.tsyganenko.fpMap`: Map points to their footpoints using cached tables
   
 This module contains the following module(s):
 
     * :mod:`models.tsyganenko.tsygFort`: Fortran subroutines
+    * :mod:`models.tsyganenko.traceCache`: Compact on-disk storage of traces
+    * :mod:`models.tsyganenko.fpTable`: Footpoint mapping tables
  
 *******************************
 """
 
 import tsygFort
+from traceCache import traceCache
+from fpTable import fpTable, fpMap
+
+
+def _traceGroups(args):
+    """
+|   Trace the points of one or more epoch groups (runs in the pool workers)
+|
+|   **INPUTS**:
+|       **args**: (groups, vswgse, parmod, lmax, rmax, rmin, dsmax, err)
+|           where groups is a list of (time tuple, indices, lat, lon, rho)
+|           and a time tuple is (year, day of year, hour, minute, second)
+|
+|   **OUTPUTS**:
+|       list of (index, gsw start point, NH footpoint, SH footpoint,
+|       northward trace, southward trace)
+    """
+    from numpy import radians, degrees, array
+
+    groups, vswgse, parmod, lmax, rmax, rmin, dsmax, err = args
+    # Declare the same Re as used in Tsyganenko models [km]
+    Re = 6371.2
+    inmod = 'IGRF_GSW_08'
+    exmod = 'T96_01'
+
+    out = []
+    for tt, inds, lats, lons, rhos in groups:
+        # This has to be called first, once for all the points of this epoch
+        tsygFort.recalc_08(tt[0], tt[1], tt[2], tt[3], tt[4],
+                            vswgse[0], vswgse[1], vswgse[2])
+
+        for ip, lat, lon, rho in zip(inds, lats, lons, rhos):
+            # Convert lat,lon to geographic cartesian and then gsw
+            r, theta, phi, xgeo, ygeo, zgeo = tsygFort.sphcar_08(
+                                                    rho/Re, radians(90.-lat), radians(lon),
+                                                    0., 0., 0.,
+                                                    1)
+            xgeo, ygeo, zgeo, xgsw, ygsw, zgsw = tsygFort.geogsw_08(
+                                                        xgeo, ygeo, zgeo,
+                                                        0. ,0. ,0. ,
+                                                        1)
+
+            # Trace field line, first towards southern hemisphere
+            res = [ip, (xgsw, ygsw, zgsw)]
+            traces = []
+            for mapto in [-1, 1]:
+                xfgsw, yfgsw, zfgsw, xarr, yarr, zarr, l = tsygFort.trace_08( xgsw, ygsw, zgsw,
+                                                                mapto, dsmax, err, rmax, rmin, 0,
+                                                                parmod, exmod, inmod,
+                                                                lmax )
+
+                # Convert back to spherical geographic coords
+                xfgeo, yfgeo, zfgeo, xfgsw, yfgsw, zfgsw  = tsygFort.geogsw_08(
+                                                                    0. ,0. ,0. ,
+                                                                    xfgsw, yfgsw, zfgsw,
+                                                                    -1)
+                geoR, geoColat, geoLon, xgeo, ygeo, zgeo = tsygFort.sphcar_08(
+                                                                    0., 0., 0.,
+                                                                    xfgeo, yfgeo, zfgeo,
+                                                                    -1)
+                res.append((90. - degrees(geoColat), degrees(geoLon), geoR*Re))
+                traces.append(array([xarr[0:l], yarr[0:l], zarr[0:l]]))
+            out.append(res + traces)
+
+    return out
+
 
 class tsygTrace(object):
     def __init__(self, lat=None, lon=None, rho=None, filename=None, 
         coords='geo', datetime=None,
         vswgse=[-400.,0.,0.], pdyn=2., dst=-5., byimf=0., bzimf=-5.,
-        lmax=5000, rmax=60., rmin=1., dsmax=0.01, err=0.000001):
+        lmax=5000, rmax=60., rmin=1., dsmax=0.01, err=0.000001, nProcs=1,
+        cache=False):
         """
 |   **PACKAGE**: models.tsyganenko.trace
 |   **FUNCTION**: trace(lat, lon, rho, coords='geo', datetime=None,
 |        vswgse=[-400.,0.,0.], Pdyn=2., Dst=-5., ByIMF=0., BzIMF=-5.
-|        lmax=5000, rmax=60., rmin=1., dsmax=0.01, err=0.000001)
+|        lmax=5000, rmax=60., rmin=1., dsmax=0.01, err=0.000001, nProcs=1,
+|        cache=False)
 |   **PURPOSE**: trace magnetic field line(s) from point(s)
 |
 |   **INPUTS**:
@@ -47,6 +120,13 @@ class tsygTrace(object):
 |       **[rmin]**: lower trace boundary in Re
 |       **[dsmax]**: maximum tracing step size
 |       **[err]**: tracing step tolerance
+|       **[nProcs]**: number of processes tracing in parallel (None for
+|           the number of CPUs). Points sharing the same time are always
+|           traced together after a single call to recalc_08.
+|       **[cache]**: True to use the default :class:`traceCache`, or a
+|           :class:`traceCache` object. Traces with the same inputs are
+|           then read back instead of recomputed (field lines only when
+|           they are used).
 |
 |   **OUTPUTS**:
 |       Elements of this object:
@@ -96,12 +176,33 @@ trace = tsyganenko.tsygTrace(filename='trace.dat')
             iTest = self.__test_valid__()
             if not iTest: self.__del__()
 
-            self.trace()
+            if cache is True:
+                import traceCache as tc
+                cache = tc.defaultCache()
+            if cache:
+                self.lmax, self.rmax, self.rmin = lmax, rmax, rmin
+                self.dsmax, self.err = dsmax, err
+                key = cache.key(self)
+                if cache.get(key, self, lines=cache.lines): return
+
+            self.trace(lmax=lmax, rmax=rmax, rmin=rmin, dsmax=dsmax, err=err,
+                nProcs=nProcs)
+            if cache: cache.put(key, self)
 
         elif filename:
             self.load(filename)
 
 
+    def __getattr__(self, name):
+        """
+|   Read the field lines of a trace loaded from a traceCache on first use
+        """
+        if name in ['xTrace', 'yTrace', 'zTrace'] and self.__dict__.get('_linesFile'):
+            traceCache.loadLines(self, self.__dict__.pop('_linesFile'))
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+
     def __test_valid__(self):
         """
 |   Test the validity of input arguments to the tsygTrace class and trace method
@@ -136,15 +237,16 @@ trace = tsyganenko.tsygTrace(filename='trace.dat')
 
     def trace(self, lat=None, lon=None, rho=None, coords=None, datetime=None,
         vswgse=None, pdyn=None, dst=None, byimf=None, bzimf=None,
-        lmax=5000, rmax=60., rmin=1., dsmax=0.01, err=0.000001):
+        lmax=5000, rmax=60., rmin=1., dsmax=0.01, err=0.000001, nProcs=1):
         """
 |   See tsygTrace for a description of each parameter
 |   Any unspecified parameter default to the one stored in the object
-|   Unspecified lmax, rmax, rmin, dsmax, err has a set default value
+|   Unspecified lmax, rmax, rmin, dsmax, err, nProcs has a set default value
 |
 |   Written by Sebastien 2012-10
         """
-        from numpy import radians, degrees, zeros
+        from numpy import zeros
+        from multiprocessing import Pool, cpu_count
 
         # Store existing values of class attributes in case something is wrong
         # and we need to revert back to them
@@ -191,92 +293,91 @@ trace = tsyganenko.tsygTrace(filename='trace.dat')
             if vswgse: self.vswgse = _vswgse
             if not datetime==None: self.datetime = _datetime
 
-        # Declare the same Re as used in Tsyganenko models [km]
-        Re = 6371.2
-        
+        # Keep the tracing parameters with the results
+        self.lmax = lmax
+        self.rmax = rmax
+        self.rmin = rmin
+        self.dsmax = dsmax
+        self.err = err
+
         # Initialize trace array
-        self.l = zeros(len(lat))
+        self.l = zeros(len(lat), dtype=int)
         self.xTrace = zeros((len(lat),2*lmax))
         self.yTrace = self.xTrace.copy()
         self.zTrace = self.xTrace.copy()
-        self.xGsw = self.l.copy()
-        self.yGsw = self.l.copy()
-        self.zGsw = self.l.copy()
-        self.latNH = self.l.copy()
-        self.lonNH = self.l.copy()
-        self.rhoNH = self.l.copy()
-        self.latSH = self.l.copy()
-        self.lonSH = self.l.copy()
-        self.rhoSH = self.l.copy()
-
-        # And now iterate through the desired points
+        self.xGsw = zeros(len(lat))
+        self.yGsw = self.xGsw.copy()
+        self.zGsw = self.xGsw.copy()
+        self.latNH = self.xGsw.copy()
+        self.lonNH = self.xGsw.copy()
+        self.rhoNH = self.xGsw.copy()
+        self.latSH = self.xGsw.copy()
+        self.lonSH = self.xGsw.copy()
+        self.rhoSH = self.xGsw.copy()
+
+        # Group points by epoch (to the second, as used by recalc_08)
+        epochs = {}
         for ip in xrange(len(lat)):
-            # This has to be called first
-            tsygFort.recalc_08(datetime[ip].year,datetime[ip].timetuple().tm_yday,
-                                datetime[ip].hour,datetime[ip].minute,datetime[ip].second,
-                                vswgse[0],vswgse[1],vswgse[2])
-
-            # Convert lat,lon to geographic cartesian and then gsw
-            r, theta, phi, xgeo, ygeo, zgeo = tsygFort.sphcar_08(
-                                                    rho[ip]/Re, radians(90.-lat[ip]), radians(lon[ip]),
-                                                    0., 0., 0.,
-                                                    1)
-            if coords.lower() == 'geo':
-                xgeo, ygeo, zgeo, xgsw, ygsw, zgsw = tsygFort.geogsw_08(
-                                                            xgeo, ygeo, zgeo,
-                                                            0. ,0. ,0. ,
-                                                            1)
-            self.xGsw[ip] = xgsw
-            self.yGsw[ip] = ygsw
-            self.zGsw[ip] = zgsw
-
-            # Trace field line
-            inmod = 'IGRF_GSW_08'
-            exmod = 'T96_01'
-            parmod = [pdyn, dst, byimf, bzimf, 0, 0, 0, 0, 0, 0]
-            # First towards southern hemisphere
-            maptoL = [-1, 1]
-            for mapto in maptoL:
-                xfgsw, yfgsw, zfgsw, xarr, yarr, zarr, l = tsygFort.trace_08( xgsw, ygsw, zgsw,
-                                                                mapto, dsmax, err, rmax, rmin, 0,
-                                                                parmod, exmod, inmod,
-                                                                lmax )
+            tt = (datetime[ip].year, datetime[ip].timetuple().tm_yday,
+                  datetime[ip].hour, datetime[ip].minute, datetime[ip].second)
+            epochs.setdefault(tt, []).append(ip)
+
+        # Split the groups in chunks of about the same number of points
+        if nProcs is None: nProcs = cpu_count()
+        nProcs = max(1, min(nProcs, len(lat)))
+        chunkSize = max(1, len(lat)/(4*nProcs)) if nProcs > 1 else len(lat)
+        parmod = [pdyn, dst, byimf, bzimf, 0, 0, 0, 0, 0, 0]
+        chunks, groups, nPts = [], [], 0
+        for tt in sorted(epochs.keys()):
+            inds = epochs[tt]
+            for i0 in xrange(0, len(inds), chunkSize):
+                sub = inds[i0:i0+chunkSize]
+                groups.append((tt, sub, [lat[i] for i in sub],
+                    [lon[i] for i in sub], [rho[i] for i in sub]))
+                nPts += len(sub)
+                if nPts >= chunkSize:
+                    chunks.append((groups, vswgse, parmod, lmax, rmax, rmin, dsmax, err))
+                    groups, nPts = [], 0
+        if groups:
+            chunks.append((groups, vswgse, parmod, lmax, rmax, rmin, dsmax, err))
+
+        # Trace, in parallel if requested
+        if nProcs > 1 and len(chunks) > 1:
+            pool = Pool(processes=nProcs)
+            try:
+                results = pool.imap_unordered(_traceGroups, chunks)
+                self.__storeTraces(results)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            self.__storeTraces(_traceGroups(c) for c in chunks)
 
-                # Convert back to spherical geographic coords
-                xfgeo, yfgeo, zfgeo, xfgsw, yfgsw, zfgsw  = tsygFort.geogsw_08(
-                                                                    0. ,0. ,0. ,
-                                                                    xfgsw, yfgsw, zfgsw,
-                                                                    -1)
-                geoR, geoColat, geoLon, xgeo, ygeo, zgeo = tsygFort.sphcar_08(
-                                                                    0., 0., 0.,
-                                                                    xfgeo, yfgeo, zfgeo,
-                                                                    -1)
+        # Resize trace output to more minimum possible length
+        lMax = self.l.max() if len(lat) > 0 else 0
+        self.xTrace = self.xTrace[:,0:lMax]
+        self.yTrace = self.yTrace[:,0:lMax]
+        self.zTrace = self.zTrace[:,0:lMax]
 
-                # Get coordinates of traced point
-                if mapto == 1:
-                    self.latSH[ip] = 90. - degrees(geoColat)
-                    self.lonSH[ip] = degrees(geoLon)
-                    self.rhoSH[ip] = geoR*Re
-                elif mapto == -1:
-                    self.latNH[ip] = 90. - degrees(geoColat)
-                    self.lonNH[ip] = degrees(geoLon)
-                    self.rhoNH[ip] = geoR*Re
-                    
-                # Store trace
-                if mapto == -1:
-                    self.xTrace[ip,0:l] = xarr[l-1::-1]
-                    self.yTrace[ip,0:l] = yarr[l-1::-1]
-                    self.zTrace[ip,0:l] = zarr[l-1::-1]
-                elif mapto == 1:
-                    self.xTrace[ip,self.l[ip]:self.l[ip]+l] = xarr[0:l]
-                    self.yTrace[ip,self.l[ip]:self.l[ip]+l] = yarr[0:l]
-                    self.zTrace[ip,self.l[ip]:self.l[ip]+l] = zarr[0:l]
-                self.l[ip] += l
 
-        # Resize trace output to more minimum possible length
-        self.xTrace = self.xTrace[:,0:self.l.max()]
-        self.yTrace = self.yTrace[:,0:self.l.max()]
-        self.zTrace = self.zTrace[:,0:self.l.max()]
+    def __storeTraces(self, results):
+        """
+|   Write the output of _traceGroups into the preallocated arrays
+        """
+        for chunk in results:
+            for ip, gsw, nh, sh, north, south in chunk:
+                self.xGsw[ip], self.yGsw[ip], self.zGsw[ip] = gsw
+                self.latNH[ip], self.lonNH[ip], self.rhoNH[ip] = nh
+                self.latSH[ip], self.lonSH[ip], self.rhoSH[ip] = sh
+                # Northward trace is stored backwards, followed by the southward one
+                ln, ls = north.shape[1], south.shape[1]
+                self.xTrace[ip,0:ln] = north[0,::-1]
+                self.yTrace[ip,0:ln] = north[1,::-1]
+                self.zTrace[ip,0:ln] = north[2,::-1]
+                self.xTrace[ip,ln:ln+ls] = south[0]
+                self.yTrace[ip,ln:ln+ls] = south[1]
+                self.zTrace[ip,ln:ln+ls] = south[2]
+                self.l[ip] = ln + ls
 
 
     def __str__(self):
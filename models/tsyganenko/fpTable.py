@@ -0,0 +1,387 @@
+# Copyright (C) 2012  VT SuperDARN Lab
+# Full license can be found in LICENSE.txt
+"""
+*********************
+**Module**: models.tsyganenko.fpTable
+*********************
+Map points to their T96 footpoints from precomputed tables
+
+Tracing every point along the field is the expensive part of footpoint
+mapping. A :class:`fpTable` traces once, for a bin of (epoch, pdyn, dst,
+byimf, bzimf), the northern and southern footpoints of every node of a
+geographic (lat, lon, log rho) grid, saves them to disk, and maps points
+by trilinear interpolation in that grid. Interpolation is skipped, and
+the point traced, where the footpoints of the surrounding nodes curve too
+much for a linear interpolation (estimated error above **tol**), where a
+node field line is open, or outside the grid.
+
+**Classes**:
+    * :class:`models.tsyganenko.fpTable.fpTable`: footpoint table for one parameter bin
+
+**Functions**:
+    * :func:`models.tsyganenko.fpTable.fpMap`: map points using cached tables
+
+"""
+
+# Same Re as used in Tsyganenko models [km]
+Re = 6371.2
+
+# Tables already built or loaded in this process
+_tables = {}
+
+
+def _footpoints(args):
+    """
+|   Trace a chunk of table nodes, keeping the footpoints only (runs in the
+|   pool workers)
+    """
+    from models.tsyganenko import _traceGroups
+
+    return [(ip, nh, sh) for ip, gsw, nh, sh, north, south in _traceGroups(args)]
+
+
+class fpTable(object):
+    """
+|   Northern and southern footpoints on a grid of start points
+|
+|   The parameters are rounded to their bin (datetime to dtRes seconds,
+|   pdyn to pdynRes, dst to dstRes, byimf and bzimf to imfRes) and the
+|   table is computed for the rounded values.
+|
+|   **INPUTS**:
+|       **datetime**: a python datetime object
+|       **[pdyn, dst, byimf, bzimf, vswgse]**: T96 parameters, as for tsygTrace
+|       **[dtRes, pdynRes, dstRes, imfRes]**: parameter bin sizes [s, nPa, nT, nT]
+|       **[latRes, lonRes]**: grid resolution [degrees]
+|       **[rhoGrid]**: grid distances from the center of the Earth [km], increasing
+|           (defaults to 12 logarithmically spaced values from 1.05 to 10 Re)
+|       **[rmin, rmax, dsmax, err, lmax]**: tracing settings, as for tsygTrace
+|           (err defaults to 1e-4, smaller tolerances often exhaust lmax
+|           before the field line reaches rmin)
+|       **[tol]**: largest accepted interpolation error [degrees]
+|       **[cacheDir]**: where tables are saved (defaults to
+|           $DAVIT_TMPDIR/tsyganenko or /tmp/sd/tsyganenko)
+|       **[nProcs]**: number of processes used to build the table (None for
+|           the number of CPUs)
+|
+|   **OUTPUTS**:
+|       **.latNH, .lonNH, .rhoNH, .latSH, .lonSH, .rhoSH**: footpoints at each
+|           node, shaped (nlat, nlon, nrho)
+|       **.errNH, .errSH**: estimated interpolation error at each node [degrees]
+|
+|   **EXAMPLES**:
+from datetime import datetime
+import tsyganenko
+table = tsyganenko.fpTable(datetime(2013,1,1,12), pdyn=2., dst=-10.)
+fp = table.map(lats, lons, rhos)
+print fp['latNH'], fp['traced'].sum()
+    """
+
+    def __init__(self, datetime, pdyn=2., dst=-5., byimf=0., bzimf=-5.,
+        vswgse=[-400.,0.,0.], dtRes=3600., pdynRes=1., dstRes=10., imfRes=2.,
+        latRes=4., lonRes=10., rhoGrid=None, rmin=1., rmax=60., dsmax=0.01,
+        err=0.0001, lmax=5000, tol=0.5, cacheDir=None, nProcs=None):
+        import os
+        import hashlib
+        import numpy as np
+        from datetime import datetime as pydt, timedelta
+
+        # Round the parameters to their bin
+        epoch = pydt(1970,1,1)
+        sec = (datetime - epoch).total_seconds()
+        self.datetime = epoch + timedelta(seconds=round(sec/dtRes)*dtRes)
+        self.pdyn = round(pdyn/pdynRes)*pdynRes
+        self.dst = round(dst/dstRes)*dstRes
+        self.byimf = round(byimf/imfRes)*imfRes
+        self.bzimf = round(bzimf/imfRes)*imfRes
+        self.vswgse = [float(v) for v in vswgse]
+        self.rmin, self.rmax, self.dsmax, self.err, self.lmax = rmin, rmax, dsmax, err, lmax
+        self.tol = tol
+
+        self.lat = np.arange(-90., 90.+latRes/2., latRes)
+        self.lon = np.arange(0., 360.+lonRes/2., lonRes)
+        if rhoGrid is None: rhoGrid = Re*np.exp(np.linspace(np.log(1.05), np.log(10.), 12))
+        self.rho = np.asarray(rhoGrid, dtype='float64')
+
+        if cacheDir is None:
+            try: cacheDir = os.path.join(os.environ['DAVIT_TMPDIR'], 'tsyganenko')
+            except KeyError: cacheDir = '/tmp/sd/tsyganenko'
+        h = hashlib.sha1()
+        for v in (self.lat, self.lon, self.rho, self.vswgse,
+                [rmin, rmax, dsmax, err, lmax]):
+            h.update(np.asarray(v, dtype='float64').tostring())
+        self.fileName = os.path.join(cacheDir,
+            'fpTable_{:%Y%m%d%H%M%S}_p{:g}_d{:g}_by{:g}_bz{:g}_{}.npz'.format(
+            self.datetime, self.pdyn, self.dst, self.byimf, self.bzimf,
+            h.hexdigest()[:12]))
+
+        names = ['latNH', 'lonNH', 'rhoNH', 'latSH', 'lonSH', 'rhoSH']
+        if os.path.isfile(self.fileName):
+            with np.load(self.fileName) as npz:
+                for k in names: setattr(self, k, npz[k])
+        else:
+            self._build(nProcs)
+            if not os.path.exists(cacheDir): os.makedirs(cacheDir)
+            np.savez_compressed(self.fileName,
+                **dict((k, getattr(self, k)) for k in names))
+
+        self._prepare()
+
+
+    def __str__(self):
+        return ('fpTable: {:%Y-%m-%d %H:%M:%S} UT, pdyn {:g} nPa, dst {:g} nT, '
+            'byimf {:g} nT, bzimf {:g} nT\n  grid {}x{}x{}, {:.1f}% of the '
+            'cells interpolated').format(self.datetime, self.pdyn, self.dst,
+            self.byimf, self.bzimf, len(self.lat), len(self.lon),
+            len(self.rho), 100.*(1. - self._bad.mean()))
+
+
+    def _parmod(self):
+        return [self.pdyn, self.dst, self.byimf, self.bzimf, 0, 0, 0, 0, 0, 0]
+
+
+    def _trace(self, lat, lon, rho, nProcs=1):
+        """
+|   Trace points at the table epoch and parameters, returns (nh, sh)
+|   footpoints as (npts, 3) arrays of (lat, lon, rho)
+        """
+        import numpy as np
+        from multiprocessing import Pool, cpu_count
+
+        d = self.datetime
+        tt = (d.year, d.timetuple().tm_yday, d.hour, d.minute, d.second)
+        nPts = len(lat)
+        if nProcs is None: nProcs = cpu_count()
+        nProcs = max(1, min(nProcs, nPts))
+        chunkSize = max(1, nPts/(4*nProcs))
+        chunks = []
+        for i0 in xrange(0, nPts, chunkSize):
+            inds = range(i0, min(i0+chunkSize, nPts))
+            chunks.append(([(tt, inds, lat[i0:i0+chunkSize], lon[i0:i0+chunkSize],
+                rho[i0:i0+chunkSize])], self.vswgse, self._parmod(), self.lmax,
+                self.rmax, self.rmin, self.dsmax, self.err))
+
+        if nProcs > 1 and len(chunks) > 1:
+            pool = Pool(processes=nProcs)
+            try:
+                results = pool.map(_footpoints, chunks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_footpoints(c) for c in chunks]
+
+        nh, sh = np.zeros((nPts, 3)), np.zeros((nPts, 3))
+        for chunk in results:
+            for ip, fpNH, fpSH in chunk:
+                nh[ip], sh[ip] = fpNH, fpSH
+        return nh, sh
+
+
+    def _build(self, nProcs):
+        """
+|   Trace every node of the grid
+        """
+        import numpy as np
+
+        lat, lon, rho = np.meshgrid(self.lat, self.lon, self.rho, indexing='ij')
+        shape = lat.shape
+        # nodes at 360 degrees are the same as at 0
+        wrap = np.isclose(self.lon[-1], 360.)
+        sl = np.s_[:, :-1, :] if wrap else np.s_[:, :, :]
+        nh, sh = self._trace(lat[sl].ravel(), lon[sl].ravel(), rho[sl].ravel(),
+            nProcs=nProcs)
+        for i, k in enumerate(['lat', 'lon', 'rho']):
+            for hemi, fp in [('NH', nh), ('SH', sh)]:
+                arr = np.zeros(shape)
+                arr[sl] = fp[:, i].reshape(arr[sl].shape)
+                if wrap: arr[:, -1, :] = arr[:, 0, :]
+                setattr(self, k+hemi, arr)
+
+
+    def _prepare(self):
+        """
+|   Set up the arrays actually interpolated and flag the nodes which cannot
+|   be trusted: open field lines, and nodes where the estimated error of a
+|   linear interpolation (from the second differences of the footpoint
+|   position along each axis) is above tol
+        """
+        import numpy as np
+
+        self._fields = []
+        bad = np.zeros(self.latNH.shape, dtype=bool)
+        for hemi in ['NH', 'SH']:
+            lat = getattr(self, 'lat'+hemi)
+            lon = getattr(self, 'lon'+hemi)
+            rho = getattr(self, 'rho'+hemi)
+            # field lines which did not come back down to rmin
+            open_ = ~np.isfinite(lat) | ~(rho <= 1.01*self.rmin*Re)
+            rlat, rlon = np.radians(np.where(open_, 0., lat)), np.radians(np.where(open_, 0., lon))
+            u = np.array([np.cos(rlat)*np.cos(rlon), np.cos(rlat)*np.sin(rlon), np.sin(rlat)])
+
+            # linear interpolation error ~ 1/8 of the second difference
+            errMax = np.zeros(lat.shape)
+            for ax in [1, 2, 3]:
+                d2 = np.zeros(u.shape)
+                sl = [slice(None)]*4
+                c, m, p = list(sl), list(sl), list(sl)
+                c[ax], m[ax], p[ax] = slice(1, -1), slice(0, -2), slice(2, None)
+                c, m, p = tuple(c), tuple(m), tuple(p)
+                d2[c] = u[m] - 2.*u[c] + u[p]
+                errMax = np.maximum(errMax, np.degrees(np.sqrt((d2**2).sum(axis=0)))/8.)
+            setattr(self, 'err'+hemi, errMax)
+            bad |= open_ | (errMax > self.tol)
+            self._fields += [np.where(open_, 0., lat), np.cos(rlon), np.sin(rlon),
+                np.where(open_, 0., rho)]
+        self._bad = bad.astype('float64')
+
+
+    def map(self, lat, lon, rho, fallback=True, nProcs=1):
+        """
+|   Footpoints of points from the table
+|
+|   **INPUTS**:
+|       **lat, lon**: geographic coordinates [degrees] (scalars or arrays)
+|       **rho**: distance from the center of the Earth [km]
+|       **[fallback]**: trace the points which cannot be interpolated (with
+|           the table epoch and parameters), otherwise return NaN there
+|       **[nProcs]**: number of processes used for those traces
+|
+|   **OUTPUTS**:
+|       **fp**: dictionnary of arrays shaped like the inputs: 'latNH',
+|           'lonNH', 'rhoNH', 'latSH', 'lonSH', 'rhoSH' and 'traced' (True
+|           where the point was traced instead of interpolated). Longitudes
+|           are in [0, 360).
+        """
+        import numpy as np
+        from scipy import ndimage
+
+        lat, lon, rho = np.broadcast_arrays(*[np.asarray(a, dtype='float64')
+            for a in (lat, lon, rho)])
+        shape = lat.shape
+        lat, lon, rho = lat.ravel(), lon.ravel(), rho.ravel()
+
+        lonRes = self.lon[1] - self.lon[0]
+        latRes = self.lat[1] - self.lat[0]
+        iRho = np.interp(np.log(rho), np.log(self.rho), np.arange(len(self.rho)))
+        coords = np.array([(lat - self.lat[0])/latRes, np.mod(lon, 360.)/lonRes, iRho])
+        kw = dict(order=1, mode='nearest', prefilter=False)
+        vals = [ndimage.map_coordinates(f, coords, **kw) for f in self._fields]
+        bad = ndimage.map_coordinates(self._bad, coords, **kw) > 0.
+        bad |= (rho < self.rho[0]) | (rho > self.rho[-1])
+        bad |= ~(np.isfinite(lat) & np.isfinite(lon) & np.isfinite(rho))
+
+        fp = {}
+        for i, hemi in enumerate(['NH', 'SH']):
+            fLat, c, s, fRho = vals[4*i:4*i+4]
+            fp['lat'+hemi] = fLat
+            fp['lon'+hemi] = np.degrees(np.arctan2(s, c))
+            fp['rho'+hemi] = fRho
+        good = np.isfinite(lat) & np.isfinite(lon) & np.isfinite(rho)
+        if bad.any():
+            if fallback:
+                inds = np.where(bad & good)[0]
+                nh, sh = self._trace(lat[inds], lon[inds], rho[inds], nProcs=nProcs)
+                for i, k in enumerate(['lat', 'lon', 'rho']):
+                    fp[k+'NH'][inds] = nh[:, i]
+                    fp[k+'SH'][inds] = sh[:, i]
+                for k in fp: fp[k][bad & ~good] = np.nan
+            else:
+                for k in fp: fp[k][bad] = np.nan
+        # longitudes in [0, 360) like the traces, interpolated or not
+        for hemi in ['NH', 'SH']: fp['lon'+hemi] = np.mod(fp['lon'+hemi], 360.)
+        for k in fp: fp[k] = fp[k].reshape(shape)
+        fp['traced'] = (bad & good & fallback).reshape(shape)
+        return fp
+
+
+    def checkError(self, nCheck=50, seed=0):
+        """
+|   Compare the table against real traces at random points within the grid
+|
+|   **INPUTS**:
+|       **[nCheck]**: number of random points
+|       **[seed]**: random seed, so that the estimate is reproducible
+|
+|   **OUTPUTS**:
+|       **maxError, rmsError**: great-circle distance [degrees] between the
+|           interpolated and traced northern and southern footpoints, for
+|           the points which were interpolated
+        """
+        import numpy as np
+
+        rnd = np.random.RandomState(seed)
+        lat = np.degrees(np.arcsin(rnd.uniform(-1., 1., nCheck)))
+        lon = rnd.uniform(0., 360., nCheck)
+        rho = np.exp(rnd.uniform(np.log(self.rho[0]), np.log(self.rho[-1]), nCheck))
+        fp = self.map(lat, lon, rho, fallback=False)
+        good = np.isfinite(fp['latNH'])
+        if not good.any(): return np.nan, np.nan
+        nh, sh = self._trace(lat[good], lon[good], rho[good])
+        err = []
+        for hemi, ex in [('NH', nh), ('SH', sh)]:
+            la1, lo1 = np.radians(fp['lat'+hemi][good]), np.radians(fp['lon'+hemi][good])
+            la2, lo2 = np.radians(ex[:, 0]), np.radians(ex[:, 1])
+            cosd = np.sin(la1)*np.sin(la2) + np.cos(la1)*np.cos(la2)*np.cos(lo1 - lo2)
+            err.append(np.degrees(np.arccos(np.clip(cosd, -1., 1.))))
+        err = np.concatenate(err)
+        return err.max(), np.sqrt(np.mean(err**2))
+
+
+def fpMap(lat, lon, rho, datetime, pdyn=2., dst=-5., byimf=0., bzimf=-5.,
+    fallback=True, **kwargs):
+    """
+|   Map points to their footpoints using cached tables, one per parameter bin
+|
+|   **INPUTS**:
+|       **lat, lon**: geographic coordinates [degrees] (arrays)
+|       **rho**: distance from the center of the Earth [km] (array)
+|       **datetime**: a python datetime object, or a list (one per point)
+|       **[pdyn, dst, byimf, bzimf]**: T96 parameters (scalars, or one per point)
+|       **[fallback]**: trace the points which cannot be interpolated
+|       **[kwargs]**: passed to :class:`fpTable`
+|
+|   **OUTPUTS**:
+|       **fp**: dictionnary of arrays, see :func:`fpTable.map`
+    """
+    import numpy as np
+    from datetime import datetime as pydt
+
+    lat, lon, rho = [np.atleast_1d(np.asarray(a, dtype='float64')).ravel()
+        for a in (lat, lon, rho)]
+    nPts = len(lat)
+    if isinstance(datetime, pydt): datetime = [datetime]*nPts
+    pars = [np.broadcast_to(np.asarray(p, dtype='float64'), (nPts,))
+        for p in (pdyn, dst, byimf, bzimf)]
+
+    # Group the points by the table they fall in
+    groups = {}
+    for ip in xrange(nPts):
+        key = _binKey(datetime[ip], [p[ip] for p in pars], kwargs)
+        groups.setdefault(key, []).append(ip)
+
+    fp = dict((k, np.zeros(nPts)) for k in
+        ['latNH', 'lonNH', 'rhoNH', 'latSH', 'lonSH', 'rhoSH'])
+    fp['traced'] = np.zeros(nPts, dtype=bool)
+    for key, inds in groups.items():
+        if key not in _tables:
+            ip = inds[0]
+            _tables[key] = fpTable(datetime[ip], pdyn=pars[0][ip], dst=pars[1][ip],
+                byimf=pars[2][ip], bzimf=pars[3][ip], **kwargs)
+        res = _tables[key].map(lat[inds], lon[inds], rho[inds], fallback=fallback)
+        for k in fp: fp[k][inds] = res[k]
+    return fp
+
+
+def _binKey(datetime, pars, kwargs):
+    """
+|   Key of the parameter bin of one point, as rounded by fpTable
+    """
+    from datetime import datetime as pydt
+
+    dtRes = kwargs.get('dtRes', 3600.)
+    res = [kwargs.get('pdynRes', 1.), kwargs.get('dstRes', 10.),
+        kwargs.get('imfRes', 2.), kwargs.get('imfRes', 2.)]
+    sec = (datetime - pydt(1970,1,1)).total_seconds()
+    return (round(sec/dtRes),) + tuple(round(p/r) for p, r in zip(pars, res)) + \
+        tuple(sorted((k, str(v)) for k, v in kwargs.items()))
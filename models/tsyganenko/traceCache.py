@@ -0,0 +1,179 @@
+# Copyright (C) 2012  VT SuperDARN Lab
+# Full license can be found in LICENSE.txt
+"""
+*********************
+**Module**: models.tsyganenko.traceCache
+*********************
+Content-keyed cache of :class:`models.tsyganenko.tsygTrace` results
+
+Each entry is keyed by a hash of everything that determines a trace (start
+points, times, models, model parameters and tracing settings) and stored
+as two compressed files: the footpoints, and optionally the field lines
+(concatenated, with the length of each line). Field lines are only read
+when one of xTrace, yTrace or zTrace is first accessed, so footpoint-only
+work never loads them.
+
+**Classes**:
+  * :class:`models.tsyganenko.traceCache.traceCache`: on-disk cache of traces
+
+"""
+
+# Bump when the stored layout changes so that old entries are not reused
+_version = 1
+
+# Attributes of a trace stored with the footpoints
+_fpNames = ['lat', 'lon', 'rho', 'xGsw', 'yGsw', 'zGsw',
+            'latNH', 'lonNH', 'rhoNH', 'latSH', 'lonSH', 'rhoSH', 'l']
+
+# Default cache, created on first use
+_defaultCache = None
+
+
+class traceCache(object):
+    """
+|   Cache of tsygTrace results keyed by their inputs
+|
+|   **INPUTS**:
+|       **[cacheDir]**: defaults to $DAVIT_TMPDIR/tsyganenko or /tmp/sd/tsyganenko
+|       **[lines]**: store the field lines as well as the footpoints
+|
+|   **EXAMPLES**:
+import tsyganenko
+cache = tsyganenko.traceCache(lines=False)
+# traced the first time, read back from the cache afterwards
+trace = tsyganenko.tsygTrace(lats, lons, rhos, datetime=times, cache=cache)
+    """
+
+    def __init__(self, cacheDir=None, lines=True):
+        import os
+
+        if cacheDir is None:
+            try: cacheDir = os.path.join(os.environ['DAVIT_TMPDIR'], 'tsyganenko')
+            except KeyError: cacheDir = '/tmp/sd/tsyganenko'
+        if not os.path.exists(cacheDir): os.makedirs(cacheDir)
+        self.cacheDir = cacheDir
+        self.lines = lines
+        self.hits = 0
+        self.misses = 0
+
+
+    @staticmethod
+    def key(trace):
+        """
+|   Hash of all the inputs of a trace (its start points, times, models,
+|   model parameters and tracing settings)
+        """
+        import hashlib
+        import numpy as np
+
+        h = hashlib.sha1()
+        h.update('tsygTrace v{} {} T96_01 IGRF_GSW_08'.format(_version,
+            trace.coords.lower()))
+        for v in (trace.lat, trace.lon, trace.rho):
+            h.update(np.asarray(v, dtype='float64').tostring())
+        h.update(np.asarray(trace.datetime, dtype='datetime64[us]').astype('int64').tostring())
+        h.update(np.array(list(trace.vswgse) + [trace.pdyn, trace.dst,
+            trace.byimf, trace.bzimf, trace.rmax, trace.rmin, trace.dsmax,
+            trace.err, trace.lmax], dtype='float64').tostring())
+        return h.hexdigest()
+
+
+    def _fileNames(self, key):
+        import os
+        base = os.path.join(self.cacheDir, key)
+        return base+'.fp.npz', base+'.lines.npz'
+
+
+    def get(self, key, trace, lines=False):
+        """
+|   Fill trace with the cached results for key
+|
+|   **INPUTS**:
+|       **key**: see :func:`traceCache.key`
+|       **trace**: the tsygTrace object to fill
+|       **[lines]**: only accept entries which include the field lines
+|
+|   **OUTPUTS**:
+|       True if the entry was found. The field lines are not read until
+|       they are first used.
+        """
+        import os
+        import numpy as np
+
+        fpFile, linesFile = self._fileNames(key)
+        if lines and not os.path.isfile(linesFile):
+            self.misses += 1
+            return False
+        try:
+            with np.load(fpFile) as npz:
+                fp = dict((k, npz[k]) for k in npz.files)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return False
+
+        self.hits += 1
+        for k in _fpNames: setattr(trace, k, fp[k])
+        trace.datetime = list(fp['datetime'].astype(object))
+        for k in ['xTrace', 'yTrace', 'zTrace']: trace.__dict__.pop(k, None)
+        trace._linesFile = linesFile if os.path.isfile(linesFile) else None
+        return True
+
+
+    def put(self, key, trace):
+        """
+|   Store the results of trace under key
+        """
+        import numpy as np
+
+        fpFile, linesFile = self._fileNames(key)
+        fp = dict((k, np.asarray(getattr(trace, k))) for k in _fpNames)
+        fp['datetime'] = np.asarray(trace.datetime, dtype='datetime64[us]')
+        if self.lines:
+            # the traces come out of fortran in single precision
+            l = np.asarray(trace.l)
+            keep = np.arange(trace.xTrace.shape[1]) < l[:, np.newaxis]
+            np.savez_compressed(linesFile,
+                x=trace.xTrace[keep].astype('float32'),
+                y=trace.yTrace[keep].astype('float32'),
+                z=trace.zTrace[keep].astype('float32'))
+        # footpoints last, they mark the entry as complete
+        np.savez_compressed(fpFile, **fp)
+
+
+    @staticmethod
+    def loadLines(trace, linesFile):
+        """
+|   Read the field lines of a cached trace back into padded arrays
+        """
+        import numpy as np
+
+        l = np.asarray(trace.l)
+        lMax = l.max() if len(l) > 0 else 0
+        keep = np.arange(lMax) < l[:, np.newaxis]
+        with np.load(linesFile) as npz:
+            for name, k in [('xTrace', 'x'), ('yTrace', 'y'), ('zTrace', 'z')]:
+                arr = np.zeros((len(l), lMax))
+                arr[keep] = npz[k]
+                setattr(trace, name, arr)
+
+
+    def clear(self):
+        """
+|   Remove every cached trace
+        """
+        import os
+        import glob
+
+        for f in glob.glob(os.path.join(self.cacheDir, '*.npz')):
+            try: os.remove(f)
+            except OSError: pass
+
+
+def defaultCache():
+    """
+|   The cache used by tsygTrace(..., cache=True)
+    """
+    global _defaultCache
+
+    if _defaultCache is None: _defaultCache = traceCache()
+    return _defaultCache
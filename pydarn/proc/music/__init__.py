@@ -12,6 +12,7 @@ DEV: functions/modules/classes with a * have not been developed yet
 """
 #import sigio
 from music import *
+import musicBatch
 #from signal import *
 #from sigproc import *
 #from compare import *
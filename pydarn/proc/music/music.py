@@ -37,8 +37,10 @@
 *********************
 **Functions**:
     * :func:`pydarn.proc.music.getDataSet`
+    * :func:`pydarn.proc.music.baseArray`
     * :func:`pydarn.proc.music.stringify_signal`
     * :func:`pydarn.proc.music.stringify_signal_list`
+    * :func:`pydarn.proc.music.interpFinite`: Linear interpolation along the first axis of an array ignoring non-finite values.
     * :func:`pydarn.proc.music.beamInterpolation`
     * :func:`pydarn.proc.music.defineLimits`
     * :func:`pydarn.proc.music.applyLimits`
@@ -50,10 +52,13 @@
     * :func:`pydarn.proc.music.windowData`
     * :func:`pydarn.proc.music.calculateFFT`
     * :func:`pydarn.proc.music.calculateDlm`: Calculate the cross-spectral matrix of a musicArray/musicDataObj object.
+    * :func:`pydarn.proc.music.cellLookupTable`: Table of the cells of the cross-spectral matrix.
+    * :func:`pydarn.proc.music.dominantEigen`: Largest eigenvalues and eigenvectors of a Hermitian matrix.
     * :func:`pydarn.proc.music.calculateKarr`: Calculate the two-dimensional horizontal wavenumber array of a musicArray/musicDataObj object.
     * :func:`pydarn.proc.music.simulator`: Insert a simulated MSTID into the processing chain.
     * :func:`pydarn.proc.music.scale_karr`: Scale/normalize kArr for plotting and signal detection.
     * :func:`pydarn.proc.music.detectSignals`
+    * :func:`pydarn.proc.music.peakOffset`
     * :func:`pydarn.proc.music.add_signal`
     * :func:`pydarn.proc.music.del_signal`
 
@@ -63,6 +68,7 @@
     * :class:`pydarn.proc.music.musicDataObj`: Basic container for holding MUSIC data.
     * :class:`pydarn.proc.music.musicArray`: Container object for holding musicDataObj's.
     * :class:`pydarn.proc.music.filter`
+    * :class:`pydarn.proc.music.slidingDlm`: Cross-spectral matrix of a sliding window, updated incrementally.
 """
 
 import numpy as np
@@ -104,6 +110,12 @@ def getDataSet(dataObj,dataSet='active'):
     currentData = getattr(dataObj,dataSet)
     return currentData
 
+def baseArray(arr):
+    """Returns the array that owns the memory of a numpy array (the array itself if it is not a view).
+    """
+    while isinstance(arr.base,np.ndarray): arr = arr.base
+    return arr
+
 class emptyObj(object):
     """Create an empty object.
     """
@@ -262,10 +274,15 @@ class musicDataObj(object):
         * :func:`musicDataObj.printMetadata`
         * :func:`musicDataObj.appendHistory`
         * :func:`musicDataObj.printHistory`
+        * :func:`musicDataObj.spill`
+        * :func:`musicDataObj.restore`
 
     Written by Nathaniel A. Frissell, Fall 2013
     """
 
+    #Large arrays which may be spilled to disk to keep a musicArray within its memory budget.
+    arrayAttrs = ['data', 'spectrum', 'Dlm', 'karr']
+
     def __init__(self, time, data, fov=None, comment=None, parent=0, **metadata):
         self.parent = parent
 
@@ -277,8 +294,20 @@ class musicDataObj(object):
 
         self.history = {datetime.datetime.now():comment}
 
+    def __getattr__(self,name):
+        #Only called for missing attributes: read spilled arrays back from disk on first access.
+        if name in self.__dict__.get('_spilled',{}):
+            self.restore()
+            return self.__dict__[name]
+        raise AttributeError("'musicDataObj' object has no attribute '"+name+"'")
+
     def copy(self,newsig,comment):
-        """Copy a musicDataObj object.  This deep copies data and metadata, updates the serial number, and logs a comment in the history.  Methods such as plot are kept as a reference.
+        """Copy a musicDataObj object.  This copies metadata, updates the serial number, and logs a comment in the history.  Methods such as plot are kept as a reference.
+
+        The data and time arrays are shared with the original as read-only views rather than copied; processing
+        routines replace them with new arrays.  The FOV object is copied, and its arrays shared, so that its attributes
+        can be replaced independently.  The spectrum, Dlm and karr of the original describe its own data and are not
+        carried over.
 
         **Args**:
             * **newsig** (str): Name for the new musicDataObj object.
@@ -292,20 +321,68 @@ class musicDataObj(object):
         serial = self.metadata['serial'] + 1
         newsig = '_'.join(['DS%03d' % serial,newsig])
 
+        self.restore()
         setattr(self.parent,newsig,copy.copy(self))
         newsigobj = getattr(self.parent,newsig)
 
-        newsigobj.time      = copy.deepcopy(self.time)
-        newsigobj.data      = copy.deepcopy(self.data)
-        newsigobj.fov       = copy.deepcopy(self.fov)
+        for key in ['time','data']:
+            arr = getattr(self,key).view()
+            arr.flags.writeable = False
+            setattr(newsigobj,key,arr)
+        for key in ['spectrum','Dlm','karr']: newsigobj.__dict__.pop(key,None)
+        newsigobj.fov       = copy.copy(self.fov)
         newsigobj.metadata  = copy.deepcopy(self.metadata)
         newsigobj.history   = copy.deepcopy(self.history)
 
         newsigobj.metadata['dataSetName'] = newsig
         newsigobj.metadata['serial']      = serial
         newsigobj.history[datetime.datetime.now()] = '['+newsig+'] '+comment
+
+        if hasattr(self.parent,'enforceMemoryBudget'): self.parent.enforceMemoryBudget()
         
         return newsigobj
+
+    def spill(self,fileName,keep=()):
+        """Move the large arrays of this musicDataObj (data, spectrum, Dlm, karr) to a compressed file.  They are read
+        back automatically the next time one of them is accessed.
+
+        **Args**:
+            * **fileName** (str): Name of the .npz file to write.
+            * [**keep**] (iterable): ids of base arrays to keep in memory because other data sets share them.
+
+        **Returns**:
+            * **nbytes** (int): Memory released.
+        """
+        arrays = {}
+        for key in self.arrayAttrs:
+            arr = self.__dict__.get(key)
+            if not isinstance(arr,np.ndarray) or id(baseArray(arr)) in keep: continue
+            arrays[key] = arr
+        if len(arrays) == 0: return 0
+
+        np.savez_compressed(fileName,**arrays)
+        nbytes = 0
+        for key,arr in arrays.iteritems():
+            nbytes += baseArray(arr).nbytes
+            del self.__dict__[key]
+        self._spilled     = arrays.keys()
+        self._spillFile   = fileName
+        return nbytes
+
+    def restore(self):
+        """Read arrays moved to disk by :func:`musicDataObj.spill` back into memory.
+        """
+        import os
+
+        spilled = self.__dict__.get('_spilled')
+        if not spilled: return
+
+        with np.load(self._spillFile) as npz:
+            for key in spilled: self.__dict__[key] = npz[key]
+        try: os.remove(self._spillFile)
+        except OSError: pass
+        self._spilled   = []
+        self._spillFile = None
   
     def setActive(self):
         """Sets this signal as the currently active signal.
@@ -442,9 +519,16 @@ class musicArray(object):
                         'GS': Ground Scatter Mapping Model.  See Bristow et al. [1994]
                         'IS': Standard SuperDARN scatter mapping model.
         * [**fovCoords**] (str): Map coordinate system. WARNING: 'geo' is curently only tested coordinate system.
+        * [**memoryBudget**] (int or None): Maximum memory [bytes] used by the arrays of all of the data sets.  When a new
+                        data set, spectrum, Dlm or kArr takes the total over the budget, the arrays of the oldest data
+                        sets (other than the active one) are moved to compressed files in spillDir until it fits.
+                        None for no limit.
+        * [**spillDir**] (str): Directory for spilled data sets.  Defaults to $DAVIT_TMPDIR/music or /tmp/sd/music.
 
     **Methods**:
         * :func:`musicArray.get_data_sets`
+        * :func:`musicArray.memoryUsage`
+        * :func:`musicArray.enforceMemoryBudget`
 
     **Example**:
         ::
@@ -464,10 +548,13 @@ class musicArray(object):
 
     Written by Nathaniel A. Frissell, Fall 2013
     """
-    def __init__(self,myPtr,sTime=None,eTime=None,param='p_l',gscat=1,fovElevation=None,fovModel='GS',fovCoords='geo'):
+    def __init__(self,myPtr,sTime=None,eTime=None,param='p_l',gscat=1,fovElevation=None,fovModel='GS',fovCoords='geo',memoryBudget=None,spillDir=None):
         # Create a list that can be used to store top-level messages.
         self.messages   = []
 
+        self.memoryBudget = memoryBudget
+        self.spillDir     = spillDir
+
         no_data_message = 'No data for this time period.'
         # If no data, report and return.
         if myPtr is None:
@@ -478,44 +565,23 @@ class musicArray(object):
         if eTime == None: eTime = myPtr.eTime
 
         scanTimeList = []
+        #Columns of the data records: scan number, beam number, range gate, value and ground scatter flag.
+        scanList  = []
+        beamList  = []
+        gateList  = []
         dataList  = []
-        cpidList  = []
-        #Subscripts of columns in the dataList/dataArray
-        scanInx = 0
-        dateInx = 1
-        beamInx = 2
-        gateInx = 3
-        dataInx = 4
+        flagList  = []
 
         beamTime    = sTime
-        scanNr      = np.uint64(0)
+        scanNr      = 0
         fov         = None
 
-
-        # Create a place to store the prm data.
-        prm             = emptyObj()
-        prm.time        = []
-        prm.mplgs       = []
-        prm.nave        = []
-        prm.noisesearch = []
-        prm.scan        = []
-        prm.smsep       = []
-        prm.mplgexs     = []
-        prm.xcf         = []
-        prm.noisesky    = []
-        prm.rsep        = []
-        prm.mppul       = []
-        prm.inttsc      = []
-        prm.frang       = []
-        prm.bmazm       = []
-        prm.lagfr       = []
-        prm.ifmode      = []
-        prm.noisemean   = []
-        prm.tfreq       = []
-        prm.inttus      = []
-        prm.rxrise      = []
-        prm.mpinc       = []
-        prm.nrang       = []
+        # Create a place to store the prm data.  Values are collected per beam and converted to arrays at the end.
+        prmNames    = ['mplgs', 'nave', 'noisesearch', 'scan', 'smsep', 'mplgexs', 'xcf', 'noisesky', 'rsep',
+                       'mppul', 'inttsc', 'frang', 'bmazm', 'lagfr', 'ifmode', 'noisemean', 'tfreq', 'inttus',
+                       'rxrise', 'mpinc', 'nrang']
+        prmLists    = dict((name,[]) for name in prmNames)
+        prmTime     = []
 
         while beamTime < eTime:
             #Load one scan into memory.
@@ -535,52 +601,26 @@ class musicArray(object):
                 bmnum    = myBeam.bmnum
 
                 # Save all of the radar operational parameters.
-                prm.time.append(beamTime)
-                prm.mplgs.append(myBeam.prm.mplgs)
-                prm.nave.append(myBeam.prm.nave)
-                prm.noisesearch.append(myBeam.prm.noisesearch)
-                prm.scan.append(myBeam.prm.scan)
-                prm.smsep.append(myBeam.prm.smsep)
-                prm.mplgexs.append(myBeam.prm.mplgexs)
-                prm.xcf.append(myBeam.prm.xcf)
-                prm.noisesky.append(myBeam.prm.noisesky)
-                prm.rsep.append(myBeam.prm.rsep)
-                prm.mppul.append(myBeam.prm.mppul)
-                prm.inttsc.append(myBeam.prm.inttsc)
-                prm.frang.append(myBeam.prm.frang)
-                prm.bmazm.append(myBeam.prm.bmazm)
-                prm.lagfr.append(myBeam.prm.lagfr)
-                prm.ifmode.append(myBeam.prm.ifmode)
-                prm.noisemean.append(myBeam.prm.noisemean)
-                prm.tfreq.append(myBeam.prm.tfreq)
-                prm.inttus.append(myBeam.prm.inttus)
-                prm.rxrise.append(myBeam.prm.rxrise)
-                prm.mpinc.append(myBeam.prm.mpinc)
-                prm.nrang.append(myBeam.prm.nrang)
+                prmTime.append(beamTime)
+                for name in prmNames: prmLists[name].append(getattr(myBeam.prm,name))
 
                 #Get the fitData.
                 fitDataList = getattr(myBeam.fit,param)
                 slist       = getattr(myBeam.fit,'slist')
                 gflag       = getattr(myBeam.fit,'gflg')
 
-                if len(slist) > 1:
-                    for (gate,data,flag) in zip(slist,fitDataList,gflag):
-                        #Get information from each gate in scan.  Skip record if the chosen ground scatter option is not met.
-                        if (gscat == 1) and (flag == 0): continue
-                        if (gscat == 2) and (flag == 1): continue
-                        tmp = (scanNr,beamTime,bmnum,gate,data)
-                        dataList.append(tmp)
-                        goodScan = True
-                elif len(slist) == 1:
-                    gate,data,flag = (slist[0],fitDataList[0],gflag[0])
-                    #Get information from each gate in scan.  Skip record if the chosen ground scatter option is not met.
-                    if (gscat == 1) and (flag == 0): continue
-                    if (gscat == 2) and (flag == 1): continue
-                    tmp = (scanNr,beamTime,bmnum,gate,data)
-                    dataList.append(tmp)
-                    goodScan = True
-                else:
-                    continue
+                nGates = len(slist)
+                if nGates == 0: continue
+                #Skip the beam if the chosen ground scatter option is not met by any gate.
+                if (gscat == 1) and not any(gflag): continue
+                if (gscat == 2) and all(gflag): continue
+
+                scanList.extend([scanNr]*nGates)
+                beamList.extend([bmnum]*nGates)
+                gateList.extend(slist)
+                dataList.extend(fitDataList)
+                flagList.extend(gflag)
+                goodScan = True
 
             if goodScan:
                 #Determine the start time for each scan and save to list.
@@ -591,17 +631,29 @@ class musicArray(object):
 
         #Convert lists to numpy arrays.
         timeArray       = np.array(scanTimeList)
-        dataListArray   = np.array(dataList)
 
         # If no data, report and return.
-        if dataListArray.size == 0:
+        if len(dataList) == 0:
             self.messages.append(no_data_message)
             return
 
+        #Skip records if the chosen ground scatter option is not met.
+        flagArray = np.array(flagList)
+        if gscat == 1:
+            keep  = flagArray != 0
+        elif gscat == 2:
+            keep  = flagArray != 1
+        else:
+            keep  = np.ones(len(flagArray),dtype=np.bool)
+        scanArray = np.array(scanList,dtype=np.int64)[keep]
+        beamArray = np.array(beamList,dtype=np.int64)[keep]
+        gateArray = np.array(gateList,dtype=np.int64)[keep]
+        dataArray = np.array(dataList,dtype=np.float64)[keep]
+
         #Figure out what size arrays we need and initialize the arrays...
-        nrTimes = np.max(dataListArray[:,scanInx]) + 1
-        nrBeams = np.max(dataListArray[:,beamInx]) + 1
-        nrGates = np.max(dataListArray[:,gateInx]) + 1
+        nrTimes = np.max(scanArray) + 1
+        nrBeams = np.max(beamArray) + 1
+        nrGates = np.max(gateArray) + 1
 
         #Make sure the FOV is the same size as the data array.
         if len(fov.beams) != nrBeams:
@@ -622,11 +674,15 @@ class musicArray(object):
           fov.lonFull       = fov.lonFull[:,0:nrGates+1]
           fov.slantRFull    = fov.slantRFull[:,0:nrGates+1]
 
-        #Convert the dataListArray into a 3 dimensional array.
-        dataArray     = np.ndarray([nrTimes,nrBeams,nrGates])
-        dataArray[:]  = np.nan
-        for inx in range(len(dataListArray)):
-          dataArray[dataListArray[inx,scanInx],dataListArray[inx,beamInx],dataListArray[inx,gateInx]] = dataListArray[inx,dataInx]
+        #Scatter the records into a 3 dimensional array.
+        dataCube      = np.ndarray([nrTimes,nrBeams,nrGates])
+        dataCube[:]   = np.nan
+        dataCube[scanArray,beamArray,gateArray] = dataArray
+
+        #Convert the prm data to arrays.
+        prm             = emptyObj()
+        prm.time        = np.array(prmTime)
+        for name in prmNames: setattr(prm,name,np.array(prmLists[name]))
 
         #Make metadata block to hold information about the processing.
         metadata = {}
@@ -650,7 +706,7 @@ class musicArray(object):
         metadata['serial']      = 0
         comment = '['+dataSet+'] '+ 'Original Fit Data'
         #Save data to be returned as self.variables
-        setattr(self,dataSet,musicDataObj(timeArray,dataArray,fov=fov,parent=self,comment=comment))
+        setattr(self,dataSet,musicDataObj(timeArray,dataCube,fov=fov,parent=self,comment=comment))
         newSigObj = getattr(self,dataSet)
         setattr(newSigObj,'metadata',metadata)
 
@@ -679,6 +735,113 @@ class musicArray(object):
         dataSets.sort()
         return dataSets
 
+    def memoryUsage(self):
+        """
+        Return the memory used by the arrays (data, spectrum, Dlm, karr) of all of the data sets held in memory.
+        Arrays shared between data sets are counted once.
+
+        **Returns**:
+            * **nbytes** (int): Memory used [bytes].
+        """
+        bases = {}
+        for dataSet in self.get_data_sets():
+            currentData = getattr(self,dataSet)
+            for key in currentData.arrayAttrs:
+                arr = currentData.__dict__.get(key)
+                if isinstance(arr,np.ndarray):
+                    base = baseArray(arr)
+                    bases[id(base)] = base.nbytes
+        return sum(bases.values())
+
+    def enforceMemoryBudget(self):
+        """
+        Spill the arrays of the oldest data sets to disk until the memory used is within memoryBudget.  The active
+        data set and the newest data set are always kept in memory.  Spilled arrays are read back when accessed.
+        """
+        import os
+        import tempfile
+
+        budget = getattr(self,'memoryBudget',None)
+        if budget is None: return
+
+        spillDir = getattr(self,'spillDir',None)
+        if spillDir is None:
+            try: spillDir = os.path.join(os.environ['DAVIT_TMPDIR'],'music')
+            except KeyError: spillDir = '/tmp/sd/music'
+        if not os.path.exists(spillDir): os.makedirs(spillDir)
+
+        dataSets = [getattr(self,dataSet) for dataSet in self.get_data_sets()]
+        usage    = self.memoryUsage()
+        for currentData in dataSets[:-1]:
+            if usage <= budget: break
+            if currentData is getattr(self,'active',None): continue
+
+            #Arrays still shared with other data sets in memory would not be released.
+            keep = set()
+            for otherData in dataSets:
+                if otherData is currentData: continue
+                for key in otherData.arrayAttrs:
+                    arr = otherData.__dict__.get(key)
+                    if isinstance(arr,np.ndarray): keep.add(id(baseArray(arr)))
+
+            fd,fileName = tempfile.mkstemp(suffix='.npz',prefix=currentData.metadata['dataSetName']+'_',dir=spillDir)
+            os.close(fd)
+            nbytes = currentData.spill(fileName,keep=keep)
+            if nbytes == 0: os.remove(fileName)
+            usage -= nbytes
+
+def interpFinite(x,y,xNew,fill_value=np.nan):
+    """Linear interpolation along the first axis of an array, done separately for every column using only its finite
+    values.  This gives the same results as a scipy.interpolate.interp1d(x[good],y[good],bounds_error=False) per column,
+    but for all of the columns at once.
+
+    **Args**:
+        * **x** (numpy.array):      increasing sample positions, shape (n,)
+        * **y** (numpy.array):      values, shape (n, ...).  Non-finite values are ignored.
+        * **xNew** (numpy.array):   positions to interpolate to, shape (m,)
+        * [**fill_value**] (float): value outside of the finite samples of a column
+    **Returns**:
+        * **yNew** (numpy.array):   interpolated values, shape (m, ...).  Columns with less than 2 finite values are 0.
+    """
+    x       = np.asarray(x,dtype=np.float64)
+    xNew    = np.asarray(xNew,dtype=np.float64)
+    y       = np.asarray(y)
+    n       = y.shape[0]
+    m       = len(xNew)
+    shape   = (m,) + y.shape[1:]
+    y       = y.reshape(n,-1)
+    cols    = np.arange(y.shape[1])
+
+    #Index of the last finite sample at or before, and of the first finite sample at or after, each sample.
+    valid   = np.isfinite(y)
+    inx     = np.arange(n)[:,np.newaxis]
+    prevInx = np.maximum.accumulate(np.where(valid,inx,-1),axis=0)
+    nextInx = np.minimum.accumulate(np.where(valid,inx,n)[::-1],axis=0)[::-1]
+
+    #Finite samples bracketing each new position.
+    pos     = np.searchsorted(x,xNew,side='right')
+    lo      = prevInx[np.clip(pos-1,0,n-1),:]
+    lo[pos == 0,:] = -1
+    hi      = nextInx[np.clip(pos,0,n-1),:]
+    hi[pos == n,:] = n
+    loC     = np.clip(lo,0,n-1)
+    hiC     = np.clip(hi,0,n-1)
+
+    #The last finite sample is inside the interpolation range.
+    xNew    = xNew[:,np.newaxis]
+    last    = np.logical_and(hi == n,np.logical_and(lo >= 0,x[loC] == xNew))
+    hiC[last] = loC[last]
+
+    xLo,xHi = x[loC],x[hiC]
+    yLo,yHi = y[loC,cols],y[hiC,cols]
+    dx      = np.where(hiC == loC,1.,xHi - xLo)
+    yNew    = (yHi - yLo)/dx * (xNew - xLo) + yLo
+
+    inside  = np.logical_and(lo >= 0,np.logical_or(hi < n,last))
+    yNew[np.logical_not(inside)] = fill_value
+    yNew[:,np.sum(valid,axis=0) < 2] = 0
+    return yNew.reshape(shape)
+
 def beamInterpolation(dataObj,dataSet='active',newDataSetName='beamInterpolated',comment='Beam Linear Interpolation'):
     """Interpolates the data in a musicArray object along the beams of the radar.  This method will ensure that no
     rangegates are missing data.  Ranges outside of metadata['gateLimits'] will be set to 0.
@@ -692,36 +855,25 @@ def beamInterpolation(dataObj,dataSet='active',newDataSetName='beamInterpolated'
 
     Written by Nathaniel A. Frissell, Fall 2013
     """
-    from scipy.interpolate import interp1d
     currentData = getDataSet(dataObj,dataSet)
 
     nrTimes = len(currentData.time)
     nrBeams = len(currentData.fov.beams)
     nrGates = len(currentData.fov.gates)
 
+    #If metadata['gateLimits'], select only those measurements...
+    gateInx = np.arange(nrGates)
+    if currentData.metadata.has_key('gateLimits'):
+        limits = currentData.metadata['gateLimits']
+        gateInx = np.where(np.logical_and(currentData.fov.gates >= limits[0],currentData.fov.gates <= limits[1]))[0]
+
+    #Interpolate all of the times of a beam at once.
     interpArr = np.zeros([nrTimes,nrBeams,nrGates])
-    for tt in range(nrTimes):
+    if len(gateInx) >= 2:
         for bb in range(nrBeams):
             rangeVec  = currentData.fov.slantRCenter[bb,:]
-            input_x   = copy.copy(rangeVec)
-            input_y   = currentData.data[tt,bb,:]
-
-            #If metadata['gateLimits'], select only those measurements...
-            if currentData.metadata.has_key('gateLimits'):
-                limits = currentData.metadata['gateLimits']
-                gateInx = np.where(np.logical_and(currentData.fov.gates >= limits[0],currentData.fov.gates <= limits[1]))[0]
-
-                if len(gateInx) < 2: continue
-                input_x   = input_x[gateInx]
-                input_y   = input_y[gateInx]
-
-            good      = np.where(np.isfinite(input_y))[0]
-            if len(good) < 2: continue
-            input_x   = input_x[good]
-            input_y   = input_y[good]
-
-            intFn     = interp1d(input_x,input_y,bounds_error=False,fill_value=0)
-            interpArr[tt,bb,:] = intFn(rangeVec)
+            input_y   = np.transpose(currentData.data[:,bb,gateInx])
+            interpArr[:,bb,:] = np.transpose(interpFinite(rangeVec[gateInx],input_y,rangeVec,fill_value=0))
     newDataSet = currentData.copy(newDataSetName,comment)
     newDataSet.data = interpArr
     newDataSet.setActive()
@@ -980,7 +1132,6 @@ def timeInterpolation(dataObj,dataSet='active',newDataSetName='timeInterpolated'
 
     Written by Nathaniel A. Frissell, Fall 2013
     """
-    from scipy.interpolate import interp1d
     import utils 
     currentData = getDataSet(dataObj,dataSet)
 
@@ -1005,22 +1156,9 @@ def timeInterpolation(dataObj,dataSet='active',newDataSetName='timeInterpolated'
     nrBeams = len(currentData.fov.beams)
     nrGates = len(currentData.fov.gates)
 
-    interpArr = np.zeros([nrTimes,nrBeams,nrGates])
-
-    for rg in range(nrGates):
-        for bb in range(nrBeams):
-            input_x   = currentData.time[:]
-            input_y   = currentData.data[:,bb,rg]
-
-            good      = np.where(np.isfinite(input_y))[0]
-            if len(good) < 2: continue
-            input_x   = input_x[good]
-            input_y   = input_y[good]
-
-            input_x   = utils.datetimeToEpoch(input_x)
-
-            intFn     = interp1d(input_x,input_y,bounds_error=False)#,fill_value=0)
-            interpArr[:,bb,rg] = intFn(newEpochVec)
+    #Interpolate every cell at once, each using only its own finite values.
+    epochVec  = utils.datetimeToEpoch(currentData.time)
+    interpArr = interpFinite(epochVec,currentData.data,newEpochVec)
     newDataSet = currentData.copy(newDataSetName,comment)
     newDataSet.time = newTimeVec
     newDataSet.data = interpArr
@@ -1320,14 +1458,9 @@ class filter(object):
         val_tm0 = sigobj.time[tinx0]
         val_tm1 = sigobj.time[tinx1]
 
-        filteredData = np.zeros_like(sigobj.data)
-
-        #Apply filter
-        for bm in range(nrBeams):
-            for rg in range(nrGates):
-                tmp = sp.signal.lfilter(self.ir,[1.0],sigobj.data[:,bm,rg])
-                tmp = np.roll(tmp,shift)
-                filteredData[:,bm,rg] = tmp[:]
+        #Apply filter to every cell along the time axis.
+        filteredData = sp.signal.lfilter(self.ir,[1.0],sigobj.data,axis=0)
+        filteredData = np.roll(filteredData,shift,axis=0)
 
         #Create new signal object.
         newsigobj = sigobj.copy(newDataSetName,self.comment)
@@ -1379,13 +1512,10 @@ def detrend(dataObj,dataSet='active',newDataSetName='detrended',comment=None,typ
 
     nrTimes, nrBeams, nrGates = np.shape(currentData.data)
 
-    newDataArr= np.zeros_like(currentData.data)
-    for bm in range(nrBeams):
-        for rg in range(nrGates):
-            try:
-                newDataArr[:,bm,rg] = sp.signal.detrend(currentData.data[:,bm,rg],type=type)
-            except:
-                newDataArr[:,bm,rg] = np.nan
+    #Cells with any non-finite value cannot be detrended and are set to NaN.
+    good      = np.all(np.isfinite(currentData.data),axis=0)
+    newDataArr= sp.signal.detrend(np.where(good,currentData.data,0.),axis=0,type=type)
+    newDataArr[:,np.logical_not(good)] = np.nan
   
     if comment == None:
         comment = type.capitalize() + ' detrend (scipy.signal.detrend)'
@@ -1437,10 +1567,7 @@ def windowData(dataObj,dataSet='active',newDataSetName='windowed',comment=None,w
     nrTimes, nrBeams, nrGates = np.shape(currentData.data)
 
     win = sp.signal.get_window(window,nrTimes,fftbins=False)
-    newDataArr= np.zeros_like(currentData.data)
-    for bm in range(nrBeams):
-        for rg in range(nrGates):
-            newDataArr[:,bm,rg] = currentData.data[:,bm,rg] * win
+    newDataArr= currentData.data * win[:,np.newaxis,np.newaxis]
   
     if comment == None:
         comment = window.capitalize() + ' window applied (scipy.signal.get_window)'
@@ -1473,10 +1600,8 @@ def calculateFFT(dataObj,dataSet='active',comment=None):
     freq_ax = freq_ax * 2. * nyq
 
     #Use complex64, not complex128!  If you use complex128, too much numerical noise will accumulate and the final plot will be bad!
-    newDataArr= np.zeros((nrTimes,nrBeams,nrGates),dtype=np.complex64)
-    for bm in range(nrBeams):
-        for rg in range(nrGates):
-            newDataArr[:,bm,rg] = sp.fftpack.fftshift(sp.fftpack.fft(currentData.data[:,bm,rg])) / np.size(currentData.data[:,bm,rg])
+    newDataArr= sp.fftpack.fftshift(sp.fftpack.fft(currentData.data,axis=0),axes=0) / nrTimes
+    newDataArr= newDataArr.astype(np.complex64)
   
     currentData.freqVec   = freq_ax
     currentData.spectrum  = newDataArr
@@ -1489,18 +1614,28 @@ def calculateFFT(dataObj,dataSet='active',comment=None):
     data        = np.abs(currentData.spectrum[posFreqInx,:,:]) #Use the magnitude of the positive frequency data.
 
     #Average Power Spectral Density
-    avg_psd = np.zeros(npf)
-    for x in range(npf): avg_psd[x] = np.mean(data[x,:,:])
+    avg_psd = np.mean(data.reshape(npf,-1),axis=1)
     currentData.dominantFreq = posFreqVec[np.argmax(avg_psd)]
     currentData.appendHistory('Calculated FFT')
+    if hasattr(currentData.parent,'enforceMemoryBudget'): currentData.parent.enforceMemoryBudget()
   
-def calculateDlm(dataObj,dataSet='active',comment=None):
+def calculateDlm(dataObj,dataSet='active',comment=None,dtype=np.complex128):
     """Calculate the cross-spectral matrix of a musicaArray object. FFT must already have been calculated.
 
+    Dlm[l,m] is the sum over the positive frequencies of spectrum_l * conj(spectrum_m), where the cells l and m are
+    numbered gate by gate (cell l = gate*nrBeams + beam, see llLookupTable).  It is computed as a single matrix product.
+
+    Dlm has at most as many nonzero eigenvalues as there are positive frequencies, and it is usually smaller than
+    nCells.  The former element by element complex64 sums left rounding noise which kept its zero eigenvalues
+    distinct.  The exact product makes them repeated, so that a general eigensolver (np.linalg.eig) returns
+    non-orthogonal noise eigenvectors and a distorted kArr.  Use a Hermitian solver, as :func:`calculateKarr` does
+    by default.
+
     **Args**:
         * **dataObj** (:class:`musicArray`): musicArray object
         * [**dataSet**] (str): which dataSet in the musicArray object to process
         * [**comment**] (str): String to be appended to the history of this object.  Set to None for the Default comment (recommended).
+        * [**dtype**] (numpy dtype): type of Dlm.  np.complex64 halves the memory used by the nCells x nCells matrix.
 
     Written by Nathaniel A. Frissell, Fall 2013
     """
@@ -1509,34 +1644,225 @@ def calculateDlm(dataObj,dataSet='active',comment=None):
     nrTimes, nrBeams, nrGates = np.shape(currentData.data)
 
     nCells                    = nrBeams * nrGates
-    currentData.llLookupTable = np.zeros([5,nCells])
-    currentData.Dlm           = np.zeros([nCells,nCells],dtype=np.complex128)
 
     #Only use positive frequencies...
     posInx = np.where(currentData.freqVec > 0)[0]
 
+    currentData.llLookupTable = cellLookupTable(currentData)
+
+    #Positive frequency spectrum as a (nFreqs, nCells) array, in the same cell order.
+    spect = np.transpose(currentData.spectrum[posInx,:,:],(0,2,1)).reshape(len(posInx),nCells).astype(dtype)
+    currentData.Dlm = np.dot(spect.T,np.conj(spect))
+
+    currentData.appendHistory('Calculated Cross-Spectral Matrix Dlm')
+    if hasattr(currentData.parent,'enforceMemoryBudget'): currentData.parent.enforceMemoryBudget()
+
+def cellLookupTable(currentData):
+    """Table of the cells of the cross-spectral matrix Dlm.  Cells are ordered gate by gate, with the beams varying
+    fastest (cell = gate*nrBeams + beam).
+
+    **Args**:
+        * **currentData** (:class:`musicDataObj`): musicDataObj object, after determineRelativePosition()
+    **Returns**:
+        * **llLookupTable** (numpy.array): (5, nCells) array; the rows are the cell number, beam, gate, N-S distance
+            and E-W distance from the center of the array [km].
+    """
+    nrTimes, nrBeams, nrGates = np.shape(currentData.data)
+    nCells  = nrBeams * nrGates
+
     #Explicitly write out gate/range indices...
+    bbInx   = np.tile(np.arange(nrBeams),nrGates)
+    ggInx   = np.repeat(np.arange(nrGates),nrBeams)
 
-    llList = []
-    for gg in xrange(nrGates):
-        for bb in xrange(nrBeams):
-            llList.append((bb,gg))
+    ew_dist = currentData.fov.relative_x[bbInx,ggInx]
+    ns_dist = currentData.fov.relative_y[bbInx,ggInx]
+    return np.array([np.arange(nCells), currentData.fov.beams[bbInx], currentData.fov.gates[ggInx],ns_dist,ew_dist],dtype=np.float64)
 
+class slidingDlm(object):
+    """Cross-spectral matrix Dlm of a window sliding along a long data set, updated incrementally.
 
-    for ll in range(nCells):
-        llAI  = llList[ll]
-        ew_dist           = currentData.fov.relative_x[llAI]
-        ns_dist           = currentData.fov.relative_y[llAI]
-        currentData.llLookupTable[:,ll]  = [ll, currentData.fov.beams[llAI[0]], currentData.fov.gates[llAI[1]],ns_dist,ew_dist]
-        spectL            = currentData.spectrum[posInx,llAI[0],llAI[1]]
-        for mm in range(nCells):
-            mmAI  = llList[mm]
-            spectM          = currentData.spectrum[posInx,mmAI[0],mmAI[1]]
-            currentData.Dlm[ll,mm] = np.sum(spectL * np.conj(spectM))
+    Sliding the window by step samples changes the (unnormalized) DFT of each cell by the samples entering and leaving
+    the window:  X_k' = exp(2 pi i k step/N) * (X_k + sum_j W_kj (x[end+j] - x[start+j])), with W_kj = exp(-2 pi i k j/N).
+    The phase factor is the same for every cell, so that Dlm = sum_k X_k X_k^H only changes by the rank-step terms
+    X^T conj(D) + D^T conj(X) + D^T conj(D), where D = W Delta.  These cost O(nCells^2 * step) instead of the
+    O(nCells^2 * nFreqs) of :func:`calculateDlm`.
 
-    currentData.appendHistory('Calculated Cross-Spectral Matrix Dlm')
+    Dlm is accumulated in double precision and recomputed from scratch every resync steps.  It matches calculateDlm
+    of the same window (which works from the single precision spectrum of calculateFFT) to about 1e-6 of max(abs(Dlm)).
+    The data must be regularly sampled and should not be windowed (see windowData), since a taper changes every sample
+    of the window when it moves.
+
+    **Args**:
+        * **dataObj** (:class:`musicArray`): musicArray object
+        * [**dataSet**] (str): which dataSet in the musicArray object to process.  It should be filtered and have its
+            limits applied, as for calculateFFT().
+        * [**nrTimes**] (int): Length of the window [samples].  None for the whole data set.
+        * [**step**] (int): Number of samples the window moves by in :func:`slidingDlm.advance`.
+        * [**resync**] (int): Recompute the spectra and Dlm from scratch after this many steps (0 for never).
+
+    **Methods**:
+        * :func:`slidingDlm.advance`
+        * :func:`slidingDlm.windowDataSet`
 
-def calculateKarr(dataObj,dataSet='active',kxMax=0.05,kyMax=0.05,dkx=0.001,dky=0.001,threshold=0.15):
+    **Example**:
+        ::
+
+            sld = music.slidingDlm(dataObj,nrTimes=60,step=5)
+            while True:
+                sld.windowDataSet()
+                music.calculateKarr(dataObj)
+                music.detectSignals(dataObj)
+                if not sld.advance(): break
+    """
+    def __init__(self,dataObj,dataSet='active',nrTimes=None,step=1,resync=100):
+        self.dataObj    = dataObj
+        self.currentData= getDataSet(dataObj,dataSet)
+
+        nrTotal, nrBeams, nrGates = np.shape(self.currentData.data)
+        if nrTimes is None: nrTimes = nrTotal
+        if nrTimes > nrTotal:
+            raise ValueError('Window of '+str(nrTimes)+' samples longer than the data set ('+str(nrTotal)+' samples)')
+
+        self.nrTimes    = nrTimes
+        self.step       = step
+        self.resync     = resync
+        self.nCells     = nrBeams * nrGates
+        self.start      = 0
+        self.steps      = 0
+
+        #Samples as a (nrTotal, nCells) array in the cell order of calculateDlm.
+        self.cells      = np.transpose(self.currentData.data,(0,2,1)).reshape(nrTotal,self.nCells)
+
+        #DFT bins used by calculateDlm: the positive frequencies of calculateFFT's (shifted) frequency axis.
+        freq_ax         = np.arange(nrTimes,dtype='f8')
+        freq_ax         = (freq_ax / max(freq_ax)) - 0.5
+        self.posBins    = (np.where(freq_ax > 0)[0] - nrTimes/2) % nrTimes
+
+        kk              = np.arange(nrTimes)[:,np.newaxis]
+        self.stepDft    = np.exp(-2j*np.pi*kk*np.arange(step)[np.newaxis,:]/nrTimes)
+        self.stepPhase  = np.exp(2j*np.pi*kk[:,0]*step/nrTimes)
+        stepDftPos      = self.stepDft[self.posBins,:]
+        self.stepGram   = np.dot(stepDftPos.T,np.conj(stepDftPos))
+
+        self.compute()
+
+    def compute(self):
+        """Compute the spectra and Dlm of the current window from scratch.
+        """
+        win         = self.cells[self.start:self.start+self.nrTimes,:]
+        self.X      = np.fft.fft(win,axis=0)
+        Xp          = self.X[self.posBins,:]
+        self.DlmRaw = np.dot(Xp.T,np.conj(Xp))
+
+    def advance(self):
+        """Move the window by step samples and update the spectra and Dlm.
+
+        **Returns**:
+            * False (and the window is not moved) if the window would go past the end of the data set.
+        """
+        start = self.start
+        if start + self.step + self.nrTimes > self.cells.shape[0]: return False
+
+        #Samples entering minus samples leaving the window.
+        delta   = self.cells[start+self.nrTimes:start+self.nrTimes+self.step,:] - self.cells[start:start+self.step,:]
+
+        #X^T conj(D) + D^T conj(X) + D^T conj(D) = C + C^H, with C = (X^T conj(W) + Delta^T W^T conj(W) / 2) conj(Delta)
+        Xp      = self.X[self.posBins,:]
+        cross   = np.dot(Xp.T,np.conj(self.stepDft[self.posBins,:])) + 0.5*np.dot(delta.T,self.stepGram)
+        cross   = np.dot(cross,np.conj(delta))
+        self.DlmRaw += cross
+        self.DlmRaw += np.conj(cross.T)
+        self.X  = (self.X + np.dot(self.stepDft,delta)) * self.stepPhase[:,np.newaxis]
+
+        self.start  = start + self.step
+        self.steps  = self.steps + 1
+        if self.resync > 0 and self.steps % self.resync == 0: self.compute()
+        return True
+
+    @property
+    def Dlm(self):
+        """Cross-spectral matrix of the current window, normalized as in calculateDlm.
+        """
+        return self.DlmRaw / float(self.nrTimes)**2
+
+    @property
+    def time(self):
+        """Time vector of the current window.
+        """
+        return self.currentData.time[self.start:self.start+self.nrTimes]
+
+    def windowDataSet(self,newDataSetName='slidingWindow',comment=None):
+        """Store the current window as a new musicDataObj, with the spectrum, dominant frequency and Dlm that
+        calculateFFT() and calculateDlm() would give, and make it active so that calculateKarr() and
+        detectSignals() can be run on it.  The data set is replaced each time this is called.
+
+        **Args**:
+            * [**newDataSetName**] (str): Name of the new musicDataObj.
+            * [**comment**] (str): String to be appended to the history of this object.  Set to None for the Default comment (recommended).
+        **Returns**:
+            * **newDataSet** (:class:`musicDataObj`)
+        """
+        if comment == None:
+            comment = 'Sliding window: '+self.time[0].strftime('%Y-%m-%d/%H:%M:%S')+' - '+self.time[-1].strftime('%Y-%m-%d/%H:%M:%S')
+
+        nrTimes     = self.nrTimes
+        newDataSet  = self.currentData.copy(newDataSetName,comment)
+        newDataSet.data = newDataSet.data[self.start:self.start+nrTimes]
+        newDataSet.time = newDataSet.time[self.start:self.start+nrTimes]
+
+        #Same frequency axis and dominant frequency as calculateFFT().
+        nyq         = newDataSet.nyquistFrequency()
+        freq_ax     = np.arange(nrTimes,dtype='f8')
+        freq_ax     = (freq_ax / max(freq_ax)) - 0.5
+        newDataSet.freqVec  = freq_ax * 2. * nyq
+
+        spectrum    = np.fft.fftshift(self.X,axes=0) / nrTimes
+        nrBeams     = len(newDataSet.fov.beams)
+        newDataSet.spectrum = np.transpose(spectrum.reshape(nrTimes,-1,nrBeams),(0,2,1)).astype(np.complex64)
+
+        posFreqInx  = np.where(newDataSet.freqVec >= 0)[0]
+        avg_psd     = np.mean(np.abs(newDataSet.spectrum[posFreqInx,:,:]).reshape(len(posFreqInx),-1),axis=1)
+        newDataSet.dominantFreq = newDataSet.freqVec[posFreqInx][np.argmax(avg_psd)]
+
+        newDataSet.llLookupTable = cellLookupTable(newDataSet)
+        newDataSet.Dlm  = self.Dlm
+        newDataSet.appendHistory('Calculated FFT and Cross-Spectral Matrix Dlm (sliding window)')
+        newDataSet.setActive()
+        if hasattr(newDataSet.parent,'enforceMemoryBudget'): newDataSet.parent.enforceMemoryBudget()
+        return newDataSet
+
+def dominantEigen(mat,threshold=0.15,k=16):
+    """Find the eigenvalues of a Hermitian matrix larger than a fraction of the largest one, and their eigenvectors,
+    without a full eigendecomposition.  The k largest eigenpairs are found with ARPACK (scipy.sparse.linalg.eigsh),
+    doubling k until an eigenvalue below threshold is reached.
+
+    **Args**:
+        * **mat** (numpy.array): Hermitian positive semi-definite (nCells x nCells) matrix
+        * [**threshold**] (float):  fraction of the largest eigenvalue
+        * [**k**] (int):            number of eigenpairs to start with
+    **Returns**:
+        * **eVals** (numpy.array): the eigenvalues larger than threshold times the largest one, in decreasing order
+        * **eVecs** (numpy.array): the corresponding eigenvectors, one per column
+    """
+    from scipy.sparse.linalg import eigsh
+
+    nCells = mat.shape[0]
+    k      = min(k,nCells-2)
+    while True:
+        if k < 1:
+            eVals,eVecs = np.linalg.eigh(mat)
+        else:
+            eVals,eVecs = eigsh(mat,k=k,which='LA')
+        order       = np.argsort(eVals)[::-1]
+        eVals,eVecs = eVals[order],eVecs[:,order]
+        if k < 1 or eVals[-1] <= threshold*eVals[0]: break
+        #Still no eigenvalue below threshold, look further or fall back to a full decomposition.
+        k = 2*k if 2*k < nCells-1 else 0
+
+    inx = np.where(eVals > threshold*eVals[0])[0]
+    return eVals[inx],eVecs[:,inx]
+
+def calculateKarr(dataObj,dataSet='active',kxMax=0.05,kyMax=0.05,dkx=0.001,dky=0.001,threshold=0.15,blockSize=4096,nThreads=1,solver='eigh'):
     """Calculate the two-dimensional horizontal wavenumber array of a musicArray/musicDataObj object.
     Cross-spectrum array Dlm must already have been calculated.
 
@@ -1548,15 +1874,36 @@ def calculateKarr(dataObj,dataSet='active',kxMax=0.05,kyMax=0.05,dkx=0.001,dky=0
         * [**dkx**] (float):        kx resolution [rad/km]
         * [**dky**] (float):        ky resolution [rad/km]
         * [**threshold**] (float):  threshold of signals to detect as a fraction of the maximum eigenvalue
+        * [**blockSize**] (int):    approximate number of (kx,ky) points evaluated at once.  Memory use is about
+                                    blockSize*nCells complex numbers per thread.
+        * [**nThreads**] (int):     number of threads evaluating blocks in parallel
+        * [**solver**] (str):       eigensolver used for the cross-spectral matrix Dlm:
+                                    'eigh': full Hermitian decomposition.
+                                    'eig': full general decomposition (slowest).  Dlm is rank deficient, and eig
+                                    returns non-orthogonal eigenvectors for its repeated zero eigenvalues, which
+                                    distorts kArr.  With the exact Dlm of :func:`calculateDlm` this does not
+                                    reproduce the results of the original code either.
+                                    'partial': only the signal eigenvectors U are found (see :func:`dominantEigen`),
+                                    and the noise projector is I - U U^H.  Fastest on large arrays.
 
     Written by Nathaniel A. Frissell, Fall 2013
     """
     currentData = getDataSet(dataObj,dataSet)
 
     nrTimes, nrBeams, nrGates = np.shape(currentData.data)
+    nCells  = np.shape(currentData.Dlm)[0]
 
     #Calculate eigenvalues, eigenvectors
-    eVals,eVecs = np.linalg.eig(np.transpose(dataObj.active.Dlm))
+    if solver == 'eigh':
+        eVals,eVecs = np.linalg.eigh(np.transpose(currentData.Dlm))
+    elif solver == 'eig':
+        eVals,eVecs = np.linalg.eig(np.transpose(currentData.Dlm))
+        #Dlm is Hermitian, so that the eigenvalues are real apart from numerical noise.
+        eVals       = np.real(eVals)
+    elif solver == 'partial':
+        eVals,eVecs = dominantEigen(np.transpose(currentData.Dlm),threshold)
+    else:
+        raise ValueError("solver must be 'eigh', 'eig' or 'partial', not " + str(solver))
 
     nkx     = np.ceil(2*kxMax/dkx)
     if (nkx % 2) == 0: nkx = nkx+1
@@ -1572,17 +1919,15 @@ def calculateKarr(dataObj,dataSet='active',kxMax=0.05,kyMax=0.05,dkx=0.001,dky=0
     xm      = currentData.llLookupTable[4,:] #x is in the E-W direction.
     ym      = currentData.llLookupTable[3,:] #y is in the N-S direction.
 
-    threshold   = 0.15
     maxEval     = np.max(np.abs(eVals))
 
     minEvalsInx = np.where(eVals <= threshold*maxEval)[0]
-    cnt         = np.size(minEvalsInx)
     maxEvalsInx = np.where(eVals >  threshold*maxEval)[0]
     nSigs       = np.size(maxEvalsInx)
+    cnt         = nCells - nSigs
 
     if cnt < 3:
-        print 'Not enough small eigenvalues!'
-        import ipdb; ipdb.set_trace()
+        raise ValueError('Not enough small eigenvalues! ('+str(cnt)+' below threshold)')
 
     print 'K-Array: ' + str(nkx) + ' x ' + str(nky)
     print 'Kx Max: ' + str(kxMax)
@@ -1596,17 +1941,42 @@ def calculateKarr(dataObj,dataSet='active',kxMax=0.05,kyMax=0.05,dkx=0.001,dky=0
 
     print 'Starting kArr Calculation...'
     t0 = datetime.datetime.now()
-    def vCalc(um,v):
-        return np.dot( np.conj(um), v) * np.dot( np.conj(v), um)
-
-    vList = [eVecs[:,minEvalsInx[ee]] for ee in xrange(cnt)]
+    #Noise subspace, one eigenvector per column.  The Hermitian solvers give orthonormal eigenvectors, so that
+    #the usually much smaller signal subspace U can be used instead, with the noise projector I - U U^H.
+    useSigs = solver == 'partial' or (solver == 'eigh' and nSigs < cnt)
+    if useSigs:
+        vArr  = eVecs[:,maxEvalsInx]
+    else:
+        vArr  = eVecs[:,minEvalsInx]
     kArr  = np.zeros((nkx,nky),dtype=np.complex64)
-    for kk_kx in xrange(nkx):
-        kx  = kxVec[kk_kx]
-        for kk_ky in xrange(nky):
-            ky  = kyVec[kk_ky]
-            um  = np.exp(1j*(kx*xm + ky*ym))
-            kArr[kk_kx,kk_ky]= 1. / np.sum(map(lambda v: vCalc(um,v), vList))
+
+    #The steering vector um = exp(1j*(kx*xm + ky*ym)) separates into a kx and a ky factor.
+    #Each block covers whole rows of kArr (nBlk kx values by all the ky values).
+    ex    = np.exp(1j*np.outer(kxVec,xm))
+    ey    = np.exp(1j*np.outer(kyVec,ym))
+    nBlk  = max(1,int(blockSize)/nky)
+
+    def blockCalc(kk_kx):
+        #Steering matrix of the block, (nBlk*nky, nCells)
+        um  = (ex[kk_kx:kk_kx+nBlk,np.newaxis,:] * ey[np.newaxis,:,:]).reshape(-1,len(xm))
+        #Projection onto the noise eigenvectors: sum over v of dot(conj(um),v)*dot(conj(v),um)
+        prj = np.dot(np.conj(um),vArr)
+        pwr = np.sum(prj*np.conj(prj),axis=1)
+        #With the signal eigenvectors U: um^H (I - U U^H) um, where um^H um = nCells.
+        if useSigs: pwr = nCells - pwr
+        kArr[kk_kx:kk_kx+nBlk,:] = (1. / pwr).reshape(-1,nky)
+
+    blocks = range(0,nkx,nBlk)
+    if nThreads > 1 and len(blocks) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(processes=nThreads)
+        try:
+            pool.map(blockCalc,blocks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for kk_kx in blocks: blockCalc(kk_kx)
     t1 = datetime.datetime.now()
     print 'Finished kArr Calculation.  Total time: ' + str(t1-t0)
 
@@ -1614,6 +1984,7 @@ def calculateKarr(dataObj,dataSet='active',kxMax=0.05,kyMax=0.05,dkx=0.001,dky=0
     currentData.kxVec = kxVec
     currentData.kyVec = kyVec
     currentData.appendHistory('Calculated kArr')
+    if hasattr(currentData.parent,'enforceMemoryBudget'): currentData.parent.enforceMemoryBudget()
 
 def simulator(dataObj, dataSet='active',newDataSetName='simulated',comment=None,keepLocalRange=True,sigs=None,noiseFactor=0):
     """Replace SuperDARN Data with simulated MSTID(s).  This is useful for understanding how the signal processing
@@ -1786,7 +2157,6 @@ def simulator(dataObj, dataSet='active',newDataSetName='simulated',comment=None,
     #CLOSE,unit
 
 def scale_karr(kArr):
-    from scipy import stats
     """Scale/normalize kArr for plotting and signal detection.
     
     **Args**:
@@ -1801,18 +2171,27 @@ def scale_karr(kArr):
 
     #Determine scale for colorbar.
     scale       = [0.,1.]
-    sd          = stats.nanstd(data,axis=None)
-    mean        = stats.nanmean(data,axis=None)
+    sd          = np.nanstd(data,axis=None,ddof=1)
+    mean        = np.nanmean(data,axis=None)
     scMax       = mean + 6.5*sd
     data        = data / scMax
     return data
 
-def detectSignals(dataObj,dataSet='active',threshold=0.35,neighborhood=(10,10)):
+def detectSignals(dataObj,dataSet='active',threshold=0.35,neighborhood=(10,10),subpixel=True):
     """
-    Automatically detects local maxima/signals in a calculated kArr.  This routine uses the watershed
-    algorithm from the skimage image processing library.  Results are automatically stored in
+    Automatically detects local maxima/signals in a calculated kArr.  Peaks are the points above threshold which are the
+    maximum of their neighborhood (scipy.ndimage.maximum_filter).  Each point above threshold is then assigned to a
+    peak by a watershed on the scaled kArr (scipy.ndimage.watershed_ift).  Results are automatically stored in
     dataObj.dataSet.sigDetect.
 
+    Earlier versions found the peaks of the distance transform of the thresholded kArr instead (skimage
+    peak_local_max and watershed).  The ridge of an elongated region often has several such peaks, which split a
+    single kArr maximum into signals with adjacent maxpos.  Here it is one signal with the combined area.  For example,
+    karr = exp(-0.5*(kx/0.01)**2 - 0.5*(ky/0.003)**2) on the default kx/ky grids gives one signal at maxpos (50,50)
+    with an area of 293, where the distance transform gave two, at (50,50) and (47,50).  Conversely, two kArr maxima
+    more than about half a neighborhood apart within one compact region are now found separately, where the distance
+    transform only had one peak.
+
     **Args**:
         * **dataObj** (:class:`musicArray`): musicArray object
         * [**dataSet**] (str): which dataSet in the musicArray object to process
@@ -1820,6 +2199,8 @@ def detectSignals(dataObj,dataSet='active',threshold=0.35,neighborhood=(10,10)):
             will reduce the number of signals detected.
         * [**neighborhood**] (int,int): Local region in which to search for peaks at every point in the image/array.
             (10,10) will search a 10x10 pixel area.
+        * [**subpixel**] (bool): Refine kx and ky of each signal by fitting a parabola through the peak and its
+            neighbors along each axis.  maxpos always holds the grid indices of the peak.
 
     **Returns**:
         * **currentData**: musicDataObj object
@@ -1831,55 +2212,112 @@ def detectSignals(dataObj,dataSet='active',threshold=0.35,neighborhood=(10,10)):
     #Feature detection...
     #Now lets do a little image processing...
     from scipy import ndimage
-    from skimage.morphology import watershed
-    from skimage.feature import peak_local_max
-
-    #sudo pip install cython
-    #sudo pip install scikit-image
 
     data = scale_karr(currentData.karr)
-
-    mask        = data > threshold
-    labels, nb  = ndimage.label(mask)
-
-    distance    = ndimage.distance_transform_edt(mask)
-    local_maxi  = peak_local_max(distance,footprint=np.ones(neighborhood),indices=False)
-    markers,nb  = ndimage.label(local_maxi)
-    labels      = watershed(-distance,markers,mask=mask)
-
-    areas         = ndimage.sum(mask,labels,xrange(1,labels.max()+1))
-    maxima        = ndimage.maximum(data,labels,xrange(1, labels.max()+1))
-    sortedMaxima  = np.sort(maxima)[::-1]
-    maxpos        = ndimage.maximum_position(data,labels,xrange(1, labels.max()+1))
+    mask = data > threshold
+
+    #Local maxima.  Neighboring points of a flat peak are labeled as one marker.
+    peaks       = np.logical_and(mask,data == ndimage.maximum_filter(data,size=neighborhood,mode='nearest'))
+
+    #Regions above threshold overshadowed by a stronger peak nearby still get their own signal.
+    regions,nRegions = ndimage.label(mask)
+    hasPeak     = np.zeros(nRegions+1,dtype=np.bool)
+    hasPeak[regions[peaks]] = True
+    missing     = np.nonzero(np.logical_not(hasPeak[1:]))[0] + 1
+    if len(missing) > 0:
+        pos     = np.array(ndimage.maximum_position(data,regions,missing)).reshape(-1,2)
+        peaks[pos[:,0],pos[:,1]] = True
+    markers,nb  = ndimage.label(peaks)
+
+    #Watershed from the markers on the inverted kArr.  Points below threshold are flooded last and then dropped.
+    #watershed_ift is only reliable on uint8 levels, and does not flood through points at 255.
+    dMin,dMax   = np.min(data),np.max(data)
+    scaled      = (dMax - data) / (dMax - dMin) if dMax > dMin else np.zeros_like(data)
+    level       = np.round(scaled*253).astype(np.uint8)
+    level[np.logical_not(mask)] = 254
+    labels      = ndimage.watershed_ift(level,markers.astype(np.int32))
+    labels[np.logical_not(mask)] = 0
+
+    nrLabels    = labels.max() if labels.size > 0 else 0
+    inx         = np.arange(1,nrLabels+1)
+    areas       = np.bincount(labels.ravel(),minlength=nrLabels+1)[1:]
+    maxima      = np.atleast_1d(ndimage.maximum(data,labels,inx))
+    maxpos      = ndimage.maximum_position(data,labels,inx)
+    if nrLabels == 0: maxpos = []
+
+    #Signals are numbered by decreasing maximum.
+    order       = np.zeros(nrLabels,dtype=np.int)
+    order[np.argsort(-maxima,kind='mergesort')] = np.arange(1,nrLabels+1)
+
+    kxInx       = np.array([pos[0] for pos in maxpos],dtype=np.int)
+    kyInx       = np.array([pos[1] for pos in maxpos],dtype=np.int)
+    kx          = currentData.kxVec[kxInx]
+    ky          = currentData.kyVec[kyInx]
+    if subpixel:
+        kx      = kx + peakOffset(data,kxInx,kyInx,0) * (currentData.kxVec[1] - currentData.kxVec[0])
+        ky      = ky + peakOffset(data,kxInx,kyInx,1) * (currentData.kyVec[1] - currentData.kyVec[0])
+
+    with np.errstate(divide='ignore'):
+        k           = np.sqrt(kx**2 + ky**2)
+        lambda_x    = 2*np.pi / kx
+        lambda_y    = 2*np.pi / ky
+        lambda_     = 2*np.pi / k
+    azm         = np.degrees(np.arctan2(kx,ky))
+    freq        = currentData.dominantFreq
+    vel         = lambda_ * freq * 1000.
 
     sigDetect = SigDetect()
     sigDetect.mask    = mask
     sigDetect.labels  = labels
     sigDetect.nrSigs  = nb
     sigDetect.info    = []
-    for x in xrange(labels.max()):
+    for x in xrange(nrLabels):
         info = {}
         info['labelInx']    = x+1
-        info['order']       = int(np.where(maxima[x] == sortedMaxima)[0]) + 1
+        info['order']       = order[x]
         info['area']        = areas[x]
         info['max']         = maxima[x]
         info['maxpos']      = maxpos[x]
-        info['kx']          = currentData.kxVec[info['maxpos'][0]]
-        info['ky']          = currentData.kyVec[info['maxpos'][1]]
-        info['k']           = np.sqrt( info['kx']**2 + info['ky']**2 )
-        info['lambda_x']    = 2*np.pi / info['kx']
-        info['lambda_y']    = 2*np.pi / info['ky']
-        info['lambda']      = 2*np.pi / info['k']
-        info['azm']         = np.degrees(np.arctan2(info['kx'],info['ky']))
-        info['freq']        = currentData.dominantFreq
-        info['period']      = 1./currentData.dominantFreq
-        info['vel']         = (2.*np.pi/info['k']) * info['freq'] * 1000.
+        info['kx']          = kx[x]
+        info['ky']          = ky[x]
+        info['k']           = k[x]
+        info['lambda_x']    = lambda_x[x]
+        info['lambda_y']    = lambda_y[x]
+        info['lambda']      = lambda_[x]
+        info['azm']         = azm[x]
+        info['freq']        = freq
+        info['period']      = 1./freq
+        info['vel']         = vel[x]
         sigDetect.info.append(info)
 
     currentData.appendHistory('Detected KArr Signals')
     currentData.sigDetect = sigDetect
     return currentData
 
+def peakOffset(data,xInx,yInx,axis):
+    """Sub-pixel offset of peaks of a 2D array along one axis, from the parabola through each peak and its two
+    neighbors.  Peaks on the edge of the array are not moved.
+
+    **Args**:
+        * **data** (2D numpy.array): array holding the peaks
+        * **xInx** (numpy.array): first indices of the peaks
+        * **yInx** (numpy.array): second indices of the peaks
+        * **axis** (int): axis along which to refine the peaks
+    **Returns**:
+        * **offset** (numpy.array): offsets between -0.5 and 0.5 [samples]
+    """
+    pos     = (xInx,yInx)[axis]
+    edge    = np.logical_or(pos == 0,pos == data.shape[axis]-1)
+    step    = np.where(edge,0,1)
+    if axis == 0:
+        fm,f0,fp    = data[xInx-step,yInx],data[xInx,yInx],data[xInx+step,yInx]
+    else:
+        fm,f0,fp    = data[xInx,yInx-step],data[xInx,yInx],data[xInx,yInx+step]
+
+    curv    = fm - 2.*f0 + fp
+    offset  = np.where(curv < 0,0.5*(fm - fp)/np.where(curv < 0,curv,-1.),0.)
+    return np.clip(offset,-0.5,0.5)
+
 def add_signal(kx,ky,dataObj,dataSet='active',frequency=None):
     """Manually add a signal to the detected signal list.  All signals will be re-ordered according to value in the 
     scaled kArr.  Added signals can be distinguished from autodetected signals because 
@@ -1901,11 +2339,9 @@ def add_signal(kx,ky,dataObj,dataSet='active',frequency=None):
     currentData = getDataSet(dataObj,dataSet)
     data = scale_karr(currentData.karr)
 
-    def find_nearest_inx(array,value):
-        return (np.abs(array-value)).argmin()
-
-    kx_inx  = find_nearest_inx(currentData.kxVec,kx)
-    ky_inx  = find_nearest_inx(currentData.kyVec,ky)
+    #Nearest point of the regular kx/ky grids.
+    kx_inx  = int(np.clip(np.round((kx - currentData.kxVec[0]) / (currentData.kxVec[1] - currentData.kxVec[0])),0,len(currentData.kxVec)-1))
+    ky_inx  = int(np.clip(np.round((ky - currentData.kyVec[0]) / (currentData.kyVec[1] - currentData.kyVec[0])),0,len(currentData.kyVec)-1))
 
     maxpos      = (kx_inx,ky_inx)
     value       = data[kx_inx,ky_inx]
@@ -0,0 +1,286 @@
+# Copyright (C) 2012  VT SuperDARN Lab
+# Full license can be found in LICENSE.txt
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: musicBatch
+    :synopsis: Run the MUSIC processing chain on sliding windows across long intervals and many radars.
+
+    Each window goes through the same chain as the MUSIC notebook in the docs folder of the DaViTPy distribution
+    (limits, beam and time interpolation, FIR filter, FFT, Dlm, kArr and signal detection).  Windows are processed in
+    a pool of processes, and the detected signals of each window are appended to a CSV results table as soon as it
+    finishes.  A second file (the results file name + '.done') records every finished window, so that an interrupted
+    batch picks up where it stopped when it is run again.
+
+    **Example**:
+        ::
+
+            from pydarn.proc.music import musicBatch
+            sTime   = datetime.datetime(2011,5,1)
+            eTime   = datetime.datetime(2011,6,1)
+            windows = musicBatch.slidingWindows(sTime,eTime,datetime.timedelta(hours=2),datetime.timedelta(minutes=30))
+            musicBatch.runBatch(['bks','fhe','fhw'],windows,'mstid_may2011.csv',nprocs=8,gateLimits=(10,40))
+            sigs    = musicBatch.readBatchResults('mstid_may2011.csv')
+
+*********************
+**Module**: pydarn.proc.music.musicBatch
+*********************
+**Functions**:
+    * :func:`pydarn.proc.music.musicBatch.slidingWindows`: Overlapping time windows covering an interval.
+    * :func:`pydarn.proc.music.musicBatch.runWindow`: Run the MUSIC chain on one radar and window.
+    * :func:`pydarn.proc.music.musicBatch.runBatch`: Run many windows in a process pool, with checkpoints.
+    * :func:`pydarn.proc.music.musicBatch.readBatchResults`: Read a results table back into a numpy record array.
+"""
+
+import numpy as np
+import datetime
+
+#Default processing settings of runWindow.
+batchDefaults = {
+    'param':        'p_l',          #Fit parameter to process
+    'gscat':        1,              #Ground scatter option of musicArray
+    'fovModel':     'GS',           #Scatter mapping model of musicArray
+    'fileType':     'fitex',        #Passed to pydarn.sdio.radDataOpen
+    'channel':      None,           #Passed to pydarn.sdio.radDataOpen
+    'gateLimits':   None,
+    'beamLimits':   None,
+    'maxOffTime':   10,             #Windows where the radar is off for longer [min] are skipped (see checkDataQuality)
+    'timeRes':      120,            #Time resolution of the interpolated data [s]
+    'numTaps':      101,            #FIR filter length
+    'cutoff_low':   0.0003,         #FIR filter band [Hz]
+    'cutoff_high':  0.0012,
+    'kxMax':        0.05,           #kArr grid [rad/km]
+    'kyMax':        0.05,
+    'dkx':          0.001,
+    'dky':          0.001,
+    'threshold':    0.15,           #Signal eigenvalue threshold of calculateKarr
+    'solver':       'eigh',         #Eigensolver of calculateKarr
+    'sigThreshold': 0.35,           #Threshold of detectSignals
+    'neighborhood': (10,10),        #Neighborhood of detectSignals
+    }
+
+#Columns of the results table: one row per detected signal.
+resultColumns = [('radar','S3'), ('sTime','datetime64[s]'), ('eTime','datetime64[s]'), ('order','i4'),
+                 ('max','f8'), ('area','f8'), ('kx','f8'), ('ky','f8'), ('k','f8'), ('lambda','f8'),
+                 ('azm','f8'), ('freq','f8'), ('period','f8'), ('vel','f8')]
+
+def slidingWindows(sTime,eTime,windowLength,step):
+    """Overlapping time windows covering an interval.
+
+    **Args**:
+        * **sTime** (datetime.datetime): Start of the interval.
+        * **eTime** (datetime.datetime): End of the interval.  The last window ends at or before eTime.
+        * **windowLength** (datetime.timedelta): Length of each window.
+        * **step** (datetime.timedelta): Time between the starts of consecutive windows.
+    **Returns**:
+        * **windows** (list of (datetime.datetime, datetime.datetime)): Start and end of each window.
+    """
+    windows = []
+    wStart  = sTime
+    while wStart + windowLength <= eTime:
+        windows.append((wStart,wStart+windowLength))
+        wStart = wStart + step
+    return windows
+
+def runWindow(radar,sTime,eTime,**settings):
+    """Run the MUSIC processing chain on one radar and time window and return the detected signals.
+
+    Data are loaded for the window plus the length of the FIR filter (see :func:`pydarn.proc.music.filterTimes`),
+    so that the filtered data cover the whole window.
+
+    **Args**:
+        * **radar** (str): 3-letter radar code.
+        * **sTime** (datetime.datetime): Start of the window.
+        * **eTime** (datetime.datetime): End of the window.
+        * [**settings**]: Processing settings, see batchDefaults.
+    **Returns**:
+        * **status** (str): 'ok', 'nodata' (no data or radar off for too long) or 'error'.
+        * **signals** (list of dict): sigDetect.info of the final data set, ordered by signal strength.
+    """
+    import pydarn
+    from pydarn.proc import music
+
+    s = dict(batchDefaults)
+    s.update(settings)
+
+    loadTimes = music.filterTimes(sTime,eTime,s['timeRes'],s['numTaps'])
+    myPtr     = pydarn.sdio.radDataOpen(loadTimes[0],radar,eTime=loadTimes[1],channel=s['channel'],fileType=s['fileType'])
+    dataObj   = music.musicArray(myPtr,sTime=loadTimes[0],eTime=loadTimes[1],param=s['param'],gscat=s['gscat'],fovModel=s['fovModel'])
+    if not hasattr(dataObj,'active'): return 'nodata',[]
+
+    music.checkDataQuality(dataObj,max_off_time=s['maxOffTime'],sTime=sTime,eTime=eTime)
+    if not dataObj.active.metadata['good_period']: return 'nodata',[]
+
+    music.defineLimits(dataObj,gateLimits=s['gateLimits'],beamLimits=s['beamLimits'])
+    music.defineLimits(dataObj,timeLimits=loadTimes)
+    dataObj.active.applyLimits()
+    music.beamInterpolation(dataObj)
+    music.timeInterpolation(dataObj,timeRes=s['timeRes'])
+    music.determineRelativePosition(dataObj)
+    music.filter(dataObj,numtaps=s['numTaps'],cutoff_low=s['cutoff_low'],cutoff_high=s['cutoff_high'])
+    dataObj.active.applyLimits()
+
+    music.calculateFFT(dataObj)
+    music.calculateDlm(dataObj)
+    music.calculateKarr(dataObj,kxMax=s['kxMax'],kyMax=s['kyMax'],dkx=s['dkx'],dky=s['dky'],threshold=s['threshold'],solver=s['solver'])
+    music.detectSignals(dataObj,threshold=s['sigThreshold'],neighborhood=s['neighborhood'])
+
+    signals = sorted(dataObj.active.sigDetect.info,key=lambda sig: sig['order'])
+    return 'ok',signals
+
+def runWindowJob(job):
+    """Pool worker of :func:`runBatch`: runs one (radar, sTime, eTime, settings) job and catches any failure.
+
+    **Returns**:
+        * **(radar, sTime, eTime, status, message, rows)**: rows are lists of values in the order of resultColumns.
+    """
+    import traceback
+
+    radar,sTime,eTime,settings = job
+    try:
+        status,signals = runWindow(radar,sTime,eTime,**settings)
+    except Exception:
+        message = traceback.format_exc().strip().splitlines()[-1]
+        return radar,sTime,eTime,'error',message,[]
+
+    rows = []
+    for sig in signals:
+        row = [radar,sTime.isoformat(),eTime.isoformat()]
+        row = row + [sig[key] for key,dtype in resultColumns[3:]]
+        rows.append(row)
+    return radar,sTime,eTime,status,'',rows
+
+def windowKey(radar,sTime,eTime):
+    """Identifier of a window in the checkpoint file.
+    """
+    return ','.join([radar,sTime.isoformat(),eTime.isoformat()])
+
+def readCheckpoint(outFile):
+    """Read the windows already processed by :func:`runBatch`.
+
+    **Args**:
+        * **outFile** (str): Results file name of the batch.
+    **Returns**:
+        * **done** (dict): status of each finished window, keyed by :func:`windowKey`.
+    """
+    import os
+
+    done = {}
+    if not os.path.exists(outFile+'.done'): return done
+    with open(outFile+'.done') as fl:
+        for line in fl:
+            fields = line.rstrip('\n').split(',')
+            #Skip a line cut short by an interruption.
+            if len(fields) < 5: continue
+            done[','.join(fields[:3])] = fields[3]
+    return done
+
+def runBatch(radars,windows,outFile,nprocs=None,retryErrors=True,**settings):
+    """Run the MUSIC processing chain on every radar and window in a process pool.
+
+    The detected signals of each window are appended to the CSV file outFile as soon as the window is done, and the
+    window is recorded in outFile+'.done' together with its status ('ok', 'nodata' or 'error: message').  Windows
+    already recorded are skipped, so that running the same batch again resumes it.
+
+    **Args**:
+        * **radars** (str or list of str): 3-letter radar codes.
+        * **windows** (list of (datetime.datetime, datetime.datetime)): Windows to process, see :func:`slidingWindows`.
+        * **outFile** (str): Name of the results table.
+        * [**nprocs**] (int or None): Number of processes.  None for one per CPU; 1 runs the windows in this process.
+        * [**retryErrors**] (bool): Run windows which failed in a previous run again.
+        * [**settings**]: Processing settings passed to :func:`runWindow`, see batchDefaults.
+    **Returns**:
+        * **counts** (dict): Number of windows processed in this run with each status.
+    """
+    import os
+    import multiprocessing
+
+    if isinstance(radars,str): radars = [radars]
+
+    done = readCheckpoint(outFile)
+    if retryErrors:
+        done = dict((key,status) for key,status in done.iteritems() if not status.startswith('error'))
+
+    #Drop rows of windows that were not checkpointed before an interruption (or are being retried).
+    header = ','.join([name for name,dtype in resultColumns])+'\n'
+    if os.path.exists(outFile):
+        tmpFile = outFile+'.tmp'
+        with open(outFile) as fIn, open(tmpFile,'w') as fOut:
+            fOut.write(header)
+            for line in fIn:
+                if line == header: continue
+                if ','.join(line.split(',')[:3]) in done: fOut.write(line)
+        os.rename(tmpFile,outFile)
+    else:
+        with open(outFile,'w') as fOut: fOut.write(header)
+
+    jobs = [(radar,wStart,wEnd,settings) for radar in radars for (wStart,wEnd) in windows
+            if windowKey(radar,wStart,wEnd) not in done]
+
+    counts = {}
+    if len(jobs) == 0: return counts
+
+    if nprocs is None: nprocs = multiprocessing.cpu_count()
+    pool = None
+    if nprocs > 1:
+        pool    = multiprocessing.Pool(processes=nprocs)
+        results = pool.imap_unordered(runWindowJob,jobs)
+    else:
+        results = (runWindowJob(job) for job in jobs)
+
+    try:
+        with open(outFile,'a') as fOut, open(outFile+'.done','a') as fDone:
+            for radar,wStart,wEnd,status,message,rows in results:
+                #Rows first, then the checkpoint: the checkpoint marks the window as complete.
+                for row in rows:
+                    fOut.write(','.join([str(row[0]),row[1],row[2]] + ['%.8g' % val for val in row[3:]])+'\n')
+                fOut.flush()
+                os.fsync(fOut.fileno())
+                if status == 'error': status = 'error: '+message.replace(',',';')
+                fDone.write(','.join([windowKey(radar,wStart,wEnd),status,str(len(rows))])+'\n')
+                fDone.flush()
+
+                key = status.split(':')[0]
+                counts[key] = counts.get(key,0) + 1
+                print windowKey(radar,wStart,wEnd)+': '+status+' ('+str(len(rows))+' signals)'
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    return counts
+
+def readBatchResults(outFile):
+    """Read a results table written by :func:`runBatch`.
+
+    **Args**:
+        * **outFile** (str): Name of the results table.
+    **Returns**:
+        * **results** (numpy.recarray): One record per detected signal, with the fields of resultColumns.
+    """
+    rows = []
+    with open(outFile) as fl:
+        fl.readline()
+        for line in fl:
+            fields = line.rstrip('\n').split(',')
+            if len(fields) != len(resultColumns): continue
+            rows.append(tuple(fields))
+
+    results = np.zeros(len(rows),dtype=resultColumns)
+    if len(rows) == 0: return results.view(np.recarray)
+    cols = zip(*rows)
+    for (name,dtype),col in zip(resultColumns,cols):
+        results[name] = np.array(col).astype(dtype)
+    return results.view(np.recarray)
@@ -208,12 +208,6 @@ class fov(object):
                   latE, lonE = calcFieldPnt(siteLat, siteLon, siteAlt*1e-3, 
                             siteBore, bOffEdge[ib], sRangEdge[ig],
                             elevation=tElev, altitude=tAlt, model=model)
-                              
-                  if(coords == 'mag'):
-                      latC, lonC, _ = aacgm.aacgmlib.aacgmConv(
-                        latC,lonC,0.,siteYear,0)
-                      latE, lonE, _ = aacgm.aacgmlib.aacgmConv(
-                        latE,lonE,0.,siteYear,0)
                 else:
                   latC, lonC = nan, nan
                   latE, lonE = nan, nan
@@ -224,6 +218,13 @@ class fov(object):
                 latFull[ib, ig] = latE
                 lonFull[ib, ig] = lonE
         
+        # Convert all cells to magnetic coordinates in one call
+        if(coords == 'mag'):
+            latCenter, lonCenter, _ = aacgm.aacgmConvNp(
+                latCenter, lonCenter, 0., siteYear, 0)
+            latFull, lonFull, _ = aacgm.aacgmConvNp(
+                latFull, lonFull, 0., siteYear, 0)
+
         # Output is...
         self.latCenter= latCenter[:-1,:-1]
         self.lonCenter = lonCenter[:-1,:-1]
@@ -9,12 +9,12 @@ from numpy.distutils.core import setup, Extension
 
 
 # Fortran extensions
-hwm = Extension('hwm07',sources=['models/hwm/apexcord.f90','models/hwm/dwm07b.f90','models/hwm/hwm07e.f90','models/hwm/hwm07.pyf'])
-igrf = Extension("igrf",sources=["models/igrf/igrf11.f90",'models/igrf/igrf11.pyf'])
+hwm = Extension('hwm07',sources=['models/hwm/apexcord.f90','models/hwm/dwm07b.f90','models/hwm/hwm07e.f90','models/hwm/hwm07arr.f90','models/hwm/hwm07.pyf'])
+igrf = Extension("igrf",sources=["models/igrf/igrf11.f90","models/igrf/igrf11arr.f90",'models/igrf/igrf11.pyf'])
 iri = Extension('iri',sources=['models/iri/irisub.for', 'models/iri/irifun.for', 'models/iri/iriflip.for', \
                     'models/iri/iritec.for', 'models/iri/igrf.for', 'models/iri/cira.for', 'models/iri/iridreg.for', \
                     'models/iri/iri.pyf'])
-msis = Extension("msisFort",sources=["models/msis/nrlmsise00_sub.for",'models/msis/nrlmsis.pyf'])
+msis = Extension("msisFort",sources=["models/msis/nrlmsise00_sub.for","models/msis/nrlmsise00_arr.for",'models/msis/nrlmsis.pyf'])
 tsyg = Extension('tsygFort',sources=['models/tsyganenko/T02.f', 'models/tsyganenko/T96.f', \
                     'models/tsyganenko/geopack08.for','models/tsyganenko/geopack08.pyf'])
 
@@ -52,7 +52,7 @@ class mapObj(basemap.Basemap):
     projection='stere', resolution='c', dateTime=None, 
     lat_0=None, lon_0=None, boundinglat=None, width=None, height=None, 
     fillContinents='.8', fillOceans='None', fillLakes=None, coastLineWidth=0., 
-    grid=True, gridLabels=True, showCoords=True, **kwargs):
+    grid=True, gridLabels=True, showCoords=True, aacgmMode='exact', **kwargs):
     """Create empty map 
     
     **Args**:    
@@ -66,6 +66,8 @@ class mapObj(basemap.Basemap):
       * **[coords]**: 'geo'
       * **[showCoords]**: display coordinate system name in upper right corner
       * **[dateTime]** (datetime.datetime): necessary for MLT plots if you want the continents to be plotted
+      * **[aacgmMode]**: 'exact' to convert every point with the full AACGM expansion, 'fast' to interpolate
+        a cached lookup grid (see :mod:`models.aacgm.aacgmGrid`)
       * **[kwargs]**: See <http://tinyurl.com/d4rzmfo> for more keywords
     **Returns**:
       * **map**: a Basemap object (<http://tinyurl.com/d4rzmfo>)
@@ -100,6 +102,10 @@ class mapObj(basemap.Basemap):
       print 'Invalid coordinate system given in coords ({}): setting "geo"'.format(coords)
       coords = 'geo'
     self.coords = coords
+    if aacgmMode not in ['exact', 'fast']:
+      print 'Invalid aacgmMode given ({}): setting "exact"'.format(aacgmMode)
+      aacgmMode = 'exact'
+    self.aacgmMode = aacgmMode
 
     # Set map projection limits and center point depending on hemisphere selection
     if lat_0 is None: 
@@ -167,14 +173,7 @@ class mapObj(basemap.Basemap):
         flag = 0 if trans == 'geo-mag' else 1
         try:
           nx, ny = len(x), len(y)
-          xt = np.array(x)
-          yt = np.array(y)
-          shape = xt.shape    
-          y, x, _ = aacgm.aacgmConvArr(
-            list(yt.flatten()), list(xt.flatten()), [0.]*nx, 
-            self.datetime.year, flag)
-          x = np.array(x).reshape(shape)
-          y = np.array(y).reshape(shape)
+          y, x = self._aacgmConv(y, x, flag)
         except TypeError as e:
           y, x, _ = aacgm.aacgmConv(y, x, 0., 
             self.datetime.year, flag)
@@ -194,14 +193,7 @@ class mapObj(basemap.Basemap):
         if not inverse:
           try:
             nx, ny = len(x), len(y)
-            x = np.array(x)
-            y = np.array(y)
-            shape = x.shape
-            yout, xout, _ = aacgm.aacgmConvArr(
-              list(y.flatten()), list(x.flatten()), [0.]*nx, 
-              self.datetime.year, 0)
-            xout = np.array(xout).reshape(shape)
-            yout = np.array(yout).reshape(shape)
+            yout, xout = self._aacgmConv(y, x, 0)
           except TypeError:
             yout, xout, _ = aacgm.aacgmConv(y, x, 0., 
               self.datetime.year, 0)
@@ -216,6 +208,17 @@ class mapObj(basemap.Basemap):
       callerFile, _, callerName = inspect.getouterframes(inspect.currentframe())[1][1:4]
 
 
+  def _aacgmConv(self, lat, lon, flag):
+    """Convert arrays to (flag=0) or from (flag=1) AACGM at ground level,
+    exactly or from a lookup grid depending on self.aacgmMode"""
+    from models import aacgm
+
+    if getattr(self, 'aacgmMode', 'exact') == 'fast':
+      return aacgm.aacgmConvFast(lat, lon, 0., self.datetime.year, flag)
+    lat, lon, _ = aacgm.aacgmConvNp(lat, lon, 0., self.datetime.year, flag)
+    return lat, lon
+
+
   def _readboundarydata(self, name, as_polygons=False):
     from models import aacgm
     from copy import deepcopy
@@ -223,11 +226,9 @@ class mapObj(basemap.Basemap):
     import numpy as np
 
     if self.coords is 'mag':
-      nPts = len(self._boundarypolyll.boundary[:, 0])
-      lats, lons, _ = aacgm.aacgmConvArr(
-              list(self._boundarypolyll.boundary[:, 1]), 
-              list(self._boundarypolyll.boundary[:, 0]), 
-              [0.]*nPts, self.datetime.year, 1)
+      lats, lons = self._aacgmConv(
+              self._boundarypolyll.boundary[:, 1], 
+              self._boundarypolyll.boundary[:, 0], 1)
       b = np.asarray([lons,lats]).T
       oldgeom = deepcopy(self._boundarypolyll)
       newgeom = _geoslib.Polygon(b).fix()